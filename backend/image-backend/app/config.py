@@ -1,5 +1,5 @@
 import os
-from typing import Set
+from typing import Dict, List, Set
 
 class Settings:
     # 应用配置
@@ -14,11 +14,104 @@ class Settings:
     UPLOAD_DIR: str = "uploads"
     MAX_FILE_SIZE: int = 20 * 1024 * 1024  # 20MB
     ALLOWED_EXTENSIONS: Set[str] = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+    # 上传存储：内容相同的上传只保存一份（UPLOAD_DIR/blobs），original 下的文件为其硬链接
+    UPLOAD_RETENTION_HOURS: float = 168  # original / processed / temp 中文件的保留时长，0表示不按时间清理
+    UPLOAD_QUOTA_MB: int = 10240  # 三个目录的总大小上限（同一内容只计一次），超出时从最早的文件开始删除，0表示不限
+    UPLOAD_JANITOR_INTERVAL_S: float = 600  # 后台清理间隔（秒），0表示不启动清理线程
     
     # 算法配置
     DEFAULT_MODEL: str = "256"
     SIMULATE_PROCESSING_TIME: float = 2.0  # 模拟处理时间（秒）
     # ONNX 模型路径（根据实际模型文件位置调整）
     ONNX_MODEL_PATH: str = "app/models/20251005100417.onnx"
+    # 模型注册表：model 参数 -> ONNX 路径与输入分辨率（整数或 (W, H)）
+    MODELS: Dict[str, Dict] = {
+        "256": {"path": ONNX_MODEL_PATH, "input_size": 256},
+        # "512": {"path": "app/models/pcb_512.onnx", "input_size": 512},
+        # 大图切片推理：同一模型按原始分辨率切成重叠切片，小缺陷不会因整图缩放而丢失
+        # "256-tiled": {"path": ONNX_MODEL_PATH, "input_size": 256, "tiled": True},
+    }
+    # quantize.py 生成的模型清单：通过精度校验的INT8模型，与 MODELS 合并（同名时以 MODELS 为准），文件不存在时忽略
+    # 与 ORT_OPTIMIZED_MODEL_DIR 一样放在运行时目录 cache/ 下（不在源码目录中，已加入 .gitignore）
+    MODELS_MANIFEST: str = "cache/quantized/models.json"
+    MODEL_PRELOAD: List[str] = ["256"]  # 启动时预加载的模型
+    MODEL_MEMORY_LIMIT_MB: int = 2048  # 已加载模型占用内存上限，超出时卸载最久未使用的空闲模型
+    # 无法测量进程内存（非Linux）时模型占用的估算倍数：文件大小 x 该值
+    # （ORT 会话除权重外还持有优化后的计算图与预打包的权重副本，实测约为文件大小的1.5~2.5倍）
+    MODEL_MEMORY_FACTOR: float = 2.0
+    PRINT_MODEL_INFO: bool = False  # 加载模型时打印输入/输出信息
+
+    # 切片推理配置（MODELS 中 "tiled": True 的模型）
+    TILE_MIN_SIZE: int = 1024  # 长边超过该值才切片，否则按整图推理
+    TILE_OVERLAP: int = 32  # 相邻切片重叠的像素数，重叠区热力图加权融合
+    TILE_BATCH_SIZE: int = 8  # 每次 session.run 的切片数（决定切片推理的峰值内存）
+
+    # 启动预热配置（预热完成前 /ready 返回503）
+    WARMUP_ENABLED: bool = True
+    WARMUP_ITERATIONS: int = 2  # 每个批大小的预跑次数
+    WARMUP_BATCH_SIZES: List[int] = []  # 留空则覆盖模型可能出现的全部批大小
+    ANOMALY_THRESHOLD: float = 0.35  # 异常概率大于该值判定为缺陷
+
+    # Gerber参考库配置（预处理张量以内存映射方式复用）
+    GERBER_LIBRARY_DIR: str = "uploads/gerbers"
+    GERBER_CACHE_SIZE: int = 64  # 内存LRU中保留的Gerber数量
+
+    # 检测结果缓存配置（键为查询图哈希、Gerber哈希、模型与判定阈值）
+    RESULT_CACHE_ENABLED: bool = True
+    RESULT_CACHE_MEMORY_MB: int = 128  # 内存层上限
+    RESULT_CACHE_DIR: str = ""  # 磁盘层目录，留空则不启用
+    RESULT_CACHE_DISK_MB: int = 1024  # 磁盘层上限
+
+    # 批量检测任务配置（POST /api/jobs）
+    JOB_DIR: str = "uploads/jobs"  # 上传压缩包的保存目录
+    JOB_CONCURRENCY: int = 0  # 批量任务同时检测的图片对数，0表示与 INFERENCE_WORKERS 相同
+    JOB_MAX_PAIRS: int = 5000  # 单个任务的图片对上限
+    JOB_MAX_ARCHIVE_MB: int = 1024  # 上传压缩包大小上限
+    JOB_MAX_FINISHED: int = 100  # 内存中保留的已结束任务数，超出时清理最早的任务及其文件
+
+    # 请求追踪文件（JSON Lines，记录输入尺寸、模型、各阶段耗时与缓存命中），留空则不写文件
+    TRACE_FILE: str = ""
+    TRACE_FILE_MAX_MB: int = 50  # 单个文件上限，超出后轮转
+    TRACE_FILE_BACKUPS: int = 3  # 保留的历史文件数
+    TRACE_QUEUE_SIZE: int = 10000  # 待写入记录上限，写入跟不上时丢弃新记录
+
+    # 热力图色表（jet / hot / gray / turbo / viridis / inferno / magma）
+    HEATMAP_COLORMAP: str = "jet"
+
+    # 结果图片编码（请求可用 encoding 参数覆盖，格式见 ImageEncoding："png"、"png:6"、"webp:80"、"webp:lossless"、"jpeg:90"）
+    IMAGE_ENCODING: str = "png"
+    PNG_COMPRESS_LEVEL: int = 1  # zlib 级别 0-9：1 比 Pillow 默认的 6 快约3倍，文件约大15%
+    WEBP_QUALITY: int = 80  # 有损 WebP 质量 1-100
+    WEBP_METHOD: int = 0  # WebP 压缩速度 0（最快）-6（最慢、文件最小）
+    JPEG_QUALITY: int = 90  # JPEG 质量 1-95
+
+    # ONNX Runtime 会话配置（线程数为0表示使用ORT默认值）
+    ORT_INTRA_OP_THREADS: int = 0  # 单个算子内部的并行线程数
+    ORT_INTER_OP_THREADS: int = 0  # 算子之间的并行线程数（仅 parallel 模式生效）
+    ORT_EXECUTION_MODE: str = "sequential"  # sequential / parallel
+    ORT_GRAPH_OPTIMIZATION_LEVEL: str = "all"  # disable / basic / extended / all
+    ORT_ENABLE_CPU_MEM_ARENA: bool = True  # CPU内存池
+    ORT_ENABLE_MEM_PATTERN: bool = True  # 按首次运行的内存分配模式预分配
+    ORT_ALLOW_SPINNING: bool = True  # 线程池空闲时自旋等待（低延迟，但空闲时占用CPU）
+    # 优化后计算图的缓存目录，留空则每次启动重新优化；缓存按模型内容、ORT版本与构建、执行提供者、优化级别与CPU指令集区分
+    ORT_OPTIMIZED_MODEL_DIR: str = "cache/optimized"
+
+    # 多进程部署（python -m app.main 启动时生效）：HTTP 工作进程只做解码、预处理与编码，
+    # 独立的推理进程持有 ONNX 会话并跨进程组批，张量经共享内存传递，模型内存不随 HTTP 进程数增加
+    # uvicorn 工作进程数；启动脚本经环境变量传给工作进程（批量任务与上传清理据此判断是否多进程）
+    HTTP_WORKERS: int = int(os.environ.get("HTTP_WORKERS", "1"))
+    INFERENCE_PROCESSES: int = 0  # 推理进程数，0表示在HTTP进程内推理（HTTP_WORKERS > 1 时至少启动1个）
+    INFERENCE_SHM_SLOT_MB: int = 16  # 共享内存槽大小（单次 session.run 的全部输入或输出），放不下时随消息传输
+    # 推理进程地址与认证密钥，由启动脚本通过环境变量传给 HTTP 工作进程，留空表示在本进程内推理
+    INFERENCE_SERVER_ADDRESS: str = os.environ.get("INFERENCE_SERVER_ADDRESS", "")
+    INFERENCE_SERVER_AUTHKEY: str = os.environ.get("INFERENCE_SERVER_AUTHKEY", "")
+
+    # 推理执行器配置
+    INFERENCE_WORKERS: int = max(4, os.cpu_count() or 1)  # 同时执行的推理任务数
+    INFERENCE_QUEUE_SIZE: int = 16  # 排队等待的请求上限，超出返回503
+
+    # 动态组批配置（BATCH_MAX_SIZE 为1时关闭组批；实际批大小不会超过 INFERENCE_WORKERS）
+    BATCH_MAX_SIZE: int = 8  # 单次 session.run 的最大样本数
+    BATCH_MAX_WAIT_MS: float = 5.0  # 队列中已有多个请求时等待凑批的最长时间（单个请求立即执行）
 
 settings = Settings()
\ No newline at end of file
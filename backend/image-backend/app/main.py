@@ -1,6 +1,8 @@
 import sys
 import os
-import uuid
+import asyncio
+import time
+from typing import Optional
 
 # 添加项目根目录到Python路径
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -8,45 +10,31 @@ project_root = os.path.dirname(current_dir)
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
+from app.services.startup_service import startup_service
 from app.config import settings
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse, FileResponse
+
+# 记录主要依赖与应用模块的导入耗时（onnxruntime 推迟到后台加载模型时导入，uvicorn 仅在直接运行时导入）
+startup_service.measure_imports(["numpy", "cv2", "PIL.Image", "fastapi"])
+_app_import_start = time.perf_counter()
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from app.services.image_service import image_service
+from app.services.base64_service import ImageEncoding
+from app.services.inference_executor import InferenceQueueFullError
+from app.services.gerber_library import gerber_library, GerberNotFoundError
 from app.models.schemas import ProcessResponse
-import uvicorn
-from app.services.onnx_service import onnx_service
-
-# 临时导入解决方案（如果file_utils还没创建）
-async def validate_image_file(file: UploadFile):
-    """临时的文件验证函数"""
-    if not file.content_type or not file.content_type.startswith('image/'):
-        raise ValueError("文件必须是图片格式")
-
-    # 计算文件大小（UploadFile 无 .size 属性）
-    content = await file.read()
-    file_size = len(content)
-    if file_size > 10 * 1024 * 1024:  # 10MB
-        raise ValueError("文件大小不能超过10MB")
-
-    # 重置读取指针，后续流程还需要读取内容
-    file.file.seek(0)
-
-    filename = file.filename.lower()
-    if not any(filename.endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.bmp']):
-        raise ValueError("不支持的文件格式")
-
-async def save_upload_file(file: UploadFile, save_dir: str, filename: str) -> str:
-    """临时的文件保存函数"""
-    import aiofiles
-    os.makedirs(save_dir, exist_ok=True)
-    file_path = os.path.join(save_dir, filename)
-    
-    async with aiofiles.open(file_path, 'wb') as f:
-        content = await file.read()
-        await f.write(content)
-    
-    return file_path
+from app.utils.response_utils import (resolve_output_format, build_multipart_response, build_score_response,
+                                      resolve_stream_format, build_stream_response)
+from app.services.model_registry import model_registry
+from app.services import metrics_service
+from app.services import trace_service
+from app.services.job_service import job_service, JobNotFoundError
+from app.models.process_models import JobRequest
+from app.services.upload_store import upload_store
+from app.services.inference_server import inference_client, start_inference_servers
+from app.utils.file_utils import read_image_upload, UploadTooLargeError
+startup_service.record_import("app", _app_import_start)
 
 # 确保上传目录存在
 os.makedirs("uploads/original", exist_ok=True)
@@ -61,109 +49,391 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Request-ID"],
 )
 
-# 启动时加载 ONNX 模型（仅在非重载模式下）
-if not onnx_service.model_loaded:
+# 请求级指标：按路由模板统计延迟、状态码与并发数
+metrics_service.register_callback_metrics(image_service.executor, image_service.result_cache, model_registry)
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    metrics_service.REQUESTS_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
     try:
-        onnx_loaded = onnx_service.load_model(getattr(settings, 'ONNX_MODEL_PATH', None))
-        if not onnx_loaded:
-            print("警告: 未能加载ONNX模型，请检查 settings.ONNX_MODEL_PATH 是否正确")
-    except Exception as e:
-        print(f"加载ONNX模型时出错: {e}")
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics_service.REQUESTS_IN_FLIGHT.dec()
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        metrics_service.REQUEST_DURATION.observe(time.perf_counter() - start, request.method, endpoint)
+        metrics_service.REQUESTS_TOTAL.inc(request.method, endpoint, str(status))
+
+# 请求追踪：每个响应带 X-Request-ID；检测类请求额外带 Server-Timing（各阶段耗时），
+# 配置 TRACE_FILE 时由后台线程写入 JSON Lines 追踪文件
+@app.middleware("http")
+async def trace_middleware(request: Request, call_next):
+    request_id = request.headers.get("x-request-id", "")
+    if not (0 < len(request_id) <= 128 and request_id.isprintable()):
+        request_id = None
+    trace = trace_service.start_trace(request_id)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        total_ms = trace.elapsed_ms()
+        if (trace.stages or trace.info) and trace_service.trace_writer.enabled:
+            route = request.scope.get("route")
+            trace_service.trace_writer.submit({
+                "ts": time.time(),
+                "request_id": trace.request_id,
+                "method": request.method,
+                "endpoint": route.path if route is not None else "unmatched",
+                "status": status,
+                "total_ms": round(total_ms, 3),
+                "stages_ms": {stage: round(ms, 3) for stage, ms in trace.stages.items()},
+                **trace.info,
+            })
+    response.headers["X-Request-ID"] = trace.request_id
+    if trace.stages or trace.info:
+        response.headers["Server-Timing"] = trace.server_timing(total_ms)
+        response.headers["Timing-Allow-Origin"] = "*"
+    return response
+
+# 启动后在后台预加载并预热 MODEL_PRELOAD 中的模型，其余模型在首次请求时加载
+@app.on_event("startup")
+async def startup_event():
+    startup_service.start(model_registry)
+    # 多个工作进程共用同一个上传目录，清理线程只在启动进程中运行（见 __main__）
+    if settings.HTTP_WORKERS <= 1:
+        upload_store.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    job_service.shutdown()
+    upload_store.shutdown()
+    image_service.shutdown()
+    model_registry.shutdown()
+    inference_client.close()
+    trace_service.trace_writer.shutdown()
 
 @app.get("/")
 async def root():
     return {"message": "API服务运行正常", "status": "OK"}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 文本格式指标"""
+    return Response(metrics_service.registry.render(), media_type=metrics_service.MetricsRegistry.CONTENT_TYPE)
+
+@app.get("/ready")
+async def ready():
+    """就绪检查：模型预加载与预热全部完成后返回200，否则503"""
+    status = startup_service.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/api/inference/stats")
+async def inference_stats():
+    """推理执行器与动态组批统计"""
+    return {
+        "executor": image_service.executor.stats(),
+        "models": model_registry.stats(),
+        "gerber_library": gerber_library.stats(),
+        "result_cache": image_service.result_cache.stats() if image_service.result_cache else {"enabled": False},
+        "trace": trace_service.trace_writer.stats(),
+        "jobs": job_service.stats(),
+        "uploads": upload_store.stats(),
+        "inference_server": inference_client.stats(),
+    }
+
+@app.get("/api/models")
+async def list_models():
+    """可用模型及其输入分辨率、加载状态"""
+    return model_registry.stats()
+
 @app.post("/api/upload")
 async def upload_image(file: UploadFile = File(...)):
     """上传并保存图片"""
     try:
-        # 验证文件
-        await validate_image_file(file)
-        
-        # 生成任务ID
-        task_id = str(uuid.uuid4())
-        
-        # 保存原始文件
-        original_filename = f"{task_id}_original{os.path.splitext(file.filename)[1]}"
-        original_path = await save_upload_file(
-            file, 
-            "uploads/original",
-            original_filename
-        )
-        
-        return JSONResponse({
-            "success": True,
-            "task_id": task_id,
-            "message": "图片上传成功",
-            "original_url": f"/api/files/original/{original_filename}",
-            "file_size": os.path.getsize(original_path),
-            "saved_path": original_path
-        })
+        # 分块写入内容寻址存储，边写边校验（大小上限、图片格式），相同内容只保存一份
+        stored = await upload_store.save(file, "original")
+        return _upload_response(stored, "图片上传成功")
         
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
 
+def _upload_response(stored: dict, message: str) -> JSONResponse:
+    return JSONResponse({
+        "success": True,
+        "task_id": stored["task_id"],
+        "message": message,
+        "original_url": f"/api/files/original/{stored['filename']}",
+        "file_size": stored["size"],
+        "saved_path": stored["path"],
+        "sha256": stored["sha256"],
+        "deduplicated": stored["deduplicated"]
+    })
+
 @app.get("/api/files/{file_type}/{filename}")
 async def get_file(file_type: str, filename: str):
     """获取文件"""
     if file_type not in ["original", "processed"]:
         raise HTTPException(status_code=400, detail="无效的文件类型")
     
-    file_path = f"uploads/{file_type}/{filename}"
+    file_path = os.path.join(settings.UPLOAD_DIR, file_type, os.path.basename(filename))
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="文件不存在")
     
     return FileResponse(file_path)
 
-# 同时上传两张图并进行处理
+# 同时上传两张图并进行处理（也可用 gerber_id 引用已注册的Gerber）
 @app.post("/api/process", response_model=ProcessResponse)
-async def process_images(query: UploadFile = File(...), gerber: UploadFile = File(...), model: str = "256"):
+async def process_images(
+    request: Request,
+    query: UploadFile = File(...),
+    gerber: Optional[UploadFile] = File(None),
+    gerber_id: Optional[str] = Form(None),
+    model: Optional[str] = Form(None),
+    model_query: Optional[str] = Query(None, alias="model"),
+    output_format: Optional[str] = Query(None, alias="format", description="json（默认）/ binary / score"),
+    encoding: Optional[str] = Query(None, description="结果图片编码：png[:0-9] / webp[:1-100|lossless] / jpeg[:1-95]，默认 IMAGE_ENCODING")
+):
     try:
-        # 校验两个文件
-        await validate_image_file(query)
-        await validate_image_file(gerber)
+        # 输出格式：显式 format 参数优先，其次 Accept: multipart/mixed
+        fmt = resolve_output_format(output_format, request.headers.get("accept"))
+        image_encoding = ImageEncoding.parse(encoding)
+
+        # 模型可放在表单（前端）或查询参数中
+        model = model or model_query or settings.DEFAULT_MODEL
 
-        # 读取二进制并转base64
-        query_bytes = await query.read()
-        gerber_bytes = await gerber.read()
+        if (gerber is None) == (gerber_id is None):
+            raise ValueError("请上传Gerber图片或提供 gerber_id（二选一）")
 
-        import base64
-        query_b64 = base64.b64encode(query_bytes).decode("utf-8")
-        gerber_b64 = base64.b64encode(gerber_bytes).decode("utf-8")
+        # 分块读取并按文件内容校验，读到的缓冲区直接交给字节版本处理流程（不再重复读取，无需Base64往返）
+        query_bytes, _ = await read_image_upload(query)
+        gerber_bytes = (await read_image_upload(gerber))[0] if gerber is not None else None
 
-        # 调用服务进行处理
-        result = await image_service.process_pcb_images(query_b64, gerber_b64, model)
-        return result
+        # 调用服务进行处理（仅需分数时跳过图片生成与编码）
+        result = await image_service.inspect_pcb_bytes(
+            query_bytes, gerber_bytes, model, include_images=(fmt != "score"), gerber_id=gerber_id,
+            encoding=image_encoding
+        )
+        if fmt == "binary":
+            return build_multipart_response(result)
+        if fmt == "score":
+            return build_score_response(result)
+        return image_service.to_process_response(result)
+    except InferenceQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except GerberNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Gerber不存在: {gerber_id}")
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
 
-# 额外的两个单文件上传接口，分别用于上传查询图与Gerber图
-@app.post("/api/upload/query")
-async def upload_query_image(file: UploadFile = File(...)):
+# 流式检测：多对图片逐对完成即输出一条记录（NDJSON 或 SSE），最后输出汇总
+@app.post("/api/process/stream")
+async def process_stream(
+    request: JobRequest,
+    http_request: Request,
+    stream_format: Optional[str] = Query(None, alias="format", description="ndjson（默认）/ sse"),
+    images: bool = Query(False, description="是否生成结果图片并在记录中返回URL"),
+    encoding: Optional[str] = Query(None, description="结果图片编码：png[:0-9] / webp[:1-100|lossless] / jpeg[:1-95]，默认 IMAGE_ENCODING"),
+):
+    pairs = []
+    for index, pair in enumerate(request.pairs, start=1):
+        if (pair.gerberImage is None) == (pair.gerberId is None):
+            raise HTTPException(status_code=400, detail=f"第{index}对: gerberImage 与 gerberId 需且仅需提供一个")
+        pairs.append({
+            "name": pair.name or f"pair_{index}",
+            "query_image": pair.queryImage,
+            "gerber_image": pair.gerberImage,
+            "gerber_id": pair.gerberId,
+        })
     try:
-        await validate_image_file(file)
-        task_id = str(uuid.uuid4())
-        original_filename = f"{task_id}_query{os.path.splitext(file.filename)[1]}"
-        original_path = await save_upload_file(
-            file,
-            "uploads/original",
-            original_filename
-        )
+        fmt = resolve_stream_format(stream_format, http_request.headers.get("accept"))
+        records = job_service.stream(request.model or settings.DEFAULT_MODEL, pairs, include_images=images,
+                                     encoding=ImageEncoding.parse(encoding))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return build_stream_response(records, fmt)
+
+@app.post("/api/process/stream/archive")
+async def process_stream_archive(
+    http_request: Request,
+    archive: UploadFile = File(..., description="zip压缩包：X.jpg 与 XG.jpg 配对，或包含 manifest.csv"),
+    model: Optional[str] = Form(None),
+    stream_format: Optional[str] = Query(None, alias="format", description="ndjson（默认）/ sse"),
+    images: bool = Query(False, description="是否生成结果图片并在记录中返回URL"),
+    encoding: Optional[str] = Query(None, description="结果图片编码：png[:0-9] / webp[:1-100|lossless] / jpeg[:1-95]，默认 IMAGE_ENCODING"),
+):
+    stream_id = job_service.new_job_id()
+    try:
+        fmt = resolve_stream_format(stream_format, http_request.headers.get("accept"))
+        image_encoding = ImageEncoding.parse(encoding)
+        path = await asyncio.to_thread(job_service.save_archive, stream_id, archive.file)
+        pairs = await asyncio.to_thread(job_service.pairs_from_archive, path)
+        records = job_service.stream(model or settings.DEFAULT_MODEL, pairs, archive_path=path,
+                                     include_images=images, stream_id=stream_id, encoding=image_encoding)
+    except ValueError as e:
+        job_service.discard_archive(stream_id)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        job_service.discard_archive(stream_id)
+        raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
+    return build_stream_response(records, fmt)
+
+# Gerber参考库：注册一次，后续处理请求通过 gerber_id 引用
+@app.post("/api/gerbers")
+async def register_gerber(file: UploadFile = File(...)):
+    try:
+        data, _ = await read_image_upload(file)
+        entry = await image_service.register_gerber(data, file.filename)
         return JSONResponse({
             "success": True,
-            "task_id": task_id,
-            "message": "查询图上传成功",
-            "original_url": f"/api/files/original/{original_filename}",
-            "file_size": os.path.getsize(original_path),
-            "saved_path": original_path
+            "message": "Gerber注册成功",
+            **entry.info()
         })
+    except InferenceQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"注册失败: {str(e)}")
+
+@app.get("/api/gerbers/{gerber_id}")
+async def get_gerber(gerber_id: str):
+    try:
+        entry = await image_service.executor.run(gerber_library.get, gerber_id)
+    except GerberNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Gerber不存在: {gerber_id}")
+    return entry.info()
+
+@app.delete("/api/gerbers/{gerber_id}")
+async def delete_gerber(gerber_id: str):
+    try:
+        gerber_library.delete(gerber_id)
+    except GerberNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Gerber不存在: {gerber_id}")
+    return {"success": True, "gerber_id": gerber_id, "message": "Gerber已删除"}
+
+# 批量检测任务：提交压缩包或Base64清单后立即返回任务ID，后台并行检测，轮询进度并下载汇总
+def _require_single_worker():
+    """任务状态保存在处理提交的工作进程内存中，多个HTTP工作进程时后续查询可能落到其他进程，不提供任务接口"""
+    if settings.HTTP_WORKERS > 1:
+        raise HTTPException(status_code=501, detail="多HTTP工作进程部署不支持批量任务接口，请使用 /api/process/stream")
+
+@app.post("/api/jobs", status_code=202)
+async def create_job(
+    archive: UploadFile = File(..., description="zip压缩包：X.jpg 与 XG.jpg 配对，或包含 manifest.csv"),
+    model: Optional[str] = Form(None),
+):
+    _require_single_worker()
+    job_id = job_service.new_job_id()
+    try:
+        model = model or settings.DEFAULT_MODEL
+        path = await asyncio.to_thread(job_service.save_archive, job_id, archive.file)
+        pairs = await asyncio.to_thread(job_service.pairs_from_archive, path)
+        job = job_service.submit(job_id, model, pairs, archive_path=path)
+    except ValueError as e:
+        job_service.discard_archive(job_id)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        job_service.discard_archive(job_id)
+        raise HTTPException(status_code=500, detail=f"任务提交失败: {str(e)}")
+    return _job_created(job)
+
+@app.post("/api/jobs/json", status_code=202)
+async def create_job_json(request: JobRequest):
+    _require_single_worker()
+    pairs = []
+    for index, pair in enumerate(request.pairs, start=1):
+        if (pair.gerberImage is None) == (pair.gerberId is None):
+            raise HTTPException(status_code=400, detail=f"第{index}对: gerberImage 与 gerberId 需且仅需提供一个")
+        pairs.append({
+            "name": pair.name or f"pair_{index}",
+            "query_image": pair.queryImage,
+            "gerber_image": pair.gerberImage,
+            "gerber_id": pair.gerberId,
+        })
+    try:
+        job = job_service.submit(job_service.new_job_id(), request.model or settings.DEFAULT_MODEL, pairs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _job_created(job)
+
+def _job_created(job) -> JSONResponse:
+    return JSONResponse({
+        "success": True,
+        "job_id": job.job_id,
+        "status": job.status,
+        "total": len(job.pairs),
+        "status_url": f"/api/jobs/{job.job_id}",
+        "summary_url": f"/api/jobs/{job.job_id}/summary",
+    }, status_code=202)
+
+@app.get("/api/jobs")
+async def list_jobs():
+    _require_single_worker()
+    return {"jobs": job_service.list_jobs()}
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=0)):
+    """任务进度与已完成的部分结果（results 按输入顺序，可用 offset/limit 分页）"""
+    _require_single_worker()
+    try:
+        return job_service.get(job_id).info(offset, limit)
+    except JobNotFoundError:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+
+@app.get("/api/jobs/{job_id}/summary")
+async def get_job_summary(job_id: str, output_format: str = Query("csv", alias="format", description="csv / json")):
+    """逐对的分数与描述；任务未结束时未完成的图片对状态为 pending"""
+    _require_single_worker()
+    try:
+        job = job_service.get(job_id)
+    except JobNotFoundError:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    if output_format == "json":
+        return job.info()
+    if output_format != "csv":
+        raise HTTPException(status_code=400, detail="format 仅支持 csv / json")
+    return Response(
+        content=job.summary_csv(),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="job_{job_id}_summary.csv"'},
+    )
+
+@app.delete("/api/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """取消（如仍在运行）并删除任务"""
+    _require_single_worker()
+    try:
+        job_service.delete(job_id)
+    except JobNotFoundError:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return {"success": True, "job_id": job_id, "message": "任务已删除"}
+
+# 额外的两个单文件上传接口，分别用于上传查询图与Gerber图
+@app.post("/api/upload/query")
+async def upload_query_image(file: UploadFile = File(...)):
+    try:
+        stored = await upload_store.save(file, "query")
+        return _upload_response(stored, "查询图上传成功")
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -172,35 +442,35 @@ async def upload_query_image(file: UploadFile = File(...)):
 @app.post("/api/upload/gerber")
 async def upload_gerber_image(file: UploadFile = File(...)):
     try:
-        await validate_image_file(file)
-        task_id = str(uuid.uuid4())
-        original_filename = f"{task_id}_gerber{os.path.splitext(file.filename)[1]}"
-        original_path = await save_upload_file(
-            file,
-            "uploads/original",
-            original_filename
-        )
-        return JSONResponse({
-            "success": True,
-            "task_id": task_id,
-            "message": "Gerber图上传成功",
-            "original_url": f"/api/files/original/{original_filename}",
-            "file_size": os.path.getsize(original_path),
-            "saved_path": original_path
-        })
+        stored = await upload_store.save(file, "gerber")
+        return _upload_response(stored, "Gerber图上传成功")
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
 
 if __name__ == "__main__":
+    import uvicorn
+
     print(f"启动服务: http://{settings.HOST}:{settings.PORT}")
     print("按 Ctrl+C 停止服务")
     
+    # 多个HTTP工作进程共用推理进程中的模型，避免每个工作进程各加载一份
+    if settings.INFERENCE_PROCESSES > 0 or settings.HTTP_WORKERS > 1:
+        start_inference_servers(max(1, settings.INFERENCE_PROCESSES))
+        print(f"🧠 推理进程: {max(1, settings.INFERENCE_PROCESSES)} 个，HTTP工作进程: {settings.HTTP_WORKERS} 个")
+    if settings.HTTP_WORKERS > 1:
+        os.environ["HTTP_WORKERS"] = str(settings.HTTP_WORKERS)
+        # 上传目录清理只在启动进程中运行一份，工作进程不再各自启动
+        upload_store.start()
+    
     uvicorn.run(
         "app.main:app",
         host=settings.HOST, 
         port=settings.PORT, 
         reload=False,  # 生产环境建议关闭热重载以避免ONNX模型重复加载
+        workers=settings.HTTP_WORKERS,
         log_level="info"
     )
\ No newline at end of file
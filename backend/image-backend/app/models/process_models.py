@@ -1,11 +1,21 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 
 class ProcessRequest(BaseModel):
     queryImage: str  # Base64编码的查询图片
     gerberImage: str  # Base64编码的Gerber图片
     model: str = "256"  # 模型参数，默认值256
 
+class JobPair(BaseModel):
+    name: Optional[str] = None  # 图片对名称（汇总中的标识），默认按序号命名
+    queryImage: str  # Base64编码的查询图片
+    gerberImage: Optional[str] = None  # Base64编码的Gerber图片
+    gerberId: Optional[str] = None  # 已注册Gerber的ID（与 gerberImage 二选一）
+
+class JobRequest(BaseModel):
+    pairs: List[JobPair]  # 待检测的图片对
+    model: Optional[str] = None  # 模型参数，默认 settings.DEFAULT_MODEL
+
 class ProcessResponse(BaseModel):
     convertedGerber: str  # Base64编码的处理后Gerber图片
     anomalyImage: str  # Base64编码的异常图片
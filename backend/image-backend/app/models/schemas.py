@@ -6,7 +6,9 @@ class ProcessResponse(BaseModel):
     anomalyImage: str     # base64-encoded image
     anomalyScore: float
     defectDescription: str
+    imageFormat: str = "png"  # png / webp / jpeg
 
 
-
-
+class ProcessScoreResponse(BaseModel):
+    anomalyScore: float
+    defectDescription: str
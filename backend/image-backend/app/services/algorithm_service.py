@@ -1,90 +1,104 @@
-from PIL import Image, ImageChops
-from typing import Dict
+from PIL import Image
+from typing import Dict, Tuple, Union
+import time
+import cv2
 import numpy as np
-from app.services.onnx_service import onnx_service
+from app.services.model_registry import model_registry
+from app.services.gerber_library import GerberEntry
+from app.services.metrics_service import stage_timer, observe_stage
 
 
 class AlgorithmService:
-    def process_images(self, query_image: Image.Image, gerber_image: Image.Image, model: str) -> Dict:
-        # 将 PIL 转为 numpy RGB 数组
-        query_rgb = query_image.convert("RGB")
-        gerber_rgb = gerber_image.convert("RGB")
-        query_np = np.array(query_rgb)
-        gerber_np = np.array(gerber_rgb)
-
-        # 运行 ONNX 推理
-        if not onnx_service.model_loaded:
-            raise RuntimeError("ONNX 模型未加载，请检查启动日志或模型路径配置")
-
-        raw_outputs = onnx_service.run_inference(query_np, gerber_np)
-        parsed = onnx_service.parse_results(raw_outputs)
+    def process_images(self, query_image: Union[np.ndarray, Image.Image],
+                       gerber_image: Union[np.ndarray, Image.Image, GerberEntry], model: str,
+                       include_images: bool = True, query_input: np.ndarray = None,
+                       gerber_input: np.ndarray = None) -> Dict:
+        """
+        执行推理并生成可视化结果
+
+        query_image / gerber_image 通常为解码好的 RGB uint8 数组（仅计算分数时可能是缩小解码的结果），
+        也接受 PIL 图片。gerber_image 为 GerberEntry（已注册的Gerber）时直接使用其预处理张量，
+        跳过Gerber的解码与预处理。include_images 为 False 时只计算异常分数与缺陷描述，跳过风格图与热力图的生成，
+        返回结果中的 converted_image / anomaly_image 为 None。
+
+        query_input / gerber_input 为送入模型的图片（按模型输入尺寸缩小解码的结果，见
+        Base64Service.bytes_to_arrays），为空时使用 query_image / gerber_image，提供时
+        query_image / gerber_image 只用于结果图。切片推理始终使用原分辨率图片。
+
+        后处理全部在 NumPy 数组上完成，converted_image / anomaly_image 为 RGB uint8 数组。
+        query_image 为可写数组时视为归本次调用所有：热力图直接叠加在其上（anomaly_image 即该数组），
+        调用方不应再使用原查询图内容。
+        """
+        # 统一为 RGB uint8 数组（ImageService 已直接解码为数组，不再经过 PIL 转换）
+        query_np = self._rgb_array(query_image)
 
-        # 生成可视化结果：
-        # 1) converted_image：优先使用 style_output（若有），否则回退为 gerber 对齐图
-        if "style_transfer" in parsed and "data" in parsed["style_transfer"]:
-            style_data = parsed["style_transfer"]["data"]
-            # 检查输出形状，确保是 [C, H, W] 格式
-            if style_data.ndim == 3 and style_data.shape[0] in (1, 3):
-                # 已经是 CHW 格式，直接使用反归一化
-                style_img = onnx_service.denormalize_image(style_data)
-                converted_image = Image.fromarray(style_img)
-            elif style_data.ndim == 3 and style_data.shape[2] in (1, 3):
-                # 是 HWC 格式，需要转换为 CHW 再反归一化
-                style_chw = np.transpose(style_data, (2, 0, 1))
-                style_img = onnx_service.denormalize_image(style_chw)
-                converted_image = Image.fromarray(style_img)
+        # 运行 ONNX 推理（按 model 参数从注册表取模型，推理期间不会被卸载）
+        with model_registry.acquire(model) as onnx_service:
+            if onnx_service.tiled:
+                # 切片推理需要全分辨率的Gerber原图（已注册的Gerber此时才解码原图）
+                gerber_np = self._gerber_array(gerber_image)
+                raw_outputs = onnx_service.run_tiled_inference(query_np, gerber_np, include_style=include_images)
             else:
-                # 其他情况，使用简单归一化作为回退
-                style_min = float(style_data.min())
-                style_max = float(style_data.max())
-                denom = (style_max - style_min) if (style_max - style_min) > 1e-6 else 1.0
-                style_norm = (style_data - style_min) / denom
-                style_img = (np.clip(style_norm, 0.0, 1.0) * 255.0).astype(np.uint8)
-                converted_image = Image.fromarray(style_img)
-        else:
-            # 回退：使用尺寸对齐后的 gerber 图
-            width = min(query_rgb.width, gerber_rgb.width)
-            height = min(query_rgb.height, gerber_rgb.height)
-            converted_image = gerber_rgb.resize((width, height))
-
-        # 2) anomaly_image：优先使用 anomaly_mask 创建彩色热力图叠加（若有），否则用两图差异
-        if "anomaly_mask" in parsed and "data" in parsed["anomaly_mask"]:
-            mask = parsed["anomaly_mask"]["data"]
-            # 处理不同维度的掩码
-            if mask.ndim == 3 and mask.shape[0] == 1:
-                mask_2d = mask[0]
-            elif mask.ndim == 2:
-                mask_2d = mask
+                query_model = query_np if query_input is None else self._rgb_array(query_input)
+                if isinstance(gerber_image, GerberEntry):
+                    raw_outputs = onnx_service.run_inference(query_model, gerber_tensor=gerber_image.tensor)
+                else:
+                    gerber_model = gerber_image if gerber_input is None else gerber_input
+                    raw_outputs = onnx_service.run_inference(query_model, self._rgb_array(gerber_model))
+        # 后处理：解析输出、生成风格图与热力图（不含PNG编码）
+        postprocess_start = time.perf_counter()
+        parsed = onnx_service.parse_results(raw_outputs)
+
+        converted_image = None
+        anomaly_image = None
+        if include_images and isinstance(gerber_image, GerberEntry) and not (
+                "style_transfer" in parsed and "anomaly_mask" in parsed):
+            # 回退路径需要Gerber原图：已注册的Gerber此时才解码，本次调用内只解码一次
+            gerber_image = gerber_image.decode_image()
+        if include_images:
+            # 生成可视化结果（均为 RGB uint8 数组，直接交给编码器）：
+            # 1) converted_image：优先使用 style_output（若有），否则回退为 gerber 对齐图
+            if "style_transfer" in parsed and "data" in parsed["style_transfer"]:
+                style_data = parsed["style_transfer"]["data"]
+                # 检查输出形状，确保是 [C, H, W] 格式
+                if style_data.ndim == 3 and style_data.shape[0] in (1, 3):
+                    # 已经是 CHW 格式，直接使用反归一化
+                    converted_image = onnx_service.denormalize_image(style_data)
+                elif style_data.ndim == 3 and style_data.shape[2] in (1, 3):
+                    # 是 HWC 格式，转为 CHW 视图再反归一化
+                    converted_image = onnx_service.denormalize_image(np.transpose(style_data, (2, 0, 1)))
+                else:
+                    # 其他情况，使用简单归一化作为回退
+                    style_min = float(style_data.min())
+                    style_max = float(style_data.max())
+                    denom = (style_max - style_min) if (style_max - style_min) > 1e-6 else 1.0
+                    style_norm = (style_data - style_min) / denom
+                    converted_image = (np.clip(style_norm, 0.0, 1.0) * 255.0).astype(np.uint8)
             else:
-                # 如果形状不符合预期，尝试取第一个通道
-                mask_2d = mask.reshape(-1, mask.shape[-1]) if mask.ndim > 2 else mask
-            
-            # 调整掩码尺寸到查询图像尺寸
-            query_size = (query_rgb.height, query_rgb.width)
-            mask_resized = onnx_service.resize_mask_to_image(mask_2d, query_size)
-            
-            # 创建彩色热力图叠加图像
-            query_array = np.array(query_rgb)
-            overlay = onnx_service.create_heatmap_overlay(query_array, mask_resized)
-            anomaly_image = Image.fromarray(overlay)
-        else:
-            # 回退：使用像素差异（转换为彩色显示）
-            width = min(query_rgb.width, gerber_rgb.width)
-            height = min(query_rgb.height, gerber_rgb.height)
-            q = query_rgb.resize((width, height))
-            g = gerber_rgb.resize((width, height))
-            diff = ImageChops.difference(q, g)
-            # 将差异图像转换为彩色显示（使用红色通道突出差异）
-            diff_array = np.array(diff)
-            if len(diff_array.shape) == 2:  # 如果是灰度图
-                # 创建彩色差异图：红色通道显示差异
-                colored_diff = np.zeros((diff_array.shape[0], diff_array.shape[1], 3), dtype=np.uint8)
-                colored_diff[:, :, 0] = diff_array  # 红色通道
-                colored_diff[:, :, 1] = diff_array // 2  # 绿色通道（较暗）
-                colored_diff[:, :, 2] = diff_array // 2  # 蓝色通道（较暗）
-                anomaly_image = Image.fromarray(colored_diff)
+                # 回退：使用尺寸对齐后的 gerber 图
+                _, converted_image = self._aligned_pair(query_np, gerber_image)
+
+            # 2) anomaly_image：优先使用 anomaly_mask 创建彩色热力图叠加（若有），否则用两图差异
+            if "anomaly_mask" in parsed and "data" in parsed["anomaly_mask"]:
+                mask = parsed["anomaly_mask"]["data"]
+                # 处理不同维度的掩码
+                if mask.ndim == 3 and mask.shape[0] == 1:
+                    mask_2d = mask[0]
+                elif mask.ndim == 2:
+                    mask_2d = mask
+                else:
+                    # 如果形状不符合预期，尝试取第一个通道
+                    mask_2d = mask.reshape(-1, mask.shape[-1]) if mask.ndim > 2 else mask
+
+                # 模型分辨率的掩码在渲染时放大到查询图尺寸；查询图数组归本请求所有时原地叠加，
+                # 不再分配整图大小的输出缓冲
+                out = query_np if query_np.flags.writeable else None
+                with stage_timer("heatmap"):
+                    anomaly_image = onnx_service.create_heatmap_overlay(query_np, mask_2d, out=out)
             else:
-                anomaly_image = diff
+                # 回退：两图逐像素差异
+                query_aligned, gerber_aligned = self._aligned_pair(query_np, gerber_image)
+                anomaly_image = cv2.absdiff(query_aligned, gerber_aligned)
 
         # 3) anomaly_score 与缺陷描述
         anomaly_score = 0.0
@@ -98,6 +112,7 @@ class AlgorithmService:
         else:
             defect_description = "模型未返回缺陷检测结果"
 
+        observe_stage("postprocess", time.perf_counter() - postprocess_start)
         return {
             "converted_image": converted_image,
             "anomaly_image": anomaly_image,
@@ -105,6 +120,34 @@ class AlgorithmService:
             "defect_description": defect_description,
         }
 
+    def _gerber_array(self, gerber_image: Union[np.ndarray, Image.Image, GerberEntry]) -> np.ndarray:
+        """回退路径与切片推理才需要Gerber原图，已注册的Gerber此时才解码"""
+        if isinstance(gerber_image, GerberEntry):
+            gerber_image = gerber_image.decode_image()
+        return self._rgb_array(gerber_image)
+
+    def _aligned_pair(self, query_np: np.ndarray, gerber_image) -> Tuple[np.ndarray, np.ndarray]:
+        """查询图与Gerber图缩放到两者较小的宽高（回退路径使用）"""
+        gerber_np = self._gerber_array(gerber_image)
+        width = min(query_np.shape[1], gerber_np.shape[1])
+        height = min(query_np.shape[0], gerber_np.shape[0])
+
+        def fit(image: np.ndarray) -> np.ndarray:
+            if image.shape[:2] == (height, width):
+                return image
+            return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+        return fit(query_np), fit(gerber_np)
+
+    @staticmethod
+    def _rgb_array(image: Union[np.ndarray, Image.Image]) -> np.ndarray:
+        """RGB uint8 数组 [H, W, 3]；已是数组时原样返回（不复制）"""
+        if isinstance(image, np.ndarray):
+            return image
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return np.asarray(image)
+
 
 algorithm_service = AlgorithmService()
 
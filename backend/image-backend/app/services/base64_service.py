@@ -1,15 +1,143 @@
 import base64
 import io
+import cv2
+import numpy as np
 from PIL import Image
+from typing import Optional, Tuple, Union
+from app.config import settings
+
+
+class ImageEncoding:
+    """
+    结果图片的编码格式与参数
+
+    文本形式为 "格式[:参数]"（不区分大小写）：
+        png[:0-9]             PNG，参数为 zlib 压缩级别（默认 PNG_COMPRESS_LEVEL）
+        webp[:1-100]          有损 WebP，参数为质量（默认 WEBP_QUALITY）
+        webp:lossless         无损 WebP
+        jpeg[:1-95] / jpg     JPEG，参数为质量（默认 JPEG_QUALITY）
+    """
+
+    FORMATS = ("png", "webp", "jpeg")
+    _RANGES = {"png": (0, 9), "webp": (1, 100), "jpeg": (1, 95)}
+
+    def __init__(self, format: str = "png", level: Optional[int] = None, lossless: bool = False):
+        self.format = format
+        self.lossless = lossless
+        if level is None and not lossless:
+            level = {"png": settings.PNG_COMPRESS_LEVEL, "webp": settings.WEBP_QUALITY,
+                     "jpeg": settings.JPEG_QUALITY}[format]
+        self.level = level
+
+    @classmethod
+    def parse(cls, text: Optional[str] = None) -> "ImageEncoding":
+        """解析编码参数，为空时使用 settings.IMAGE_ENCODING；无效时抛出 ValueError"""
+        text = (text or settings.IMAGE_ENCODING).strip().lower()
+        name, _, option = text.partition(":")
+        name = "jpeg" if name == "jpg" else name
+        if name not in cls.FORMATS:
+            raise ValueError(f"不支持的图片编码: {name}，可选: {', '.join(cls.FORMATS)}")
+        if not option:
+            return cls(name)
+        if name == "webp" and option == "lossless":
+            return cls(name, lossless=True)
+        low, high = cls._RANGES[name]
+        if not option.isdigit() or not low <= int(option) <= high:
+            raise ValueError(f"无效的 {name} 编码参数: {option}，应为 {low}-{high}"
+                             + ("或 lossless" if name == "webp" else ""))
+        return cls(name, int(option))
+
+    @property
+    def media_type(self) -> str:
+        return f"image/{self.format}"
+
+    @property
+    def extension(self) -> str:
+        return "jpg" if self.format == "jpeg" else self.format
+
+    def save_options(self) -> dict:
+        """PIL Image.save 的参数"""
+        if self.format == "png":
+            return {"format": "PNG", "compress_level": self.level}
+        if self.format == "webp":
+            if self.lossless:
+                return {"format": "WEBP", "lossless": True, "method": settings.WEBP_METHOD}
+            return {"format": "WEBP", "quality": self.level, "method": settings.WEBP_METHOD}
+        return {"format": "JPEG", "quality": self.level}
+
+    def __str__(self) -> str:
+        return f"{self.format}:{'lossless' if self.lossless else self.level}"
+
+
+class _BufferReader(io.RawIOBase):
+    """
+    只读、可定位的内存文件，直接引用 bytes / bytearray / memoryview
+
+    io.BytesIO 会复制 bytearray（上传内容），PIL 解析文件头时用它避免多一份整图字节。
+    """
+
+    def __init__(self, data):
+        super().__init__()
+        self._view = memoryview(data).cast("B")
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = min(len(buffer), len(self._view) - self._pos)
+        if count <= 0:
+            return 0
+        buffer[:count] = self._view[self._pos:self._pos + count]
+        self._pos += count
+        return count
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self):
+        self._view.release()
+        super().close()
 
 
 class Base64Service:
     def image_to_base64(self, image: Image.Image, format: str = "PNG") -> str:
+        return self.bytes_to_base64(self.image_to_bytes(image, format))
+
+    def image_to_bytes(self, image: Union[Image.Image, np.ndarray], format: str = "PNG") -> bytes:
+        if isinstance(image, np.ndarray):
+            # 连续的 uint8 数组由 PIL 直接引用其内存，不复制
+            image = Image.fromarray(image)
         buffer = io.BytesIO()
         image.save(buffer, format=format)
-        return base64.b64encode(buffer.getvalue()).decode("utf-8")
+        return buffer.getvalue()
+
+    def encode(self, image: Union[Image.Image, np.ndarray], encoding: ImageEncoding) -> bytes:
+        """按 encoding 编码结果图片（PIL 编码时释放GIL，两张结果图可在线程池中并行编码）"""
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        buffer = io.BytesIO()
+        image.save(buffer, **encoding.save_options())
+        return buffer.getvalue()
+
+    def bytes_to_base64(self, data: bytes) -> str:
+        return base64.b64encode(data).decode("utf-8")
 
     def base64_to_image(self, b64_str: str) -> Image.Image:
+        return self.bytes_to_image(self.base64_to_bytes(b64_str))
+
+    def base64_to_bytes(self, b64_str: str) -> bytes:
         # 兼容 data URL 与纯 base64 两种输入
         if b64_str.startswith("data:"):
             try:
@@ -17,9 +145,77 @@ class Base64Service:
             except Exception:
                 raise ValueError("无效的Base64数据URL格式")
         b64_str = b64_str.strip()
-        data = base64.b64decode(b64_str)
+        return base64.b64decode(b64_str)
+
+    def bytes_to_image(self, data) -> Image.Image:
+        # 直接解码原始字节（bytes / bytearray / memoryview），multipart上传无需经过Base64
         return Image.open(io.BytesIO(data)).convert("RGB")
 
+    def base64_to_array(self, b64_str: str, min_size: Tuple[int, int] = None) -> Tuple[np.ndarray, Tuple[int, int]]:
+        return self.bytes_to_array(self.base64_to_bytes(b64_str), min_size)
+
+    def bytes_to_array(self, data, min_size: Tuple[int, int] = None) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """
+        直接解码为 RGB uint8 数组 [H, W, 3]，同时返回原图尺寸 (W, H)
+
+        min_size (W, H) 不为空表示只需要不小于该尺寸的图像（如仅计算分数时只需模型输入）：
+        JPEG 利用 DCT 缩放按 1/2、1/4、1/8 分辨率解码，解码后两边仍不小于 min_size；
+        其他格式无法缩小解码，仍按原分辨率解码。
+
+        返回的数组由 cv2.imdecode 直接分配、归调用方所有（可写），后处理可在其上原地叠加热力图；
+        文件头由 PIL 解析（不解码像素，也不复制 data），OpenCV 无法解码的格式回退到 PIL。
+        """
+        image = Image.open(_BufferReader(data))
+        return self._decode(data, image, self._reduced_flag_for(image, min_size)), image.size
+
+    def base64_to_arrays(self, b64_str: str, input_size: Optional[Tuple[int, int]],
+                         full: bool = True) -> Tuple[Optional[np.ndarray], np.ndarray, Tuple[int, int]]:
+        return self.bytes_to_arrays(self.base64_to_bytes(b64_str), input_size, full)
+
+    def bytes_to_arrays(self, data, input_size: Optional[Tuple[int, int]],
+                        full: bool = True) -> Tuple[Optional[np.ndarray], np.ndarray, Tuple[int, int]]:
+        """
+        解码为 (原分辨率数组, 模型输入用数组, 原图尺寸 (W, H))
+
+        模型输入用数组始终是 bytes_to_array(data, input_size) 的结果，与是否需要结果图无关：
+        仅分数请求与完整请求送入模型的像素完全相同，分数与缺陷判定一致。
+        full 为 True 时另按原分辨率解码一次（热力图叠加与回退路径使用）；无法缩小解码时
+        （非 JPEG、图片不够大或 input_size 为 None）两者为同一数组，只解码一次。
+        full 为 False 时第一项为 None。
+        """
+        image = Image.open(_BufferReader(data))
+        reduced_flag = self._reduced_flag_for(image, input_size)
+        model_array = self._decode(data, image, reduced_flag)
+        if not full:
+            return None, model_array, image.size
+        if not reduced_flag:
+            return model_array, model_array, image.size
+        return self._decode(data, image, 0), model_array, image.size
+
+    @staticmethod
+    def _decode(data, image: Image.Image, reduced_flag: int) -> np.ndarray:
+        flags = cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION | reduced_flag  # 与 PIL 一致，不按EXIF旋转
+        array = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+        if array is None:
+            return np.array(image.convert("RGB"))
+        return cv2.cvtColor(array, cv2.COLOR_BGR2RGB, dst=array)
+
+    def _reduced_flag_for(self, image: Image.Image, min_size: Optional[Tuple[int, int]]) -> int:
+        """按文件头判断能否缩小解码，返回对应的解码标志（不能时为0）"""
+        if min_size is None or image.format != "JPEG":
+            return 0
+        return self._reduced_flag(image.size, min_size)
+
+    @staticmethod
+    def _reduced_flag(size: Tuple[int, int], min_size: Tuple[int, int]) -> int:
+        """两边缩小后仍不小于 min_size 的最大缩小倍数对应的解码标志"""
+        width, height = size
+        min_width, min_height = min_size
+        for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                             (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if width // factor >= min_width and height // factor >= min_height:
+                return flag
+        return 0
 
 base64_service = Base64Service()
 
@@ -0,0 +1,176 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+import numpy as np
+
+
+class _PendingItem:
+    """等待组批的单个推理请求"""
+
+    __slots__ = ("inputs", "future", "size")
+
+    def __init__(self, inputs: Dict[str, np.ndarray]):
+        self.inputs = inputs
+        self.future = Future()
+        # 单个请求自身的batch维度（通常为1）
+        self.size = next(iter(inputs.values())).shape[0]
+
+
+class BatchScheduler:
+    """
+    动态微批调度器
+
+    并发到达的推理请求在 max_wait_ms 时间窗口内最多攒够 max_batch_size 个样本，
+    沿batch维拼接后一次调用 session.run，再把各输出按样本拆分回每个调用方。
+    取批时队列中只有一个请求（没有其他提交者在排队）则立即执行，单个调用方不等待窗口；
+    负载较高时上一批执行期间到达的请求会在队列中积累，此时才按窗口凑批。
+    调度线程独占会话，调用方线程（推理执行器中的工作线程）阻塞等待自己的结果。
+    """
+
+    def __init__(self, run_batch: Callable[[Dict[str, np.ndarray]], Dict[str, np.ndarray]],
+                 max_batch_size: int = 8, max_wait_ms: float = 5.0, name: str = "batch-scheduler"):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._pending: List[_PendingItem] = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        # 拼接用的批缓冲区（仅调度线程访问），按输入名复用
+        self._feed_buffers: Dict[str, np.ndarray] = {}
+
+        # 统计信息
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._batch_sizes: Dict[int, int] = {}
+
+    def start(self):
+        """启动调度线程"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止调度线程，已提交的请求会先执行完毕"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self._thread = None
+
+    def submit(self, inputs: Dict[str, np.ndarray]) -> Future:
+        """提交一个请求，返回可等待输出字典的 Future"""
+        item = _PendingItem(inputs)
+        with self._cond:
+            if self._stopped or self._thread is None:
+                raise RuntimeError("批调度器未启动")
+            self._pending.append(item)
+            self._cond.notify_all()
+        return item.future
+
+    def run(self, inputs: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """提交请求并阻塞等待结果"""
+        return self.submit(inputs).result()
+
+    def _take_batch(self) -> List[_PendingItem]:
+        """等待并取出下一批请求；调度器停止且无待处理请求时返回空列表"""
+        with self._cond:
+            while not self._pending and not self._stopped:
+                self._cond.wait()
+            if not self._pending:
+                return []
+
+            # 已有其他请求在排队时，窗口内尽量攒满一批；
+            # 只有一个请求时没有并发的提交者，等待窗口只会增加它的延迟
+            deadline = time.monotonic() + self.max_wait
+            while (not self._stopped and len(self._pending) > 1
+                   and self._pending_size() < self.max_batch_size):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            total = 0
+            while self._pending:
+                size = self._pending[0].size
+                if batch and total + size > self.max_batch_size:
+                    break
+                batch.append(self._pending.pop(0))
+                total += size
+            return batch
+
+    def _pending_size(self) -> int:
+        return sum(item.size for item in self._pending)
+
+    def _loop(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: List[_PendingItem]):
+        try:
+            if len(batch) == 1:
+                feeds = batch[0].inputs
+            else:
+                feeds = self._concatenate(batch)
+            outputs = self.run_batch(feeds)
+        except Exception as e:
+            for item in batch:
+                item.future.set_exception(e)
+            return
+
+        total = sum(item.size for item in batch)
+        self._record(total)
+
+        # 按样本拆分输出（保留batch维，便于沿用 parse_results 的 [0] 取值）
+        offset = 0
+        for item in batch:
+            result = {
+                name: value[offset:offset + item.size]
+                for name, value in outputs.items()
+            }
+            offset += item.size
+            item.future.set_result(result)
+
+    def _concatenate(self, batch: List[_PendingItem]) -> Dict[str, np.ndarray]:
+        """沿batch维把各请求的输入拼接到复用的批缓冲区中"""
+        total = sum(item.size for item in batch)
+        feeds = {}
+        for name, first in batch[0].inputs.items():
+            buffer = self._feed_buffers.get(name)
+            if (buffer is None or buffer.shape[0] < total
+                    or buffer.shape[1:] != first.shape[1:] or buffer.dtype != first.dtype):
+                buffer = np.empty((max(total, self.max_batch_size),) + first.shape[1:], dtype=first.dtype)
+                self._feed_buffers[name] = buffer
+            feeds[name] = np.concatenate([item.inputs[name] for item in batch], axis=0, out=buffer[:total])
+        return feeds
+
+    def _record(self, batch_size: int):
+        with self._stats_lock:
+            self._batches += 1
+            self._items += batch_size
+            self._batch_sizes[batch_size] = self._batch_sizes.get(batch_size, 0) + 1
+
+    def stats(self) -> dict:
+        """组批统计：批次数、样本数、平均批大小与批大小分布"""
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": (self._items / self._batches) if self._batches else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+            }
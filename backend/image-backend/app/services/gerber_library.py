@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+import numpy as np
+from app.config import settings
+from app.services.base64_service import base64_service
+from app.services.preprocess_service import ImagePreprocessor
+
+
+class GerberNotFoundError(KeyError):
+    """gerber_id 未注册（或已被删除）"""
+
+
+class GerberEntry:
+    """
+    已注册的Gerber图
+
+    tensor 为磁盘上预处理结果的只读内存映射（[1, 3, H, W] float32），
+    可直接作为模型的 gerber 输入；原图仅在需要时（如模型无风格输出的回退路径、切片推理）才解码。
+    """
+
+    def __init__(self, gerber_id: str, directory: str, meta: Dict, tensor: np.ndarray):
+        self.gerber_id = gerber_id
+        self.directory = directory
+        self.meta = meta
+        self.tensor = tensor
+
+    def decode_image(self) -> np.ndarray:
+        """
+        按原分辨率解码原始Gerber图（RGB uint8 数组，与上传Gerber时的解码方式相同）
+
+        每次调用都重新解码，结果不保存在条目上：LRU 中的条目只占用张量的内存映射，
+        不会常驻 GERBER_CACHE_SIZE 张全分辨率原图。
+        """
+        with open(os.path.join(self.directory, GerberLibrary.ORIGINAL_FILE), "rb") as f:
+            return base64_service.bytes_to_array(f.read())[0]
+
+    def info(self) -> Dict:
+        return {
+            "gerber_id": self.gerber_id,
+            "filename": self.meta.get("filename"),
+            "width": self.meta["width"],
+            "height": self.meta["height"],
+            "file_size": self.meta["size"],
+            "created_at": self.meta["created_at"],
+        }
+
+
+class GerberLibrary:
+    """
+    持久化Gerber参考库
+
+    同一张Gerber会与成千上万张实物图比对。注册时只解码、预处理一次，
+    预处理张量以 .npy 形式保存在 GERBER_LIBRARY_DIR/<gerber_id>/ 下，
+    查询时以内存映射方式打开，再经内存 LRU 缓存；服务重启后无需重新解码。
+
+    gerber_id 为原始文件内容的 SHA-256 前缀，重复注册同一文件返回同一ID。
+    不同输入分辨率的模型各自使用一份张量（tensor_<W>x<H>.v<版本>.npy），首次需要时由原图生成。
+    张量与上传Gerber时的模型输入完全相同（同样按模型输入尺寸缩小解码后预处理），
+    引用 gerber_id 与直接上传同一文件得到相同的分数。
+    """
+
+    META_FILE = "meta.json"
+    ORIGINAL_FILE = "original"
+    # 张量生成方式的版本：旧版本按原分辨率解码后缩放，与上传路径不一致，需要时按新方式重新生成
+    TENSOR_VERSION = 2
+
+    def __init__(self, root: str = None, cache_size: int = None):
+        self.root = root or settings.GERBER_LIBRARY_DIR
+        self.cache_size = max(1, cache_size or settings.GERBER_CACHE_SIZE)
+        # LRU 以 (gerber_id, 输入尺寸) 为键
+        self._cache: "OrderedDict[Tuple[str, Tuple[int, int]], GerberEntry]" = OrderedDict()
+        self._preprocessors: Dict[Tuple[int, int], ImagePreprocessor] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def _directory(self, gerber_id: str) -> str:
+        # ID 只允许十六进制字符，防止路径穿越
+        if not gerber_id or not all(c in "0123456789abcdef" for c in gerber_id):
+            raise GerberNotFoundError(gerber_id)
+        return os.path.join(self.root, gerber_id)
+
+    def _tensor_file(self, input_shape: Tuple[int, int]) -> str:
+        """预处理张量文件名，与模型输入尺寸 (W, H) 及张量版本绑定"""
+        width, height = input_shape
+        return f"tensor_{width}x{height}.v{self.TENSOR_VERSION}.npy"
+
+    def _preprocess(self, data, input_shape: Tuple[int, int]) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """按模型输入尺寸解码（见 Base64Service.bytes_to_arrays）并预处理，返回 ([1, 3, H, W] 张量, 原图尺寸)"""
+        preprocessor = self._preprocessors.get(input_shape)
+        if preprocessor is None:
+            preprocessor = ImagePreprocessor(input_shape)
+            self._preprocessors[input_shape] = preprocessor
+        image, size = base64_service.bytes_to_array(data, input_shape)
+        width, height = input_shape
+        return preprocessor.preprocess_into(image, np.empty((1, 3, height, width), dtype=np.float32)), size
+
+    def register(self, data: bytes, filename: str = None, input_shape: Tuple[int, int] = (256, 256)) -> GerberEntry:
+        """
+        注册Gerber图（CPU密集，应在推理执行器中调用）
+
+        注册时按 input_shape（通常为默认模型的输入尺寸）生成张量。
+
+        Raises:
+            ValueError: 无法解码为图片
+        """
+        gerber_id = hashlib.sha256(data).hexdigest()[:32]
+        directory = self._directory(gerber_id)
+
+        if not os.path.exists(os.path.join(directory, self.META_FILE)):
+            try:
+                tensor, (width, height) = self._preprocess(data, input_shape)
+            except Exception as e:
+                raise ValueError(f"无法解析Gerber图片: {e}")
+
+            # 先写入临时目录再整体改名，避免并发注册或中途崩溃留下半成品
+            tmp_dir = f"{directory}.tmp-{os.getpid()}-{threading.get_ident()}"
+            os.makedirs(tmp_dir, exist_ok=True)
+            try:
+                with open(os.path.join(tmp_dir, self.ORIGINAL_FILE), "wb") as f:
+                    f.write(data)
+                np.save(os.path.join(tmp_dir, self._tensor_file(input_shape)), tensor)
+                meta = {
+                    "gerber_id": gerber_id,
+                    "filename": filename,
+                    "width": width,
+                    "height": height,
+                    "size": len(data),
+                    "created_at": time.time(),
+                }
+                with open(os.path.join(tmp_dir, self.META_FILE), "w", encoding="utf-8") as f:
+                    json.dump(meta, f, ensure_ascii=False)
+                os.makedirs(self.root, exist_ok=True)
+                os.replace(tmp_dir, directory)
+            except OSError:
+                # 其他线程已完成同一文件的注册
+                if not os.path.exists(os.path.join(directory, self.META_FILE)):
+                    raise
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        return self.get(gerber_id, input_shape)
+
+    def get(self, gerber_id: str, input_shape: Tuple[int, int] = (256, 256)) -> GerberEntry:
+        """
+        按ID获取指定输入尺寸 (W, H) 的Gerber张量（优先内存LRU，其次磁盘内存映射）
+
+        Raises:
+            GerberNotFoundError: ID 不存在
+        """
+        cache_key = (gerber_id, tuple(input_shape))
+        with self._lock:
+            entry = self._cache.get(cache_key)
+            if entry is not None:
+                self._cache.move_to_end(cache_key)
+                self._hits += 1
+                return entry
+            self._misses += 1
+
+        entry = self._load(gerber_id, tuple(input_shape))
+        with self._lock:
+            self._cache[cache_key] = entry
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return entry
+
+    def _load(self, gerber_id: str, input_shape: Tuple[int, int]) -> GerberEntry:
+        directory = self._directory(gerber_id)
+        meta_path = os.path.join(directory, self.META_FILE)
+        if not os.path.exists(meta_path):
+            raise GerberNotFoundError(gerber_id)
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        tensor_path = os.path.join(directory, self._tensor_file(input_shape))
+        if not os.path.exists(tensor_path):
+            # 该输入尺寸首次访问：用保存的原图生成
+            with open(os.path.join(directory, self.ORIGINAL_FILE), "rb") as f:
+                data = f.read()
+            tmp_path = f"{tensor_path}.tmp-{threading.get_ident()}.npy"
+            np.save(tmp_path, self._preprocess(data, input_shape)[0])
+            os.replace(tmp_path, tensor_path)
+
+        tensor = np.load(tensor_path, mmap_mode="r")
+        return GerberEntry(gerber_id, directory, meta, tensor)
+
+    def delete(self, gerber_id: str):
+        """删除已注册的Gerber"""
+        directory = self._directory(gerber_id)
+        if not os.path.exists(directory):
+            raise GerberNotFoundError(gerber_id)
+        with self._lock:
+            for cache_key in [k for k in self._cache if k[0] == gerber_id]:
+                del self._cache[cache_key]
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def stats(self) -> Dict:
+        """LRU 缓存统计"""
+        with self._lock:
+            return {
+                "cached": len(self._cache),
+                "cache_size": self.cache_size,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+
+# 创建全局Gerber库实例
+gerber_library = GerberLibrary()
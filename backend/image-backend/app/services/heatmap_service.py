@@ -0,0 +1,151 @@
+import cv2
+import numpy as np
+from typing import Dict, Tuple
+from app.config import settings
+
+# matplotlib 分段线性色表定义：每个通道为 (x, y0, y1) 控制点
+# 与 matplotlib._cm 中的数据一致，保证渲染结果与原 plt.cm.* 相同
+_SEGMENT_DATA: Dict[str, Dict[str, Tuple[Tuple[float, float, float], ...]]] = {
+    "jet": {
+        "red": ((0.0, 0, 0), (0.35, 0, 0), (0.66, 1, 1), (0.89, 1, 1), (1, 0.5, 0.5)),
+        "green": ((0.0, 0, 0), (0.125, 0, 0), (0.375, 1, 1), (0.64, 1, 1), (0.91, 0, 0), (1, 0, 0)),
+        "blue": ((0.0, 0.5, 0.5), (0.11, 1, 1), (0.34, 1, 1), (0.65, 0, 0), (1, 0, 0)),
+    },
+    "hot": {
+        "red": ((0.0, 0.0416, 0.0416), (0.365079, 1.0, 1.0), (1.0, 1.0, 1.0)),
+        "green": ((0.0, 0.0, 0.0), (0.365079, 0.0, 0.0), (0.746032, 1.0, 1.0), (1.0, 1.0, 1.0)),
+        "blue": ((0.0, 0.0, 0.0), (0.746032, 0.0, 0.0), (1.0, 1.0, 1.0)),
+    },
+    "gray": {
+        "red": ((0.0, 0, 0), (1.0, 1, 1)),
+        "green": ((0.0, 0, 0), (1.0, 1, 1)),
+        "blue": ((0.0, 0, 0), (1.0, 1, 1)),
+    },
+}
+
+# OpenCV 内置色表（输出为BGR顺序）
+_CV2_COLORMAPS = {
+    "turbo": cv2.COLORMAP_TURBO,
+    "viridis": cv2.COLORMAP_VIRIDIS,
+    "inferno": cv2.COLORMAP_INFERNO,
+    "magma": cv2.COLORMAP_MAGMA,
+}
+
+LUT_SIZE = 256
+# 分条渲染的行数（每条的彩色热力图临时缓冲为 STRIP_ROWS×W×3 字节）
+STRIP_ROWS = 64
+
+
+def _segment_channel(points, n: int) -> np.ndarray:
+    """按 matplotlib 的 _create_lookup_table 规则生成单通道 [0,1] 色表"""
+    data = np.asarray(points, dtype=np.float64)
+    x, y0, y1 = data[:, 0], data[:, 1], data[:, 2]
+    xind = np.linspace(0, 1, n)
+    ind = np.searchsorted(x, xind)[1:-1]
+    distance = (xind[1:-1] - x[ind - 1]) / (x[ind] - x[ind - 1])
+    lut = np.concatenate([[y1[0]], distance * (y0[ind] - y1[ind - 1]) + y1[ind - 1], [y0[-1]]])
+    return np.clip(lut, 0.0, 1.0)
+
+
+def build_colormap_lut(name: str) -> np.ndarray:
+    """
+    生成 256 项 uint8 RGB 查找表
+
+    Returns:
+        np.ndarray: 形状为 [256, 1, 3] 的 uint8 数组（可直接用于 cv2.LUT / cv2.applyColorMap）
+    """
+    if name in _SEGMENT_DATA:
+        segments = _SEGMENT_DATA[name]
+        channels = [_segment_channel(segments[c], LUT_SIZE) for c in ("red", "green", "blue")]
+        lut = (np.stack(channels, axis=-1) * 255).astype(np.uint8)
+    elif name in _CV2_COLORMAPS:
+        ramp = np.arange(LUT_SIZE, dtype=np.uint8).reshape(LUT_SIZE, 1)
+        lut = cv2.applyColorMap(ramp, _CV2_COLORMAPS[name])[:, 0, ::-1]  # BGR -> RGB
+    else:
+        raise ValueError(f"不支持的色表: {name}，可选: {', '.join(available_colormaps())}")
+    return np.ascontiguousarray(lut.reshape(LUT_SIZE, 1, 3))
+
+
+def available_colormaps():
+    """可选色表名称"""
+    return sorted(list(_SEGMENT_DATA) + list(_CV2_COLORMAPS))
+
+
+class HeatmapRenderer:
+    """
+    基于预计算查找表的热力图渲染器
+
+    掩码一次性量化为 uint8 索引，经 cv2.applyColorMap 查表得到彩色热力图，
+    再用 uint8 加权混合写入输出缓冲区，全程不产生 H×W×4 float64 中间数组，
+    也无需在请求路径中导入 matplotlib。
+    """
+
+    def __init__(self, colormap: str = None):
+        self.default_colormap = colormap or getattr(settings, 'HEATMAP_COLORMAP', 'jet')
+        self._luts: Dict[str, np.ndarray] = {}
+        # 启动时预先生成默认色表
+        self.get_lut(self.default_colormap)
+
+    def get_lut(self, colormap: str = None) -> np.ndarray:
+        """获取（并缓存）色表"""
+        name = colormap or self.default_colormap
+        lut = self._luts.get(name)
+        if lut is None:
+            lut = build_colormap_lut(name)
+            self._luts[name] = lut
+        return lut
+
+    def quantize_mask(self, mask: np.ndarray) -> np.ndarray:
+        """
+        将掩码按 min-max 归一化并量化为 uint8 色表索引
+
+        与 matplotlib 的取值方式一致：index = floor(norm * 256)，上限255。
+        cv2.convertScaleAbs 在一次遍历中完成缩放、平移与饱和截断。
+        """
+        mask_min = float(mask.min())
+        mask_max = float(mask.max())
+        scale = LUT_SIZE / (mask_max - mask_min + 1e-8)
+        # 减0.5使四舍五入等价于向下取整
+        return cv2.convertScaleAbs(mask, alpha=scale, beta=-mask_min * scale - 0.5)
+
+    def colorize(self, mask: np.ndarray, colormap: str = None) -> np.ndarray:
+        """将掩码映射为 [H, W, 3] uint8 彩色热力图"""
+        # applyColorMap 的自定义色表按单通道索引直接查表，无需先合并为3通道
+        return cv2.applyColorMap(self.quantize_mask(mask), self.get_lut(colormap))
+
+    def render(self, image: np.ndarray, mask: np.ndarray, alpha: float = 0.6, colormap: str = None,
+               out: np.ndarray = None) -> np.ndarray:
+        """
+        创建热力图叠加图像
+
+        掩码尺寸与图像不同时（模型分辨率的掩码）先量化为 uint8 色表索引再放大到图像尺寸，
+        放大后的中间数组只有 H×W 字节（而不是 float32 掩码的4倍）；着色与混合按行分条进行，
+        彩色热力图只占一个条带的临时内存。
+
+        Args:
+            image (np.ndarray): 原始图像，形状为 [H, W, 3]，uint8
+            mask (np.ndarray): 异常掩码，形状为 [h, w]（任意尺寸）
+            alpha (float): 热力图透明度
+            colormap (str): 色表名称，默认使用 HEATMAP_COLORMAP
+            out (np.ndarray): 输出缓冲区，可以就是 image（原地叠加，不再分配整图缓冲）；
+                默认新分配，不修改输入图像
+
+        Returns:
+            np.ndarray: 叠加后的彩色图像（即 out）
+        """
+        height, width = image.shape[:2]
+        index = self.quantize_mask(mask)
+        if index.shape != (height, width):
+            index = cv2.resize(index, (width, height), interpolation=cv2.INTER_LINEAR)
+        lut = self.get_lut(colormap)
+        if out is None:
+            out = np.empty_like(image)
+
+        for top in range(0, height, STRIP_ROWS):
+            rows = slice(top, top + STRIP_ROWS)
+            heatmap = cv2.applyColorMap(index[rows], lut)
+            cv2.addWeighted(image[rows], 1 - alpha, heatmap, alpha, 0, dst=out[rows])
+        return out
+
+# 创建全局渲染器实例
+heatmap_renderer = HeatmapRenderer()
@@ -1,9 +1,18 @@
 from app.services.algorithm_service import algorithm_service
-from app.services.base64_service import base64_service
+from app.services.base64_service import base64_service, ImageEncoding
+from app.services.inference_executor import InferenceExecutor, InferenceQueueFullError
+from app.services.gerber_library import gerber_library, GerberEntry, GerberNotFoundError
+from app.services.result_cache import result_cache
+from app.services.model_registry import model_registry
+from app.services.heatmap_service import heatmap_renderer
+from app.services.metrics_service import stage_timer, IMAGE_BYTES, IMAGE_MEGAPIXELS
+from app.services.trace_service import annotate
+from app.config import settings
 from app.models.schemas import ProcessResponse
-from PIL import Image
+from typing import Dict, Optional, Tuple
+import asyncio
+import numpy as np
 import traceback
-from fastapi import UploadFile
 
 class ImageService:
     """图片处理服务"""
@@ -11,56 +20,186 @@ class ImageService:
     def __init__(self):
         self.algorithm_service = algorithm_service
         self.base64_service = base64_service
+        self.gerber_library = gerber_library
+        self.model_registry = model_registry
+        self.result_cache = result_cache if settings.RESULT_CACHE_ENABLED else None
+        # CPU密集阶段统一在推理执行器中运行，避免阻塞事件循环
+        self.executor = InferenceExecutor()
     
     async def process_pcb_images(self, query_image_b64: str, gerber_image_b64: str, model: str = "256") -> ProcessResponse:
         """
-        处理PCB图片的主流程（Base64版本）
+        处理PCB图片的主流程（Base64版本，仅用于JSON请求）
         """
+        result = await self.inspect_pcb_images(query_image_b64, gerber_image_b64, model)
+        return self.to_process_response(result)
+    
+    async def inspect_pcb_images(self, query_image_b64: str, gerber_image_b64: str = None, model: str = "256",
+                                 include_images: bool = True, gerber_id: str = None,
+                                 encoding: ImageEncoding = None) -> Dict:
+        """检测Base64输入，返回编码后图片字节形式的结果（见 _inspect）"""
+        return await self._inspect(self.base64_service.base64_to_arrays, query_image_b64, gerber_image_b64, model,
+                                   include_images, gerber_id, encoding)
+    
+    async def inspect_pcb_bytes(self, query_data, gerber_data=None, model: str = "256",
+                                include_images: bool = True, gerber_id: str = None,
+                                encoding: ImageEncoding = None) -> Dict:
+        """检测原始字节输入，返回编码后图片字节形式的结果（见 _inspect）"""
+        return await self._inspect(self.base64_service.bytes_to_arrays, query_data, gerber_data, model,
+                                   include_images, gerber_id, encoding)
+    
+    async def register_gerber(self, data: bytes, filename: str = None) -> GerberEntry:
+        """注册Gerber图：解码与预处理只做一次，结果持久化到Gerber库"""
+        async with self.executor.admit():
+            return await self.executor.run(self._register_gerber, data, filename)
+    
+    def _register_gerber(self, data: bytes, filename: str = None) -> GerberEntry:
+        # 张量按默认模型配置的输入尺寸生成（不为此加载模型），其他尺寸首次使用时再生成
+        input_shape = self.model_registry.spec(settings.DEFAULT_MODEL).input_shape
+        return self.gerber_library.register(data, filename, input_shape)
+    
+    def _get_gerber(self, gerber_id: str, model: str) -> GerberEntry:
+        return self.gerber_library.get(gerber_id, self.model_registry.get(model).input_shape)
+    
+    async def _inspect(self, decode, query_source, gerber_source, model: str, include_images: bool,
+                       gerber_id: str = None, encoding: ImageEncoding = None) -> Dict:
+        """
+        检测主流程（经过结果缓存，相同输入并发到达时只执行一次，见 ResultCache）
+        
+        gerber_id 不为空时使用Gerber库中已注册的Gerber（忽略 gerber_source）。
+        encoding 为结果图片编码，默认 settings.IMAGE_ENCODING。
+        返回值格式见 _run_pipeline。
+        """
+        self.model_registry.spec(model)  # 未注册的模型名直接返回400
+        encoding = encoding or ImageEncoding.parse()
+        annotate(model=model, gerber_id=gerber_id, include_images=include_images)
+        if include_images:
+            annotate(encoding=str(encoding))
+        
+        def run():
+            return self._run_pipeline(decode, query_source, gerber_source, model, include_images, gerber_id, encoding)
+        
+        if self.result_cache is None or (gerber_id is None and gerber_source is None):
+            return await run()
+        
+        key = await self.executor.run(
+            self.result_cache.make_key, query_source, gerber_source,
+            self.model_registry.spec(model).fingerprint(), gerber_id=gerber_id
+        )
+        # 结果图片取决于编码与热力图色表
+        images = f"{encoding}:{heatmap_renderer.default_colormap}" if include_images else None
+        return await self.result_cache.get_or_compute(key, run, images)
+    
+    async def _run_pipeline(self, decode, query_source, gerber_source, model: str, include_images: bool,
+                            gerber_id: str = None, encoding: ImageEncoding = None) -> Dict:
+        """
+        解码、推理、编码的完整流程
+        
+        Returns:
+            {
+                "converted_bytes": 编码后的风格迁移图（include_images 为 False 时为 None）,
+                "anomaly_bytes": 编码后的异常热力图（include_images 为 False 时为 None）,
+                "image_format": 图片编码格式（png / webp / jpeg，include_images 为 False 时为 None）,
+                "anomaly_score": 异常分数,
+                "defect_description": 缺陷描述
+            }
+        """
+        encoding = encoding or ImageEncoding.parse()
         try:
-            # 1. Base64解码
-            query_image = self.base64_service.base64_to_image(query_image_b64)
-            gerber_image = self.base64_service.base64_to_image(gerber_image_b64)
-            
-            # 2. 调用算法服务处理
-            result = self.algorithm_service.process_images(query_image, gerber_image, model)
+            async with self.executor.admit():
+                # 1. 解码（模型输入按缩小分辨率解码，需要结果图时另解码原分辨率）
+                input_size = await self.executor.run(self._model_input_size, model)
+                query_image, query_input = await self.executor.run(
+                    self._decode, decode, query_source, "query", input_size, include_images
+                )
+                gerber_input = None
+                if gerber_id is not None:
+                    gerber_image = await self.executor.run(self._get_gerber, gerber_id, model)
+                elif gerber_source is not None:
+                    gerber_image, gerber_input = await self.executor.run(
+                        self._decode, decode, gerber_source, "gerber", input_size, include_images
+                    )
+                else:
+                    raise ValueError("请提供Gerber图片或已注册的 gerber_id")
+                
+                # 2. 调用算法服务处理
+                result = await self.executor.run(
+                    self.algorithm_service.process_images, query_image, gerber_image, model, include_images,
+                    query_input, gerber_input
+                )
+                
+                # 3. 结果编码：两张图在线程池中并行编码
+                converted_bytes = None
+                anomaly_bytes = None
+                if include_images:
+                    converted_bytes, anomaly_bytes = await asyncio.gather(
+                        self.executor.run(self._encode, result["converted_image"], encoding),
+                        self.executor.run(self._encode, result["anomaly_image"], encoding),
+                    )
             
-            # 3. 结果编码为Base64
-            converted_gerber_b64 = self.base64_service.image_to_base64(result["converted_image"])
-            anomaly_image_b64 = self.base64_service.image_to_base64(result["anomaly_image"])
-            
-            # 4. 构建响应
-            return ProcessResponse(
-                convertedGerber=converted_gerber_b64,
-                anomalyImage=anomaly_image_b64,
-                anomalyScore=result["anomaly_score"],
-                defectDescription=result["defect_description"]
-            )
+            return {
+                "converted_bytes": converted_bytes,
+                "anomaly_bytes": anomaly_bytes,
+                "image_format": encoding.format if include_images else None,
+                "anomaly_score": result["anomaly_score"],
+                "defect_description": result["defect_description"],
+            }
             
+        except (InferenceQueueFullError, GerberNotFoundError):
+            raise
         except Exception as e:
             print(f"图片处理失败: {str(e)}")
             print(traceback.format_exc())
             raise
     
-    async def process_pcb_files(self, query_file: UploadFile, gerber_file: UploadFile, model: str = "256") -> ProcessResponse:
+    def _model_input_size(self, model: str) -> Optional[Tuple[int, int]]:
         """
-        处理PCB图片的主流程（文件上传版本）
+        模型输入的解码尺寸 (W, H)，允许按该尺寸缩小解码
+
+        切片推理需要原分辨率的切片，返回 None（原分辨率解码）。
         """
-        try:
-            print(f"开始处理文件: {query_file.filename}, {gerber_file.filename}")
-            
-            # 1. 文件转换为Base64
-            query_image_b64 = await self.base64_service.file_to_base64(query_file)
-            gerber_image_b64 = await self.base64_service.file_to_base64(gerber_file)
-            
-            print("文件已转换为Base64")
-            
-            # 2. 调用Base64版本的处理流程
-            return await self.process_pcb_images(query_image_b64, gerber_image_b64, model)
-            
-        except Exception as e:
-            print(f"文件处理失败: {str(e)}")
-            print(traceback.format_exc())
-            raise
+        onnx_service = self.model_registry.get(model)
+        if onnx_service.tiled:
+            return None
+        return onnx_service.input_shape
+    
+    def _decode(self, decode, source, role: str, input_size: Optional[Tuple[int, int]],
+                full: bool) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        解码输入图片，返回 (图片, 模型输入用图片)，并记录解码耗时与图片尺寸分布（原图尺寸）
+        
+        模型输入用图片与 full 无关（见 Base64Service.bytes_to_arrays），仅分数请求与完整请求的分数一致；
+        full 为 False 时不解码原分辨率，返回的图片即模型输入用图片。
+        """
+        with stage_timer("decode"):
+            image, model_image, (width, height) = decode(source, input_size, full)
+        IMAGE_BYTES.observe(len(source), role)
+        IMAGE_MEGAPIXELS.observe(width * height / 1e6, role)
+        info = {f"{role}_size": [width, height], f"{role}_bytes": len(source)}
+        if model_image.shape[:2] != (height, width):
+            info[f"{role}_decoded_size"] = [model_image.shape[1], model_image.shape[0]]
+        annotate(**info)
+        if image is None:
+            return model_image, model_image
+        return image, model_image
+    
+    def _encode(self, image: np.ndarray, encoding: ImageEncoding) -> bytes:
+        """编码一张结果图，耗时按格式分别记录（encode_png / encode_webp / encode_jpeg）"""
+        with stage_timer(f"encode_{encoding.format}"):
+            return self.base64_service.encode(image, encoding)
+    
+    def to_process_response(self, result: Dict) -> ProcessResponse:
+        """将检测结果转换为Base64 JSON响应（当前Vue前端使用的默认格式）"""
+        return ProcessResponse(
+            convertedGerber=self.base64_service.bytes_to_base64(result["converted_bytes"]),
+            anomalyImage=self.base64_service.bytes_to_base64(result["anomaly_bytes"]),
+            anomalyScore=result["anomaly_score"],
+            defectDescription=result["defect_description"],
+            imageFormat=result["image_format"]
+        )
+    
+    def shutdown(self):
+        """关闭推理执行器"""
+        self.executor.shutdown()
 
 # 创建全局服务实例
 image_service = ImageService()
\ No newline at end of file
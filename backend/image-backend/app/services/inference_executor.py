@@ -0,0 +1,92 @@
+import asyncio
+import contextvars
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from app.config import settings
+from app.services.metrics_service import QUEUE_WAIT
+from app.services.trace_service import record_stage
+
+
+class InferenceQueueFullError(RuntimeError):
+    """推理队列已满，调用方应返回 503 让客户端稍后重试"""
+
+
+class InferenceExecutor:
+    """
+    有界推理执行器
+
+    解码、推理、PNG编码等CPU密集阶段统一提交到独立线程池执行，
+    事件循环只负责等待结果，从而保证健康检查和上传接口不被阻塞。
+    onnxruntime、OpenCV 与 Pillow 在计算时都会释放GIL，线程池即可利用多核。
+
+    - max_workers: 同时执行的任务数
+    - max_queue: 除正在执行的请求外，最多允许排队等待的请求数
+    """
+
+    def __init__(self, max_workers: int = None, max_queue: int = None):
+        self.max_workers = max_workers or settings.INFERENCE_WORKERS
+        self.max_queue = settings.INFERENCE_QUEUE_SIZE if max_queue is None else max_queue
+        self._pool = None
+        # 已接纳（执行中 + 排队中）的请求数，仅在事件循环线程中修改
+        self._admitted = 0
+        self._rejected = 0
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="inference"
+            )
+        return self._pool
+
+    @asynccontextmanager
+    async def admit(self):
+        """
+        请求级准入控制
+
+        一个请求会分多个阶段提交到线程池，准入只在入口处判断一次，
+        避免请求执行到一半才因队列已满被拒绝。
+        """
+        if self._admitted >= self.max_workers + self.max_queue:
+            self._rejected += 1
+            raise InferenceQueueFullError(
+                f"推理队列已满（并发 {self.max_workers}，排队上限 {self.max_queue}），请稍后重试"
+            )
+        self._admitted += 1
+        try:
+            yield
+        finally:
+            self._admitted -= 1
+
+    async def run(self, func, *args, **kwargs):
+        """在推理线程池中执行同步函数并等待结果（携带当前请求的追踪上下文）"""
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, self._timed_call, time.perf_counter(), func, args, kwargs)
+        return await loop.run_in_executor(self._get_pool(), call)
+
+    @staticmethod
+    def _timed_call(submitted_at: float, func, args, kwargs):
+        # 记录任务在线程池中排队等待的时间
+        wait = time.perf_counter() - submitted_at
+        QUEUE_WAIT.observe(wait)
+        record_stage("queue", wait)
+        return func(*args, **kwargs)
+
+    def stats(self) -> dict:
+        """执行器状态"""
+        return {
+            "workers": self.max_workers,
+            "queue_size": self.max_queue,
+            "admitted": self._admitted,
+            "waiting": max(0, self._admitted - self.max_workers),
+            "rejected": self._rejected,
+        }
+
+    def shutdown(self, wait: bool = True):
+        """关闭线程池"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
@@ -0,0 +1,445 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import secrets
+import threading
+import traceback
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.config import settings
+
+# 与 onnxruntime.NodeArg 字段相同，RemoteSession 用它模拟 get_inputs / get_outputs
+NodeArg = namedtuple("NodeArg", ["name", "shape", "type"])
+
+# 槽内各张量的起始偏移按该字节数对齐
+_ALIGN = 64
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """附加到已有共享内存；由创建方负责删除（Python 3.13+ 可关闭附加方的 resource_tracker 登记）"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class ShmRing:
+    """
+    共享内存槽环
+
+    一块 SharedMemory 切成 slot_count 个 slot_size 字节的槽，由 HTTP 工作进程创建。
+    每个推理请求占用一个槽：工作进程把预处理好的输入张量写入槽，推理进程直接以槽内存
+    构造 ndarray 调用 session.run，再把输出写回同一个槽；控制消息只包含槽号与各张量的
+    类型、形状和偏移，张量本身不经过 pickle。槽用完即归还，循环复用。
+    """
+
+    def __init__(self, slot_count: int, slot_size: int, name: str = None):
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=slot_count * slot_size)
+        else:
+            self.shm = _attach(name)
+        self.name = self.shm.name
+        self._free: "queue.Queue[int]" = queue.Queue()
+        for index in range(slot_count):
+            self._free.put(index)
+
+    def acquire(self) -> int:
+        """取一个空闲槽（全部占用时阻塞等待）"""
+        return self._free.get()
+
+    def release(self, index: int):
+        self._free.put(index)
+
+    def write(self, index: int, arrays: Dict[str, np.ndarray]) -> Optional[List[Tuple]]:
+        """把数组依次写入槽，返回 [(名称, dtype, 形状, 偏移)]；槽放不下时返回 None"""
+        layout = []
+        offset = 0
+        for name, array in arrays.items():
+            if offset + array.nbytes > self.slot_size:
+                return None
+            layout.append((name, array.dtype.str, tuple(array.shape), offset))
+            offset += -(-array.nbytes // _ALIGN) * _ALIGN
+        for (name, dtype, shape, offset), array in zip(layout, arrays.values()):
+            self._view(index, dtype, shape, offset)[...] = array
+        return layout
+
+    def read(self, index: int, layout: List[Tuple], copy: bool = False) -> Dict[str, np.ndarray]:
+        """按 write 返回的布局取出数组；copy 为 False 时直接返回槽内存上的视图"""
+        arrays = {}
+        for name, dtype, shape, offset in layout:
+            view = self._view(index, dtype, shape, offset)
+            arrays[name] = view.copy() if copy else view
+        return arrays
+
+    def _view(self, index: int, dtype: str, shape: Tuple, offset: int) -> np.ndarray:
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=self.shm.buf,
+                          offset=index * self.slot_size + offset)
+
+    def close(self):
+        if self.shm is None:
+            return
+        try:
+            self.shm.close()
+        except BufferError:
+            # 仍有视图引用槽内存时无法解除映射，进程退出时由系统回收
+            pass
+        if self.owner:
+            self.shm.unlink()
+        self.shm = None
+
+
+class InferenceServer:
+    """
+    推理进程：独占 ONNX 会话（经 ModelRegistry 加载、组批、卸载）
+
+    每个 HTTP 工作进程建立一条连接，先发送自己的 ShmRing 名称，之后的 load / run 请求
+    在连接专属的线程池中并发执行。来自所有工作进程的请求进入同一个模型的 BatchScheduler，
+    因此组批跨进程生效。
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def serve(self, listener: Listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+                print(f"⚠️ 推理进程拒绝连接: {e}")
+                continue
+            threading.Thread(target=self._handle, args=(conn,), name="inference-server-conn", daemon=True).start()
+
+    def _handle(self, conn):
+        ring = None
+        pool = None
+        send_lock = threading.Lock()
+        try:
+            while True:
+                try:
+                    op, request_id, args = conn.recv()
+                except (EOFError, OSError):
+                    break
+                if op == "hello":
+                    name, slot_count, slot_size = args
+                    ring = ShmRing(slot_count, slot_size, name=name)
+                    # 并发请求数不会超过槽数
+                    pool = ThreadPoolExecutor(max_workers=slot_count + 1, thread_name_prefix="inference-server")
+                    with send_lock:
+                        conn.send((request_id, True, {"pid": os.getpid()}))
+                else:
+                    pool.submit(self._dispatch, conn, send_lock, ring, op, request_id, args)
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+            if ring is not None:
+                ring.close()
+            conn.close()
+
+    def _dispatch(self, conn, send_lock: threading.Lock, ring: ShmRing, op: str, request_id: int, args):
+        try:
+            if op == "load":
+                reply = (request_id, True, self._load(*args))
+            elif op == "run":
+                reply = (request_id, True, self._run(ring, *args))
+            else:
+                raise ValueError(f"未知请求: {op}")
+        except Exception as e:
+            print(f"❌ 推理进程处理 {op} 失败: {e}")
+            print(traceback.format_exc())
+            reply = (request_id, False, f"{type(e).__name__}: {e}")
+        try:
+            with send_lock:
+                conn.send(reply)
+        except (OSError, EOFError):
+            pass
+
+    def _load(self, model: str) -> Dict:
+        service = self.registry.get(model)
+        session = service.session
+        return {
+            "inputs": [(node.name, node.shape, node.type) for node in session.get_inputs()],
+            "outputs": [(node.name, node.shape, node.type) for node in session.get_outputs()],
+            "providers": session.get_providers(),
+            "pid": os.getpid(),
+        }
+
+    def _run(self, ring: ShmRing, model: str, index: int, layout: Optional[List[Tuple]],
+             inline: Optional[Dict[str, np.ndarray]]) -> Tuple:
+        # 输入直接使用槽内存；session.run 返回后输入不再需要，输出写回同一个槽
+        feeds = inline if layout is None else ring.read(index, layout)
+        with self.registry.acquire(model) as service:
+            if service.scheduler is not None:
+                outputs = service.scheduler.run(feeds)
+            else:
+                outputs = service.run_batch(feeds)
+        del feeds
+        out_layout = ring.write(index, outputs)
+        if out_layout is None:
+            return None, {name: np.ascontiguousarray(value) for name, value in outputs.items()}
+        return out_layout, None
+
+
+def _exit_with_parent(listener: Listener):
+    """启动进程退出（包括被强制结束）时推理进程随之退出"""
+    parent = multiprocessing.parent_process()
+    if parent is None:
+        return
+
+    def watch():
+        multiprocessing.connection.wait([parent.sentinel])
+        listener.close()
+        os._exit(0)
+
+    threading.Thread(target=watch, name="inference-server-watchdog", daemon=True).start()
+
+
+def _serve_process(ready_conn, authkey: bytes):
+    # 推理进程自己持有会话
+    settings.INFERENCE_SERVER_ADDRESS = ""
+    from app.services.model_registry import model_registry
+    from app.services.startup_service import startup_service
+
+    listener = Listener(authkey=authkey)
+    ready_conn.send(listener.address)
+    ready_conn.close()
+    _exit_with_parent(listener)
+    print(f"🧠 推理进程已启动: pid {os.getpid()}，地址 {listener.address}")
+    # 预加载与预热在后台进行，期间到达的 load 请求等待模型加载完成
+    threading.Thread(target=startup_service.warmup_models, args=(model_registry,),
+                     name="inference-server-warmup", daemon=True).start()
+    InferenceServer(model_registry).serve(listener)
+
+
+def start_inference_servers(count: int) -> List[multiprocessing.Process]:
+    """
+    启动 count 个推理进程（需在创建 HTTP 工作进程之前调用）
+
+    地址与认证密钥写入 settings 与环境变量，之后启动的 HTTP 工作进程据此连接。
+    """
+    context = multiprocessing.get_context("spawn")
+    authkey = secrets.token_bytes(16)
+    processes = []
+    addresses = []
+    for i in range(max(1, count)):
+        parent_conn, child_conn = context.Pipe(duplex=False)
+        process = context.Process(target=_serve_process, args=(child_conn, authkey),
+                                  name=f"inference-server-{i}", daemon=True)
+        process.start()
+        child_conn.close()
+        try:
+            addresses.append(parent_conn.recv())
+        except EOFError:
+            raise RuntimeError(f"推理进程 {process.name} 启动失败")
+        finally:
+            parent_conn.close()
+        processes.append(process)
+
+    settings.INFERENCE_SERVER_ADDRESS = ",".join(addresses)
+    settings.INFERENCE_SERVER_AUTHKEY = authkey.hex()
+    os.environ["INFERENCE_SERVER_ADDRESS"] = settings.INFERENCE_SERVER_ADDRESS
+    os.environ["INFERENCE_SERVER_AUTHKEY"] = settings.INFERENCE_SERVER_AUTHKEY
+    return processes
+
+
+class _ServerConnection:
+    """HTTP 工作进程到一个推理进程的连接：一条控制连接加一个共享内存槽环"""
+
+    def __init__(self, address: str, authkey: bytes, slot_count: int, slot_size: int):
+        self.address = address
+        # 推理进程在公布地址之前已开始监听，连接失败说明推理进程已退出
+        try:
+            self.conn = Client(address, authkey=authkey)
+        except OSError as e:
+            raise RuntimeError(f"无法连接推理进程 {address}: {e}")
+        self.ring = ShmRing(slot_count, slot_size)
+        self._send_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending: Dict[int, Future] = {}
+        self._ids = itertools.count()
+        self.closed = False
+        # 多个推理线程同时调用 run，计数在锁内更新
+        self._stats_lock = threading.Lock()
+        self.inflight = 0
+        self.requests = 0
+        self.inline_requests = 0
+        self._receiver = threading.Thread(target=self._receive, name="inference-client", daemon=True)
+        self._receiver.start()
+        try:
+            self.pid = self.call("hello", self.ring.name, slot_count, slot_size).result()["pid"]
+        except Exception:
+            self.close()
+            raise
+
+    def call(self, op: str, *args) -> Future:
+        future = Future()
+        with self._pending_lock:
+            if self.closed:
+                raise RuntimeError(f"推理进程连接已断开: {self.address}")
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+        with self._send_lock:
+            self.conn.send((op, request_id, args))
+        return future
+
+    def _receive(self):
+        while True:
+            try:
+                request_id, ok, payload = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._pending_lock:
+                future = self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(f"推理进程执行失败: {payload}"))
+        with self._pending_lock:
+            self.closed = True
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for future in pending:
+            future.set_exception(RuntimeError(f"推理进程连接已断开: {self.address}"))
+
+    def run(self, model: str, inputs: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        index = self.ring.acquire()
+        with self._stats_lock:
+            self.inflight += 1
+        try:
+            layout = self.ring.write(index, inputs)
+            if layout is None:
+                with self._stats_lock:
+                    self.inline_requests += 1
+            out_layout, inline = self.call("run", model, index, layout,
+                                           dict(inputs) if layout is None else None).result()
+            with self._stats_lock:
+                self.requests += 1
+            # 槽归还后会被下一个请求覆盖，输出需复制出来
+            return inline if out_layout is None else self.ring.read(index, out_layout, copy=True)
+        finally:
+            with self._stats_lock:
+                self.inflight -= 1
+            self.ring.release(index)
+
+    def close(self):
+        with self._pending_lock:
+            self.closed = True
+        self.conn.close()
+        self._receiver.join(timeout=5)
+        self.ring.close()
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            inflight, requests, inline_requests = self.inflight, self.requests, self.inline_requests
+        return {
+            "address": self.address,
+            "pid": self.pid,
+            "connected": not self.closed,
+            "inflight": inflight,
+            "requests": requests,
+            "inline_requests": inline_requests,
+            "slots": self.ring.slot_count,
+            "slot_bytes": self.ring.slot_size,
+        }
+
+
+class RemoteSession:
+    """推理进程中会话的本地代理，提供 ONNXService 用到的 InferenceSession 接口"""
+
+    def __init__(self, client: "InferenceClient", model: str, meta: Dict):
+        self.client = client
+        self.model = model
+        self._inputs = [NodeArg(*node) for node in meta["inputs"]]
+        self._outputs = [NodeArg(*node) for node in meta["outputs"]]
+        self._providers = list(meta["providers"])
+
+    def get_inputs(self) -> List[NodeArg]:
+        return self._inputs
+
+    def get_outputs(self) -> List[NodeArg]:
+        return self._outputs
+
+    def get_providers(self) -> List[str]:
+        return self._providers
+
+    def run(self, output_names: List[str], input_feed: Dict[str, np.ndarray]) -> List[np.ndarray]:
+        outputs = self.client.run(self.model, input_feed)
+        return [outputs[name] for name in output_names]
+
+
+class InferenceClient:
+    """
+    HTTP 工作进程一侧的推理客户端（配置了 INFERENCE_SERVER_ADDRESS 时启用）
+
+    首次使用时连接全部推理进程；每条连接各有 INFERENCE_WORKERS 个共享内存槽，
+    与本进程同时推理的线程数一致。请求发给在途请求最少的推理进程，连接断开后下次使用时重连。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections: Dict[str, _ServerConnection] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.INFERENCE_SERVER_ADDRESS)
+
+    def _get_connections(self) -> List[_ServerConnection]:
+        """已连接的推理进程；断开的连接重新建立，连接不上的推理进程跳过"""
+        errors = []
+        with self._lock:
+            for address in settings.INFERENCE_SERVER_ADDRESS.split(","):
+                connection = self._connections.get(address)
+                if connection is not None and connection.closed:
+                    del self._connections[address]
+                    connection.close()
+                    connection = None
+                if connection is None:
+                    try:
+                        self._connections[address] = _ServerConnection(
+                            address, bytes.fromhex(settings.INFERENCE_SERVER_AUTHKEY),
+                            settings.INFERENCE_WORKERS, settings.INFERENCE_SHM_SLOT_MB * 1024 * 1024,
+                        )
+                    except RuntimeError as e:
+                        errors.append(str(e))
+            connections = list(self._connections.values())
+        if not connections:
+            raise RuntimeError("; ".join(errors) or "未配置推理进程")
+        return connections
+
+    def session(self, model: str) -> RemoteSession:
+        """在全部推理进程中加载模型，返回会话代理"""
+        futures = [connection.call("load", model) for connection in self._get_connections()]
+        metas = [future.result() for future in futures]
+        return RemoteSession(self, model, metas[0])
+
+    def run(self, model: str, inputs: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        connection = min(self._get_connections(), key=lambda c: c.inflight)
+        return connection.run(model, inputs)
+
+    def close(self):
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for connection in connections:
+            connection.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            connections = list(self._connections.values())
+        return {
+            "enabled": self.enabled,
+            "servers": [connection.stats() for connection in connections],
+        }
+
+
+# 创建全局推理客户端实例
+inference_client = InferenceClient()
@@ -0,0 +1,475 @@
+import asyncio
+import contextvars
+import csv
+import io
+import os
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from app.config import settings
+from app.services.base64_service import ImageEncoding
+from app.services.image_service import image_service
+from app.services.inference_executor import InferenceQueueFullError
+from app.services.model_registry import model_registry
+
+# 压缩包内可选的清单文件：列 name,query,gerber,gerber_id（gerber 与 gerber_id 二选一）
+MANIFEST_NAME = "manifest.csv"
+# 汇总文件的列
+SUMMARY_FIELDS = ("name", "query", "gerber", "gerber_id", "status", "anomaly_score", "is_defect",
+                  "defect_description", "error", "elapsed_ms")
+
+
+class JobNotFoundError(KeyError):
+    """批量任务不存在（或已被清理）"""
+
+
+def _camel_keys(record: Dict) -> Dict:
+    """流式结果沿用 /api/process 响应的驼峰字段名（anomaly_score -> anomalyScore）"""
+    def camel(key: str) -> str:
+        head, *rest = key.split("_")
+        return head + "".join(part.title() for part in rest)
+    return {camel(key): value for key, value in record.items()}
+
+
+def find_pairs(names: List[str]) -> List[Dict]:
+    """
+    按 X.jpg / XG.jpg 规则配对（同一目录内，文件名不区分大小写，与 test_images.py 一致）
+
+    Returns:
+        [{"name": "X", "query": "dir/X.jpg", "gerber": "dir/XG.jpg"}, ...]
+    """
+    images: Dict[str, str] = {}
+    for name in names:
+        base = os.path.basename(name)
+        if not base or base.startswith(".") or "__MACOSX" in name:
+            continue
+        stem, ext = os.path.splitext(name)
+        if ext.lower() in settings.ALLOWED_EXTENSIONS:
+            images[stem.lower()] = name
+
+    pairs = []
+    for stem, name in sorted(images.items()):
+        gerber = images.get(stem + "g")
+        if gerber is not None:
+            pairs.append({"name": os.path.splitext(name)[0], "query": name, "gerber": gerber})
+    return pairs
+
+
+class InspectionJob:
+    """一个批量检测任务：输入为压缩包（存盘）或Base64清单（内存），结果按输入顺序保存"""
+
+    def __init__(self, job_id: str, model: str, pairs: List[Dict], archive_path: str = None,
+                 encoding: ImageEncoding = None):
+        self.job_id = job_id
+        self.model = model
+        self.pairs = pairs
+        self.archive_path = archive_path
+        # 结果图片编码（仅流式检测输出图片时使用）
+        self.encoding = encoding
+        self.status = "queued"
+        self.results: List[Optional[Dict]] = [None] * len(pairs)
+        self.completed = 0
+        self.failed = 0
+        self.defects = 0
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self._archive: Optional[zipfile.ZipFile] = None
+        self._archive_lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    def read_pair(self, pair: Dict) -> Tuple[bytes, Optional[bytes]]:
+        """从压缩包读取一对图片的原始字节（在线程中调用）"""
+        with self._archive_lock:
+            if self._archive is None:
+                self._archive = zipfile.ZipFile(self.archive_path)
+            query = self._read_member(pair["query"])
+            gerber = self._read_member(pair["gerber"]) if pair.get("gerber") else None
+        return query, gerber
+
+    def _read_member(self, name: str) -> bytes:
+        info = self._archive.getinfo(name)
+        if info.file_size > settings.MAX_FILE_SIZE:
+            raise ValueError(f"{name} 超过单个文件大小上限 {settings.MAX_FILE_SIZE // (1024 * 1024)}MB")
+        return self._archive.read(info)
+
+    def close(self):
+        with self._archive_lock:
+            if self._archive is not None:
+                self._archive.close()
+                self._archive = None
+
+    def info(self, offset: int = 0, limit: Optional[int] = None) -> Dict:
+        """任务进度与已完成的部分结果（按输入顺序，可分页）"""
+        done = self.completed + self.failed
+        end = self.finished_at or time.time()
+        elapsed = (end - self.started_at) if self.started_at else 0.0
+        finished_results = [r for r in self.results if r is not None]
+        page = finished_results[offset:offset + limit if limit is not None else None]
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "model": self.model,
+            "total": len(self.pairs),
+            "completed": self.completed,
+            "failed": self.failed,
+            "defects": self.defects,
+            "progress": done / len(self.pairs) if self.pairs else 1.0,
+            "pairs_per_second": done / elapsed if elapsed > 0 else 0.0,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "results": page,
+            "summary_url": f"/api/jobs/{self.job_id}/summary",
+        }
+
+    def summary_csv(self) -> bytes:
+        """逐对的分数与描述（CSV，带BOM便于Excel直接打开中文）"""
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=SUMMARY_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for pair, result in zip(self.pairs, self.results):
+            row = {"name": pair["name"], "query": pair.get("query"), "gerber": pair.get("gerber"),
+                   "gerber_id": pair.get("gerber_id"), "status": "pending"}
+            if result is not None:
+                row.update(result)
+            writer.writerow(row)
+        return buffer.getvalue().encode("utf-8-sig")
+
+
+class JobService:
+    """
+    批量检测任务服务
+
+    提交时立即返回任务ID，后台按 JOB_CONCURRENCY 个并发逐对调用检测流程（与在线请求共用
+    推理执行器、动态组批与结果缓存），客户端轮询进度、分页获取部分结果，完成后下载汇总。
+    推理队列已满时任务退避重试而不是失败，在线请求优先。
+    任务状态只保存在内存中，服务重启后丢失；已结束的任务超过 JOB_MAX_FINISHED 个时清理最早的。
+    """
+
+    def __init__(self, job_dir: str = None):
+        self.job_dir = settings.JOB_DIR if job_dir is None else job_dir
+        self._jobs: "OrderedDict[str, InspectionJob]" = OrderedDict()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    # ---- 创建任务 ----
+
+    def new_job_id(self) -> str:
+        return uuid.uuid4().hex
+
+    def archive_path(self, job_id: str) -> str:
+        return os.path.join(self.job_dir, job_id, "input.zip")
+
+    def save_archive(self, job_id: str, fileobj) -> str:
+        """
+        分块把上传的压缩包写入任务目录（在线程中调用），不把整个文件读入内存
+
+        Raises:
+            ValueError: 超过 JOB_MAX_ARCHIVE_MB
+        """
+        path = self.archive_path(job_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        limit = settings.JOB_MAX_ARCHIVE_MB * 1024 * 1024
+        size = 0
+        try:
+            with open(path, "wb") as out:
+                while True:
+                    chunk = fileobj.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > limit:
+                        raise ValueError(f"压缩包超过上限 {settings.JOB_MAX_ARCHIVE_MB}MB")
+                    out.write(chunk)
+        except BaseException:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+            raise
+        return path
+
+    def discard_archive(self, job_id: str):
+        """提交失败时删除已保存的压缩包"""
+        shutil.rmtree(os.path.dirname(self.archive_path(job_id)), ignore_errors=True)
+
+    def pairs_from_archive(self, path: str) -> List[Dict]:
+        """
+        解析压缩包中的图片对（在线程中调用）：有 manifest.csv 时按清单，否则按文件名配对
+
+        Raises:
+            ValueError: 不是有效的zip、清单引用了不存在的文件或没有可配对的图片
+        """
+        if not zipfile.is_zipfile(path):
+            raise ValueError("上传的文件不是有效的zip压缩包")
+        with zipfile.ZipFile(path) as archive:
+            names = [info.filename for info in archive.infolist() if not info.is_dir()]
+            manifest = next((n for n in names if os.path.basename(n).lower() == MANIFEST_NAME), None)
+            if manifest is None:
+                pairs = find_pairs(names)
+            else:
+                text = archive.read(manifest).decode("utf-8-sig")
+                pairs = self._parse_manifest(text, os.path.dirname(manifest), set(names))
+        if not pairs:
+            raise ValueError("压缩包中没有可配对的图片（X.jpg 与 XG.jpg，或提供 manifest.csv）")
+        if len(pairs) > settings.JOB_MAX_PAIRS:
+            raise ValueError(f"图片对数量 {len(pairs)} 超过上限 {settings.JOB_MAX_PAIRS}")
+        return pairs
+
+    @staticmethod
+    def _parse_manifest(text: str, base_dir: str, names: set) -> List[Dict]:
+        pairs = []
+        for row_no, row in enumerate(csv.DictReader(io.StringIO(text)), start=2):
+            query = (row.get("query") or "").strip()
+            gerber = (row.get("gerber") or "").strip() or None
+            gerber_id = (row.get("gerber_id") or "").strip() or None
+            if not query or (gerber is None) == (gerber_id is None):
+                raise ValueError(f"{MANIFEST_NAME} 第{row_no}行: 需要 query，且 gerber 与 gerber_id 二选一")
+            # 清单中的路径相对于清单所在目录
+            query = os.path.join(base_dir, query).replace(os.sep, "/") if base_dir else query
+            if gerber is not None and base_dir:
+                gerber = os.path.join(base_dir, gerber).replace(os.sep, "/")
+            for member in (query, gerber):
+                if member is not None and member not in names:
+                    raise ValueError(f"{MANIFEST_NAME} 第{row_no}行: 压缩包中不存在 {member}")
+            name = (row.get("name") or "").strip() or os.path.splitext(query)[0]
+            pairs.append({"name": name, "query": query, "gerber": gerber, "gerber_id": gerber_id})
+        return pairs
+
+    def submit(self, job_id: str, model: str, pairs: List[Dict], archive_path: str = None) -> InspectionJob:
+        """
+        登记任务并在后台开始处理（需在事件循环中调用）
+
+        pairs 来自压缩包时 query/gerber 为包内文件名；来自JSON清单时 query_image/gerber_image
+        为Base64字符串（不出现在结果与汇总中）。
+
+        Raises:
+            ValueError: 未注册的模型名或图片对数量不合法
+        """
+        self._validate(model, pairs)
+        job = InspectionJob(job_id, model, pairs, archive_path)
+        self._jobs[job_id] = job
+        self._evict_finished()
+        # 在空上下文中创建任务，避免后台处理的阶段耗时计入提交请求的追踪记录
+        job.task = contextvars.Context().run(asyncio.create_task, self._run(job))
+        print(f"📦 批量任务 {job_id} 已提交: {len(pairs)} 对，模型 {model}")
+        return job
+
+    @staticmethod
+    def _validate(model: str, pairs: List[Dict]):
+        model_registry.spec(model)
+        if not pairs:
+            raise ValueError("至少需要一对图片")
+        if len(pairs) > settings.JOB_MAX_PAIRS:
+            raise ValueError(f"图片对数量 {len(pairs)} 超过上限 {settings.JOB_MAX_PAIRS}")
+
+    def stream(self, model: str, pairs: List[Dict], archive_path: str = None,
+               include_images: bool = False, stream_id: str = None,
+               encoding: ImageEncoding = None) -> AsyncIterator[Dict]:
+        """
+        流式检测：返回按完成顺序逐个产出结果记录的异步迭代器，最后产出一条汇总记录
+
+        与批量任务共用并发上限与检测流程，但不登记为任务。结果队列有界：
+        客户端读取变慢时检测随之暂停，服务端不会堆积结果；客户端断开时取消剩余检测
+        并删除上传的压缩包。include_images 为 True 时图片按 encoding 编码后保存到 uploads/processed，
+        记录中给出访问URL。
+
+        Raises:
+            ValueError: 未注册的模型名或图片对数量不合法（在开始产出之前抛出）
+        """
+        self._validate(model, pairs)
+        job = InspectionJob(stream_id or self.new_job_id(), model, pairs, archive_path, encoding)
+        return self._stream(job, include_images)
+
+    async def _stream(self, job: InspectionJob, include_images: bool) -> AsyncIterator[Dict]:
+        concurrency = settings.JOB_CONCURRENCY or settings.INFERENCE_WORKERS
+        results: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+        indices = iter(range(len(job.pairs)))
+
+        async def worker():
+            for index in indices:
+                async with self._get_semaphore():
+                    record = await self._inspect_pair(job, index, include_images)
+                # 队列满（客户端未及时读取）时在此等待，不再取新的图片对
+                await results.put(record)
+
+        job.status = "running"
+        job.started_at = time.time()
+        # 与批量任务相同，检测在空上下文中执行，不计入本次请求的 Server-Timing
+        workers = [contextvars.Context().run(asyncio.create_task, worker())
+                   for _ in range(min(concurrency, len(job.pairs)))]
+        try:
+            for _ in range(len(job.pairs)):
+                yield _camel_keys(await results.get())
+            job.status = "completed"
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            job.finished_at = time.time()
+            job.close()
+            self._remove_files(job)
+        summary = job.info(limit=0)
+        summary.pop("results")
+        summary.pop("summary_url")
+        yield _camel_keys({"type": "summary", **summary})
+
+    # ---- 执行 ----
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.JOB_CONCURRENCY or settings.INFERENCE_WORKERS)
+        return self._semaphore
+
+    async def _run(self, job: InspectionJob):
+        job.status = "running"
+        job.started_at = time.time()
+        indices = iter(range(len(job.pairs)))
+
+        async def worker():
+            for index in indices:
+                async with self._get_semaphore():
+                    await self._process_pair(job, index)
+
+        concurrency = settings.JOB_CONCURRENCY or settings.INFERENCE_WORKERS
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(concurrency, len(job.pairs)))))
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            job.close()
+            # 结果与汇总保存在内存中，任务结束后不再需要上传的压缩包
+            self._remove_files(job)
+            print(f"✅ 批量任务 {job.job_id} {job.status}: 成功 {job.completed}，失败 {job.failed}，"
+                  f"缺陷 {job.defects}，耗时 {job.finished_at - job.started_at:.1f}s")
+
+    async def _process_pair(self, job: InspectionJob, index: int):
+        job.results[index] = await self._inspect_pair(job, index)
+
+    async def _inspect_pair(self, job: InspectionJob, index: int, include_images: bool = False) -> Dict:
+        """检测一对图片，返回结果记录（单对失败记为 failed，不抛出）"""
+        pair = job.pairs[index]
+        start = time.perf_counter()
+        record = {"type": "result", "index": index, "name": pair["name"], "query": pair.get("query"),
+                  "gerber": pair.get("gerber"), "gerber_id": pair.get("gerber_id")}
+        try:
+            if job.archive_path:
+                query, gerber = await asyncio.to_thread(job.read_pair, pair)
+                inspect = image_service.inspect_pcb_bytes
+            else:
+                query, gerber = pair["query_image"], pair.get("gerber_image")
+                inspect = image_service.inspect_pcb_images
+            result = await self._inspect_with_retry(inspect, query, gerber, job.model, pair.get("gerber_id"),
+                                                    include_images, job.encoding)
+            score = result["anomaly_score"]
+            record.update({
+                "status": "done",
+                "anomaly_score": score,
+                "is_defect": score > settings.ANOMALY_THRESHOLD,
+                "defect_description": result["defect_description"],
+            })
+            if include_images:
+                record.update(await asyncio.to_thread(self._save_images, job.job_id, index, result))
+            job.completed += 1
+            if record["is_defect"]:
+                job.defects += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            record.update({"status": "failed", "error": str(e) or type(e).__name__})
+            job.failed += 1
+        record["elapsed_ms"] = round((time.perf_counter() - start) * 1000.0, 1)
+        return record
+
+    @staticmethod
+    def _save_images(job_id: str, index: int, result: Dict) -> Dict:
+        """把结果图片写入 uploads/processed，返回 /api/files/processed 下的访问URL"""
+        directory = os.path.join(settings.UPLOAD_DIR, "processed")
+        os.makedirs(directory, exist_ok=True)
+        urls = {}
+        image_format = result.get("image_format") or "png"
+        extension = ImageEncoding(image_format).extension
+        for name, key in (("converted", "converted_gerber_url"), ("anomaly", "anomaly_image_url")):
+            data = result.get(f"{name}_bytes")
+            if data is None:
+                continue
+            filename = f"{job_id}_{index}_{name}.{extension}"
+            with open(os.path.join(directory, filename), "wb") as f:
+                f.write(data)
+            urls[key] = f"/api/files/processed/{filename}"
+        return urls
+
+    @staticmethod
+    async def _inspect_with_retry(inspect, query, gerber, model: str, gerber_id: Optional[str],
+                                  include_images: bool = False, encoding: ImageEncoding = None) -> Dict:
+        """推理队列已满时退避重试，批量任务让位于在线请求"""
+        delay = 0.05
+        while True:
+            try:
+                return await inspect(query, gerber, model, include_images=include_images, gerber_id=gerber_id,
+                                     encoding=encoding)
+            except InferenceQueueFullError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 1.0)
+
+    # ---- 查询与清理 ----
+
+    def get(self, job_id: str) -> InspectionJob:
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise JobNotFoundError(job_id)
+        return job
+
+    def list_jobs(self) -> List[Dict]:
+        return [{k: v for k, v in job.info(limit=0).items() if k != "results"}
+                for job in reversed(self._jobs.values())]
+
+    def delete(self, job_id: str):
+        """取消（如仍在运行）并删除任务及其上传文件"""
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            raise JobNotFoundError(job_id)
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+        job.close()
+        self._remove_files(job)
+
+    def _remove_files(self, job: InspectionJob):
+        if job.archive_path:
+            shutil.rmtree(os.path.dirname(job.archive_path), ignore_errors=True)
+
+    def _evict_finished(self):
+        finished = [job for job in self._jobs.values() if job.finished]
+        for job in finished[:max(0, len(finished) - settings.JOB_MAX_FINISHED)]:
+            del self._jobs[job.job_id]
+            self._remove_files(job)
+
+    def shutdown(self):
+        """取消所有未完成的任务"""
+        for job in self._jobs.values():
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+
+    def stats(self) -> Dict:
+        statuses: Dict[str, int] = {}
+        for job in self._jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {"jobs": len(self._jobs), "by_status": statuses,
+                "concurrency": settings.JOB_CONCURRENCY or settings.INFERENCE_WORKERS}
+
+
+# 创建全局批量任务服务实例
+job_service = JobService()
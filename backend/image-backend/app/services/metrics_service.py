@@ -0,0 +1,269 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+from app.services.trace_service import record_stage
+
+# 各阶段耗时（秒）的默认分桶：覆盖 1ms ~ 30s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 图片像素数（百万像素）分桶
+MEGAPIXEL_BUCKETS = (0.065, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 12.0, 16.0, 24.0, 50.0)
+# 图片文件大小（字节）分桶
+BYTES_BUCKETS = (16e3, 64e3, 256e3, 512e3, 1e6, 2e6, 5e6, 10e6, 20e6)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+
+
+class Counter(_Metric):
+    """只增计数器"""
+
+    metric_type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}" for labels, v in items]
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值；也可由回调在采集时计算"""
+
+    metric_type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback: Callable[[], Dict[Tuple, float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def render(self) -> List[str]:
+        if self._callback is not None:
+            items = sorted(self._callback().items())
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}" for labels, v in items]
+
+
+class CallbackCounter(Gauge):
+    """由回调读取已有统计（如缓存命中数）的计数器，采集时才计算"""
+
+    metric_type = "counter"
+
+
+class Histogram(_Metric):
+    """
+    直方图
+
+    每次 observe 只做一次二分查找与一次加锁累加，采集时再计算累积分桶，
+    开销足够低，可在生产满载下常开。
+    """
+
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各分桶计数（最后一项为 +Inf）, 总和]
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = [[0] * (len(self.buckets) + 1), 0.0]
+                self._series[labels] = series
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """记录 with 代码块的耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        lines = []
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表，按 Prometheus 文本格式（0.0.4）输出"""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.render()
+            except Exception as e:
+                # 单个回调出错不影响其余指标的采集
+                print(f"⚠️ 指标 {metric.name} 采集失败: {e}")
+                continue
+            lines.extend(metric.header())
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+# 全局指标注册表与检测流程用到的指标
+registry = MetricsRegistry()
+
+STAGE_DURATION = registry.histogram(
+    "pcb_stage_duration_seconds",
+    "Duration of each inspection pipeline stage (heatmap is part of postprocess)",
+    ["stage"],
+)
+REQUEST_DURATION = registry.histogram(
+    "pcb_http_request_duration_seconds", "HTTP request latency", ["method", "endpoint"]
+)
+REQUESTS_TOTAL = registry.counter(
+    "pcb_http_requests_total", "HTTP requests by endpoint and status code", ["method", "endpoint", "status"]
+)
+REQUESTS_IN_FLIGHT = registry.gauge("pcb_http_requests_in_flight", "HTTP requests currently being served")
+QUEUE_WAIT = registry.histogram(
+    "pcb_inference_queue_wait_seconds", "Time a task waited for a free inference executor thread"
+)
+MODEL_LOAD_SECONDS = registry.gauge("pcb_model_load_seconds", "Time taken to load each model", ["model"])
+IMAGE_MEGAPIXELS = registry.histogram(
+    "pcb_input_image_megapixels", "Decoded input image size in megapixels", ["role"], MEGAPIXEL_BUCKETS
+)
+IMAGE_BYTES = registry.histogram(
+    "pcb_input_image_bytes", "Encoded input image size in bytes", ["role"], BYTES_BUCKETS
+)
+
+
+def observe_stage(stage: str, seconds: float):
+    """记录检测流程某一阶段的耗时（直方图 + 当前请求的 Server-Timing/追踪）"""
+    STAGE_DURATION.observe(seconds, stage)
+    record_stage(stage, seconds)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """记录 with 代码块作为检测流程某一阶段的耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def register_callback_metrics(executor, result_cache, model_registry):
+    """把已有组件的统计值注册为采集时计算的指标"""
+    registry.register(Gauge(
+        "pcb_inference_admitted", "Requests admitted by the inference executor (running + queued)",
+        callback=lambda: {(): executor.stats()["admitted"]},
+    ))
+    registry.register(Gauge(
+        "pcb_inference_waiting", "Admitted requests waiting for an executor thread",
+        callback=lambda: {(): executor.stats()["waiting"]},
+    ))
+    registry.register(CallbackCounter(
+        "pcb_inference_rejected_total", "Requests rejected because the inference queue was full",
+        callback=lambda: {(): executor.stats()["rejected"]},
+    ))
+    if result_cache is not None:
+        registry.register(CallbackCounter(
+            "pcb_result_cache_requests_total", "Result cache lookups by outcome", ["outcome"],
+            callback=lambda: {
+                (outcome,): result_cache.stats()[key]
+                for outcome, key in (("memory_hit", "memory_hits"), ("disk_hit", "disk_hits"),
+                                     ("coalesced", "coalesced"), ("miss", "misses"))
+            },
+        ))
+
+    def _batches():
+        models = model_registry.stats()["models"]
+        return {(name,): info["batching"].get("batches", 0) for name, info in models.items()}
+
+    def _loaded():
+        models = model_registry.stats()["models"]
+        return {(name,): 1 if info["loaded"] else 0 for name, info in models.items()}
+
+    registry.register(CallbackCounter(
+        "pcb_inference_batches_total", "session.run calls issued by the micro-batching scheduler", ["model"],
+        callback=_batches,
+    ))
+    registry.register(Gauge("pcb_model_loaded", "Whether each model is currently loaded", ["model"],
+                            callback=_loaded))
@@ -0,0 +1,245 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Tuple
+from app.config import settings
+from app.services.onnx_service import ONNXService
+from app.services.metrics_service import MODEL_LOAD_SECONDS
+
+
+def process_rss() -> int:
+    """当前进程的常驻内存字节数（读取 /proc/self/statm，不支持的平台返回0）"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+
+def load_model_manifest(path: str = None) -> Dict[str, Dict]:
+    """
+    读取 quantize.py 写入的模型清单（模型名 -> MODELS 格式的配置），文件不存在或无法解析时返回空
+
+    清单中的模型路径相对于清单所在目录，这里转换为可直接打开的路径，与服务的工作目录无关。
+    """
+    path = settings.MODELS_MANIFEST if path is None else path
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            models = json.load(f).get("models", {})
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 模型清单读取失败，已忽略: {path}: {e}")
+        return {}
+    directory = os.path.dirname(os.path.abspath(path))
+    for cfg in models.values():
+        model_path = os.path.join(directory, cfg["path"])
+        # 旧清单中的路径相对于运行 quantize.py 时的工作目录
+        if os.path.exists(model_path) or not os.path.exists(cfg["path"]):
+            cfg["path"] = model_path
+    return models
+
+
+class ModelSpec:
+    """注册表中的一个模型：ONNX 路径与输入分辨率"""
+
+    def __init__(self, name: str, path: str, input_size, tiled: bool = False, quantization: str = None):
+        self.name = name
+        self.path = path
+        # 为 True 时大图按模型输入尺寸切片推理（见 TiledInference）
+        self.tiled = tiled
+        # 量化方式（dynamic / static），FP32 模型为 None
+        self.quantization = quantization
+        # input_size 可为整数（正方形）或 (W, H)
+        if isinstance(input_size, int):
+            input_size = (input_size, input_size)
+        self.input_shape: Tuple[int, int] = tuple(input_size)
+
+    def fingerprint(self) -> str:
+        """模型标识（模型名、文件路径、大小与修改时间），模型文件替换后随之改变，用于结果缓存键"""
+        try:
+            stat = os.stat(self.path)
+            return f"{self.name}:{os.path.abspath(self.path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        except OSError:
+            return f"{self.name}:{os.path.abspath(self.path)}"
+
+    def file_bytes(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def estimated_bytes(self) -> int:
+        """无法测量时的内存估算：文件大小 x MODEL_MEMORY_FACTOR"""
+        return int(self.file_bytes() * settings.MODEL_MEMORY_FACTOR)
+
+
+class ModelRegistry:
+    """
+    多模型注册表
+
+    模型名（即请求中的 model 参数）映射到 ONNX 路径与输入分辨率（settings.MODELS，
+    另合并 MODELS_MANIFEST 中通过精度校验的量化模型）。
+    会话在首次使用时加载（MODEL_PRELOAD 中的模型由 StartupService 在启动时预加载并预热）；
+    已加载模型的总占用超过 MODEL_MEMORY_LIMIT_MB 时，按最久未使用顺序卸载空闲模型。
+    正在推理中的模型（acquire 未释放）不会被卸载。
+
+    每个模型的占用为创建会话前后进程常驻内存（RSS）的增长，至少按文件大小计；
+    无法读取RSS时按 ModelSpec.estimated_bytes 估算。同时加载的其他模型会计入测量值，结果偏保守。
+    会话由推理进程持有时（INFERENCE_SERVER_ADDRESS），本进程只有代理，不计占用，
+    上限由推理进程自己的注册表执行。
+    """
+
+    def __init__(self, models: Dict[str, Dict] = None, memory_limit_mb: int = None):
+        if models is None:
+            models = {**load_model_manifest(), **settings.MODELS}
+        self.specs: Dict[str, ModelSpec] = {
+            name: ModelSpec(name, cfg["path"], cfg.get("input_size", 256), cfg.get("tiled", False),
+                            cfg.get("quantization"))
+            for name, cfg in models.items()
+        }
+        limit_mb = settings.MODEL_MEMORY_LIMIT_MB if memory_limit_mb is None else memory_limit_mb
+        self.memory_limit = limit_mb * 1024 * 1024
+
+        self._lock = threading.Lock()
+        # 已加载模型，按最近使用排序
+        self._loaded: "OrderedDict[str, ONNXService]" = OrderedDict()
+        self._in_use: Dict[str, int] = {}
+        # 已加载模型的内存占用（加载时测量）
+        self._resident: Dict[str, int] = {}
+        self._load_locks: Dict[str, threading.Lock] = {name: threading.Lock() for name in self.specs}
+        self._evictions = 0
+
+    def spec(self, name: str) -> ModelSpec:
+        """
+        Raises:
+            ValueError: 未注册的模型名
+        """
+        spec = self.specs.get(name)
+        if spec is None:
+            raise ValueError(f"不支持的模型: {name}，可选: {', '.join(self.specs)}")
+        return spec
+
+    def get(self, name: str) -> ONNXService:
+        """
+        获取已加载的模型服务（未加载时同步加载，CPU/IO密集，应在推理执行器中调用）
+
+        Raises:
+            ValueError: 未注册的模型名
+            RuntimeError: 模型加载失败
+        """
+        spec = self.spec(name)
+        with self._lock:
+            service = self._loaded.get(name)
+            if service is not None:
+                self._loaded.move_to_end(name)
+                return service
+
+        # 同一模型只加载一次，不同模型可并行加载
+        with self._load_locks[name]:
+            with self._lock:
+                service = self._loaded.get(name)
+                if service is not None:
+                    return service
+
+            service = ONNXService(spec.input_shape, model_path=spec.path, name=name, tiled=spec.tiled)
+            start = time.perf_counter()
+            rss_before = process_rss()
+            if not service.load_model(spec.path):
+                raise RuntimeError(f"模型 {name} 加载失败，请检查 settings.MODELS 中的路径: {spec.path}")
+            resident = self._measure(spec, rss_before)
+            MODEL_LOAD_SECONDS.set(time.perf_counter() - start, name)
+
+            with self._lock:
+                self._loaded[name] = service
+                self._resident[name] = resident
+                evicted = self._evict_locked(keep=name)
+        for old in evicted:
+            old.shutdown()
+            print(f"♻️ 已卸载模型 {old.name}（超出 MODEL_MEMORY_LIMIT_MB）")
+        return service
+
+    @staticmethod
+    def _measure(spec: ModelSpec, rss_before: int) -> int:
+        """刚加载的模型的内存占用"""
+        if settings.INFERENCE_SERVER_ADDRESS:
+            return 0
+        if rss_before <= 0:
+            return spec.estimated_bytes()
+        # 释放过的内存可能被新会话复用，RSS 增长会偏小，至少按权重大小计
+        return max(process_rss() - rss_before, spec.file_bytes())
+
+    @contextmanager
+    def acquire(self, name: str):
+        """使用期间模型不会被卸载"""
+        with self._lock:
+            self._in_use[name] = self._in_use.get(name, 0) + 1
+        try:
+            yield self.get(name)
+        finally:
+            with self._lock:
+                self._in_use[name] -= 1
+                evicted = self._evict_locked()
+            for old in evicted:
+                old.shutdown()
+                print(f"♻️ 已卸载模型 {old.name}（超出 MODEL_MEMORY_LIMIT_MB）")
+
+    def _resident_bytes_locked(self) -> int:
+        return sum(self._resident.get(name, 0) for name in self._loaded)
+
+    def _evict_locked(self, keep: str = None):
+        """按LRU移除空闲模型直到总大小不超过上限，返回需要关闭的服务"""
+        evicted = []
+        for name in list(self._loaded):
+            if self._resident_bytes_locked() <= self.memory_limit:
+                break
+            if name == keep or self._in_use.get(name, 0) > 0:
+                continue
+            evicted.append(self._loaded.pop(name))
+            self._resident.pop(name, None)
+            self._evictions += 1
+        return evicted
+
+    def shutdown(self):
+        """卸载全部模型"""
+        with self._lock:
+            services = list(self._loaded.values())
+            self._loaded.clear()
+            self._resident.clear()
+        for service in services:
+            service.shutdown()
+
+    def stats(self) -> Dict:
+        """各模型的配置、加载状态与组批统计"""
+        with self._lock:
+            loaded = dict(self._loaded)
+            in_use = dict(self._in_use)
+            resident_by_model = dict(self._resident)
+            resident = self._resident_bytes_locked()
+        models = {}
+        for name, spec in self.specs.items():
+            service = loaded.get(name)
+            models[name] = {
+                "path": spec.path,
+                "input_size": list(service.input_shape if service else spec.input_shape),
+                "tiled": spec.tiled,
+                "quantization": spec.quantization,
+                "loaded": service is not None,
+                "in_use": in_use.get(name, 0),
+                "resident_bytes": resident_by_model.get(name, 0) if service else 0,
+                "batching": service.get_batching_stats() if service else {"enabled": False},
+            }
+        return {
+            "default": settings.DEFAULT_MODEL,
+            "memory_limit_bytes": self.memory_limit,
+            "resident_bytes": resident,
+            "evictions": self._evictions,
+            "models": models,
+        }
+
+
+# 创建全局模型注册表实例
+model_registry = ModelRegistry()
@@ -1,21 +1,57 @@
 import os
+import hashlib
+import platform
+import functools
 import cv2
 import numpy as np
-import onnxruntime as ort
-from typing import Dict, Tuple
+import time
+from typing import Dict, List, Tuple
 from app.config import settings
+from app.services.batch_scheduler import BatchScheduler
+from app.services.heatmap_service import heatmap_renderer
+from app.services.preprocess_service import ImagePreprocessor, IMAGENET_MEAN, IMAGENET_STD
+from app.services.metrics_service import stage_timer
+from app.services.tiling_service import TiledInference
+
+@functools.lru_cache(maxsize=1)
+def cpu_features() -> str:
+    """
+    CPU指令集特征（/proc/cpuinfo 的 flags / Features 行，读取不到时为 platform.processor()）
+
+    "all" 级别的优化会按指令集选择融合算子与权重预打包格式，同一架构的不同CPU不能共用优化结果。
+    """
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name.strip() in ("flags", "Features"):
+                    return " ".join(sorted(value.split()))
+    except OSError:
+        pass
+    return platform.processor()
+
 
 class ONNXService:
     """ONNX模型推理服务"""
     
-    def __init__(self):
+    def __init__(self, input_shape: Tuple[int, int] = (256, 256), model_path: str = None, name: str = None,
+                 tiled: bool = False):
         self.session = None
         self.model_loaded = False
-        self.input_shape = (256, 256)
+        self.input_shape = tuple(input_shape)  # 模型输入尺寸 (W, H)
+        self.model_path = model_path
+        self.name = name
+        # 大图切片推理模式（见 run_tiled_inference）
+        self.tiled = tiled
+        self.output_names = []
+        # 动态微批调度器（模型支持可变batch且 BATCH_MAX_SIZE > 1 时启用）
+        self.scheduler = None
         
         # ImageNet标准化参数
-        self.imagenet_mean = np.array([0.485, 0.456, 0.406], dtype=np.float32).reshape(1, 1, 3)
-        self.imagenet_std = np.array([0.229, 0.224, 0.225], dtype=np.float32).reshape(1, 1, 3)
+        self.imagenet_mean = np.array(IMAGENET_MEAN, dtype=np.float32).reshape(1, 1, 3)
+        self.imagenet_std = np.array(IMAGENET_STD, dtype=np.float32).reshape(1, 1, 3)
+        # 预处理器（每个工作线程复用自己的输入缓冲区）
+        self.preprocessor = ImagePreprocessor(self.input_shape)
     
     def load_model(self, model_path: str = None):
         """加载ONNX模型"""
@@ -25,7 +61,7 @@ class ONNXService:
             return True
             
         if model_path is None:
-            model_path = getattr(settings, 'ONNX_MODEL_PATH', 'models/pcb_defect_detection.onnx')
+            model_path = self.model_path or getattr(settings, 'ONNX_MODEL_PATH', 'models/pcb_defect_detection.onnx')
         
         if not os.path.exists(model_path):
             print(f"警告: ONNX模型文件不存在: {model_path}")
@@ -34,6 +70,7 @@ class ONNXService:
         
         try:
             # 如果已有session，先清理
+            self._stop_scheduler()
             if self.session is not None:
                 del self.session
                 self.session = None
@@ -42,14 +79,18 @@ class ONNXService:
             providers = ['CPUExecutionProvider']
             # 如果有GPU，可以添加: ['CUDAExecutionProvider', 'CPUExecutionProvider']
             
-            self.session = ort.InferenceSession(model_path, providers=providers)
+            self.session = self._create_session(model_path, providers)
+            self.output_names = [output.name for output in self.session.get_outputs()]
+            self._check_input_shape()
             self.model_loaded = True
+            self._setup_scheduler()
             
             print(f"✅ ONNX模型加载成功: {model_path}")
             print(f"📊 使用执行提供者: {self.session.get_providers()}")
             
             # 打印模型信息
-            self._print_model_info()
+            if settings.PRINT_MODEL_INFO:
+                self._print_model_info()
             
             return True
             
@@ -61,6 +102,192 @@ class ONNXService:
                 self.session = None
             return False
     
+    def _session_options(self) -> "ort.SessionOptions":
+        """按 settings 中的 ORT_* 配置构建会话选项"""
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if settings.ORT_INTRA_OP_THREADS > 0:
+            options.intra_op_num_threads = settings.ORT_INTRA_OP_THREADS
+        if settings.ORT_INTER_OP_THREADS > 0:
+            options.inter_op_num_threads = settings.ORT_INTER_OP_THREADS
+
+        execution_modes = {
+            "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+            "parallel": ort.ExecutionMode.ORT_PARALLEL,
+        }
+        mode = settings.ORT_EXECUTION_MODE.lower()
+        if mode not in execution_modes:
+            raise ValueError(f"不支持的 ORT_EXECUTION_MODE: {settings.ORT_EXECUTION_MODE}")
+        options.execution_mode = execution_modes[mode]
+
+        options.graph_optimization_level = self._optimization_level()
+        options.enable_cpu_mem_arena = settings.ORT_ENABLE_CPU_MEM_ARENA
+        options.enable_mem_pattern = settings.ORT_ENABLE_MEM_PATTERN
+        options.add_session_config_entry(
+            "session.intra_op.allow_spinning", "1" if settings.ORT_ALLOW_SPINNING else "0"
+        )
+        return options
+
+    def _optimization_level(self) -> "ort.GraphOptimizationLevel":
+        import onnxruntime as ort
+        levels = {
+            "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+            "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+        }
+        level = settings.ORT_GRAPH_OPTIMIZATION_LEVEL.lower()
+        if level not in levels:
+            raise ValueError(f"不支持的 ORT_GRAPH_OPTIMIZATION_LEVEL: {settings.ORT_GRAPH_OPTIMIZATION_LEVEL}")
+        return levels[level]
+
+    def _optimized_model_path(self, model_path: str, providers) -> str:
+        """
+        优化后计算图的缓存路径
+
+        "all" 级别的优化结果与硬件相关，因此缓存键包含模型文件（路径、大小、修改时间）、
+        ORT版本与构建（设备、可用的执行提供者）、本次使用的执行提供者、优化级别、CPU架构与指令集；
+        模型文件替换、换机器或换 onnxruntime 包后自动生成新的缓存。
+        """
+        import onnxruntime as ort
+        stat = os.stat(model_path)
+        key = (f"{os.path.abspath(model_path)}:{stat.st_size}:{stat.st_mtime_ns}:"
+               f"{ort.__version__}:{ort.get_device()}:{','.join(ort.get_available_providers())}:"
+               f"{','.join(providers)}:{settings.ORT_GRAPH_OPTIMIZATION_LEVEL}:"
+               f"{platform.machine()}:{cpu_features()}")
+        digest = hashlib.sha256(key.encode("utf-8"))
+        name = os.path.splitext(os.path.basename(model_path))[0]
+        return os.path.join(settings.ORT_OPTIMIZED_MODEL_DIR, f"{name}.{digest.hexdigest()[:16]}.opt.onnx")
+
+    def _create_session(self, model_path: str, providers) -> "ort.InferenceSession":
+        """
+        创建推理会话
+
+        配置 ORT_OPTIMIZED_MODEL_DIR 时，首次启动把优化后的计算图写入缓存，
+        之后直接加载缓存并关闭图优化，省去每次启动的重新优化。
+        onnxruntime 在此处才导入，导入 app.main 时不再加载。
+        配置了 INFERENCE_SERVER_ADDRESS 时会话由推理进程持有，这里只返回代理（本进程不导入 onnxruntime）。
+        """
+        if settings.INFERENCE_SERVER_ADDRESS:
+            from app.services.inference_server import inference_client
+            if not self.name:
+                raise ValueError("使用推理进程时需通过模型名加载模型")
+            return inference_client.session(self.name)
+        import onnxruntime as ort
+        options = self._session_options()
+        if not settings.ORT_OPTIMIZED_MODEL_DIR or options.graph_optimization_level == ort.GraphOptimizationLevel.ORT_DISABLE_ALL:
+            return ort.InferenceSession(model_path, sess_options=options, providers=providers)
+
+        optimized_path = self._optimized_model_path(model_path, providers)
+        if os.path.exists(optimized_path):
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            try:
+                session = ort.InferenceSession(optimized_path, sess_options=options, providers=providers)
+                print(f"⚡ 使用已缓存的优化计算图: {optimized_path}")
+                return session
+            except Exception as e:
+                print(f"⚠️ 优化计算图缓存不可用，重新优化: {e}")
+                options = self._session_options()
+
+        os.makedirs(settings.ORT_OPTIMIZED_MODEL_DIR, exist_ok=True)
+        options.optimized_model_filepath = optimized_path
+        return ort.InferenceSession(model_path, sess_options=options, providers=providers)
+
+    def _check_input_shape(self):
+        """模型输入为固定尺寸时以模型为准（配置的分辨率不一致时给出警告）"""
+        for input_meta in self.session.get_inputs():
+            shape = input_meta.shape
+            if len(shape) == 4 and isinstance(shape[2], int) and isinstance(shape[3], int):
+                model_shape = (shape[3], shape[2])
+                if model_shape != self.input_shape:
+                    print(f"⚠️ 配置的输入尺寸 {self.input_shape} 与模型 {model_shape} 不一致，以模型为准")
+                    self.input_shape = model_shape
+                    self.preprocessor = ImagePreprocessor(self.input_shape)
+                return
+
+    def _supports_dynamic_batch(self) -> bool:
+        """模型输入的batch维是否可变（固定为整数时无法组批）"""
+        for input_meta in self.session.get_inputs():
+            if input_meta.shape and isinstance(input_meta.shape[0], int):
+                return False
+        return True
+
+    def _setup_scheduler(self):
+        """根据配置与模型能力创建批调度器"""
+        max_batch = getattr(settings, 'BATCH_MAX_SIZE', 1)
+        if max_batch <= 1 or settings.INFERENCE_SERVER_ADDRESS:
+            # 使用推理进程时由推理进程合并所有HTTP工作进程的请求
+            return
+        if not self._supports_dynamic_batch():
+            print("⚠️ 模型batch维固定，已禁用动态组批")
+            return
+        self.scheduler = BatchScheduler(
+            self.run_batch,
+            max_batch_size=max_batch,
+            max_wait_ms=getattr(settings, 'BATCH_MAX_WAIT_MS', 5.0)
+        )
+        self.scheduler.start()
+        print(f"📦 动态组批已启用: 最大批大小 {max_batch}, 等待窗口 {self.scheduler.max_wait * 1000:.1f}ms")
+
+    def supported_batch_sizes(self) -> List[int]:
+        """
+        session.run 可能出现的批大小（固定batch维的模型只有一种）
+
+        切片模式的模型另有整批切片的批大小（TILE_BATCH_SIZE，见 TiledInference），
+        最后一批不足的切片数不固定，不逐一预热。
+        """
+        for input_meta in self.session.get_inputs():
+            if input_meta.shape and isinstance(input_meta.shape[0], int):
+                return [input_meta.shape[0]]
+        if self.scheduler is None:
+            sizes = {1}
+        else:
+            # 并发调用方不超过推理线程数，批大小也不会超过它
+            sizes = set(range(1, min(self.scheduler.max_batch_size, settings.INFERENCE_WORKERS) + 1))
+        if self.tiled:
+            sizes.add(max(1, settings.TILE_BATCH_SIZE))
+        return sorted(sizes)
+
+    def warmup(self, batch_sizes: List[int] = None, iterations: int = 1) -> Dict[int, float]:
+        """
+        用全零输入按各批大小预跑推理，完成ORT的惰性内核初始化与内存池增长
+
+        Returns:
+            批大小 -> 首次运行耗时（毫秒）
+        """
+        if not self.model_loaded:
+            raise RuntimeError("ONNX模型未加载，请先调用 load_model()")
+        width, height = self.input_shape
+        timings = {}
+        for batch_size in batch_sizes or self.supported_batch_sizes():
+            feeds = {
+                input_meta.name: np.zeros((batch_size, 3, height, width), dtype=np.float32)
+                for input_meta in self.session.get_inputs()
+            }
+            for i in range(max(1, iterations)):
+                start = time.perf_counter()
+                self.run_batch(feeds)
+                if i == 0:
+                    timings[batch_size] = (time.perf_counter() - start) * 1000.0
+        return timings
+
+    def _stop_scheduler(self):
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.scheduler = None
+
+    def shutdown(self):
+        """停止批调度器并释放推理会话（之后可重新 load_model）"""
+        self._stop_scheduler()
+        self.session = None
+        self.model_loaded = False
+
+    def get_batching_stats(self) -> Dict:
+        """组批统计信息；未启用组批时返回 enabled=False"""
+        if self.scheduler is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.scheduler.stats()}
+
     def _print_model_info(self):
         """打印模型信息"""
         if not self.session:
@@ -92,38 +319,19 @@ class ONNXService:
         Returns:
             预处理后的图像数组，形状为 [1, 3, 256, 256]
         """
-        # 确保是彩色图像
-        if len(image_array.shape) == 2:
-            image_array = cv2.cvtColor(image_array, cv2.COLOR_GRAY2RGB)
-        elif image_array.shape[2] == 4:
-            image_array = cv2.cvtColor(image_array, cv2.COLOR_RGBA2RGB)
-        elif image_array.shape[2] == 3:
-            pass  # 已经是RGB
-        else:
-            raise ValueError(f"不支持的图像通道数: {image_array.shape[2]}")
-        
-        # 调整尺寸
-        image_resized = cv2.resize(image_array, self.input_shape)
-        
-        # 转换为float32并归一化到[0,1]
-        image_float = image_resized.astype(np.float32) / 255.0
-        
-        # ImageNet标准化
-        image_normalized = (image_float - self.imagenet_mean) / self.imagenet_std
-        
-        # 转换为CHW格式并添加batch维度
-        image_chw = np.transpose(image_normalized, (2, 0, 1))  # HWC -> CHW
-        image_batch = np.expand_dims(image_chw, axis=0)       # 添加batch维度
-        
-        return image_batch
+        width, height = self.input_shape
+        image_batch = np.empty((1, 3, height, width), dtype=np.float32)
+        return self.preprocessor.preprocess_into(image_array, image_batch)
     
-    def run_inference(self, query_image: np.ndarray, gerber_image: np.ndarray) -> Dict[str, np.ndarray]:
+    def run_inference(self, query_image: np.ndarray, gerber_image: np.ndarray = None,
+                      gerber_tensor: np.ndarray = None) -> Dict[str, np.ndarray]:
         """
         运行ONNX模型推理
         
         Args:
             query_image: 查询图像数组
             gerber_image: Gerber图像数组
+            gerber_tensor: 已预处理的Gerber输入 [1, 3, H, W]（来自Gerber库），提供时忽略 gerber_image
             
         Returns:
             包含模型输出的字典
@@ -131,9 +339,14 @@ class ONNXService:
         if not self.model_loaded:
             raise RuntimeError("ONNX模型未加载，请先调用 load_model()")
         
-        # 预处理图像
-        query_array = self.preprocess_image(query_image)
-        gerber_array = self.preprocess_image(gerber_image)
+        # 预处理图像：直接写入当前工作线程的输入缓冲区
+        # （调用方线程会阻塞到推理结束，期间缓冲区不会被复用）
+        with stage_timer("preprocess"):
+            query_array = self.preprocessor.preprocess(query_image, 'img')
+            if gerber_tensor is not None:
+                gerber_array = gerber_tensor
+            else:
+                gerber_array = self.preprocessor.preprocess(gerber_image, 'gerber')
         
         # 准备输入数据
         input_data = {
@@ -141,16 +354,48 @@ class ONNXService:
             'gerber': gerber_array   # Gerber图像
         }
         
-        # 运行推理
-        outputs = self.session.run(None, input_data)
+        # 运行推理：启用组批时交给调度器与其他并发请求合并执行（耗时包含等待凑批）
+        with stage_timer("inference"):
+            if self.scheduler is not None:
+                return self.scheduler.run(input_data)
+            return self.run_batch(input_data)
+
+    def run_tiled_inference(self, query_image: np.ndarray, gerber_image: np.ndarray,
+                            include_style: bool = True) -> Dict[str, np.ndarray]:
+        """
+        大图切片推理（见 TiledInference）
         
-        # 构建输出字典
-        output_names = [output.name for output in self.session.get_outputs()]
-        result = {}
-        for i, name in enumerate(output_names):
-            result[name] = outputs[i]
+        异常分数与全分辨率热力图来自原始分辨率的重叠切片；风格图仍由整图缩放后推理一次得到
+        （include_style 为 False 时跳过）。图片不够大时退回普通推理。
+        
+        Returns:
+            与 run_inference 相同格式的输出，另含 tile_scores / tile_origins
+        """
+        if not self.model_loaded:
+            raise RuntimeError("ONNX模型未加载，请先调用 load_model()")
+        tiler = TiledInference(self)
+        if not tiler.applicable(query_image.shape):
+            return self.run_inference(query_image, gerber_image)
+        
+        outputs = tiler.run(query_image, gerber_image)
+        if include_style:
+            whole = self.run_inference(query_image, gerber_image)
+            if 'style_output' in whole:
+                outputs['style_output'] = whole['style_output']
+        return outputs
+
+    def run_batch(self, input_data: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        对一批已预处理的输入直接调用 session.run
         
-        return result
+        Args:
+            input_data: {'img': [N, 3, H, W], 'gerber': [N, 3, H, W]}
+            
+        Returns:
+            输出名到 [N, ...] 数组的字典
+        """
+        outputs = self.session.run(self.output_names, input_data)
+        return dict(zip(self.output_names, outputs))
     
     def parse_results(self, results: Dict[str, np.ndarray]) -> Dict[str, any]:
         """
@@ -172,8 +417,8 @@ class ONNXService:
                 'defect': float(anomaly_pred[1])
             }
             
-            # 判断逻辑：异常概率大于0.35就判定为缺陷
-            anomaly_threshold = 0.35
+            # 判断逻辑：异常概率大于阈值（默认0.35）就判定为缺陷
+            anomaly_threshold = settings.ANOMALY_THRESHOLD
             is_defect = anomaly_pred[1] > anomaly_threshold
             confidence = anomaly_pred[1] if is_defect else anomaly_pred[0]
             
@@ -217,21 +462,12 @@ class ONNXService:
         Returns:
             np.ndarray: 反归一化后的图像数组，形状为 [H, W, C]，值范围[0,255]
         """
-        # 复制数组避免修改原数据
-        img = image.copy()
-        
-        # 反标准化
-        for i in range(3):
-            img[i] = img[i] * self.imagenet_std[0, 0, i] + self.imagenet_mean[0, 0, i]
-        
-        # 转换为HWC格式
-        img = np.transpose(img, (1, 2, 0))
-        
-        # 限制到[0,1]范围并转换为[0,255]
-        img = np.clip(img, 0, 1)
-        img = (img * 255).astype(np.uint8)
-        
-        return img
+        # 反标准化与 [0,255] 缩放合并为一次逐通道乘加（通道维在最后，按广播向量化）
+        img = np.empty((image.shape[1], image.shape[2], image.shape[0]), dtype=np.float32)
+        np.multiply(np.transpose(image, (1, 2, 0)), self.imagenet_std * 255.0, out=img)
+        img += self.imagenet_mean * 255.0
+        np.clip(img, 0, 255, out=img)
+        return img.astype(np.uint8)
 
     def resize_mask_to_image(self, mask: np.ndarray, target_size: tuple) -> np.ndarray:
         """
@@ -244,33 +480,25 @@ class ONNXService:
         Returns:
             np.ndarray: 调整尺寸后的掩码
         """
+        if mask.shape[:2] == tuple(target_size[:2]):
+            return mask  # 切片推理的热力图已是全分辨率
         return cv2.resize(mask, (target_size[1], target_size[0]), interpolation=cv2.INTER_LINEAR)
 
-    def create_heatmap_overlay(self, image: np.ndarray, mask: np.ndarray, alpha: float = 0.6) -> np.ndarray:
+    def create_heatmap_overlay(self, image: np.ndarray, mask: np.ndarray, alpha: float = 0.6,
+                               out: np.ndarray = None) -> np.ndarray:
         """
         创建热力图叠加图像
         
         Args:
             image (np.ndarray): 原始图像，形状为 [H, W, C]
-            mask (np.ndarray): 异常掩码，形状为 [H, W]
+            mask (np.ndarray): 异常掩码，形状为 [H, W]，或模型分辨率的掩码（渲染时放大）
             alpha (float): 热力图透明度
+            out (np.ndarray): 输出缓冲区，传入 image 时原地叠加
             
         Returns:
             np.ndarray: 叠加后的彩色图像
         """
-        # 归一化掩码到[0,1]
-        mask_norm = (mask - mask.min()) / (mask.max() - mask.min() + 1e-8)
-        
-        # 创建热力图颜色映射 (使用jet colormap)
-        import matplotlib.pyplot as plt
-        colormap = plt.cm.jet
-        heatmap = colormap(mask_norm)[:, :, :3]  # 去掉alpha通道
-        heatmap = (heatmap * 255).astype(np.uint8)
-        
-        # 叠加图像
-        overlay = cv2.addWeighted(image, 1-alpha, heatmap, alpha, 0)
-        
-        return overlay
+        return heatmap_renderer.render(image, mask, alpha, out=out)
 
     def generate_defect_description(self, defect_result: Dict) -> str:
         """根据缺陷检测结果生成描述文本（两个梯度：正常/异常）"""
@@ -279,6 +507,3 @@ class ONNXService:
         else:
             confidence = defect_result['confidence']
             return f"检测到缺陷（置信度: {confidence:.1%}）：建议检查并处理"
-
-# 创建全局服务实例
-onnx_service = ONNXService()
\ No newline at end of file
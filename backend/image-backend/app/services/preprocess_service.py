@@ -0,0 +1,96 @@
+import threading
+import cv2
+import numpy as np
+from typing import Dict, Tuple
+
+# ImageNet标准化参数
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+class ImagePreprocessor:
+    """
+    免分配的图像预处理器
+
+    /255 与 ImageNet 标准化合并为每通道一次 scale/offset 运算：
+        (x / 255 - mean) / std == x * (1 / (255 * std)) + (-mean / std)
+    缩放后的 uint8 图像逐通道直接写入连续的 NCHW float32 缓冲区，
+    不再产生 astype、除法、减均值、除方差、transpose 各自的中间数组，
+    ORT 也无需为非连续视图额外拷贝一次。
+
+    缓冲区按工作线程持有（threading.local），推理执行器中的线程互不干扰。
+    """
+
+    def __init__(self, input_shape: Tuple[int, int] = (256, 256),
+                 mean=IMAGENET_MEAN, std=IMAGENET_STD):
+        # input_shape 与 cv2.resize 的 dsize 一致，为 (W, H)
+        self.input_shape = tuple(input_shape)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.std = np.asarray(std, dtype=np.float32)
+        self.scale = (1.0 / (255.0 * self.std)).astype(np.float32)
+        self.offset = (-self.mean / self.std).astype(np.float32)
+        self._local = threading.local()
+
+    def _buffers(self) -> Dict[str, np.ndarray]:
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            buffers = {}
+            self._local.buffers = buffers
+        return buffers
+
+    def get_buffer(self, name: str, batch_size: int = 1) -> np.ndarray:
+        """
+        获取当前线程可复用的输入缓冲区
+
+        Returns:
+            np.ndarray: 形状为 [batch_size, 3, H, W] 的连续 float32 数组
+        """
+        width, height = self.input_shape
+        shape = (batch_size, 3, height, width)
+        buffers = self._buffers()
+        buffer = buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, dtype=np.float32)
+            buffers[name] = buffer
+        return buffer
+
+    def _to_rgb(self, image_array: np.ndarray) -> np.ndarray:
+        """缩放到模型输入尺寸并转换为3通道 uint8 图像（缩放放在通道转换之前，处理的像素更少）"""
+        if image_array.ndim == 3 and image_array.shape[2] not in (3, 4):
+            raise ValueError(f"不支持的图像通道数: {image_array.shape[2]}")
+
+        width, height = self.input_shape
+        if image_array.shape[:2] != (height, width):
+            image_array = cv2.resize(image_array, self.input_shape)
+
+        if image_array.ndim == 2:
+            return cv2.cvtColor(image_array, cv2.COLOR_GRAY2RGB)
+        if image_array.shape[2] == 4:
+            return cv2.cvtColor(image_array, cv2.COLOR_RGBA2RGB)
+        return image_array
+
+    def preprocess_into(self, image_array: np.ndarray, out: np.ndarray) -> np.ndarray:
+        """
+        预处理单张图像并写入 out
+
+        Args:
+            image_array: 图像数组，形状为 [H, W, C] 或 [H, W]
+            out: 目标数组，形状为 [3, H, W]（或 [1, 3, H, W]），float32
+
+        Returns:
+            np.ndarray: out
+        """
+        rgb = self._to_rgb(image_array)
+        planes = out.reshape(3, *out.shape[-2:])
+        for c in range(3):
+            np.multiply(rgb[:, :, c], self.scale[c], out=planes[c])
+            np.add(planes[c], self.offset[c], out=planes[c])
+        return out
+
+    def preprocess(self, image_array: np.ndarray, name: str = "input") -> np.ndarray:
+        """
+        预处理到当前线程名为 name 的缓冲区
+
+        返回的数组在同一线程下次处理同名输入时会被覆盖，调用方需在此之前用完。
+        """
+        return self.preprocess_into(image_array, self.get_buffer(name))
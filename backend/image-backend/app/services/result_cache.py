@@ -0,0 +1,351 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+from app.config import settings
+from app.services.trace_service import annotate
+
+# 缓存中保存的图片字段及其在磁盘上的文件后缀（编码格式见条目的 image_format）
+_IMAGE_FIELDS = (("converted_bytes", "converted"), ("anomaly_bytes", "anomaly"))
+
+
+def content_hash(data) -> str:
+    """
+    输入内容哈希（bytes / bytearray / memoryview / Base64 字符串）
+
+    原始字节的哈希与Gerber库的 gerber_id 算法一致：multipart 上传同一Gerber文件与引用其 gerber_id
+    命中同一缓存项（两者送入模型的张量相同，见 GerberLibrary）。Base64 字符串按字符串本身计算，
+    与 gerber_id 不同，JSON 请求上传的Gerber与引用 gerber_id 的请求各自缓存。
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+class _Inflight:
+    """进行中的一次计算：独立任务，等待它的请求数归零时才取消"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class ResultCache:
+    """
+    检测结果缓存
+
+    键为 (查询图哈希, Gerber哈希, 模型标识, 判定阈值)，值为 ImageService._inspect 的结果
+    （编码后的图片字节、分数与描述）。模型标识包含模型文件的路径、大小与修改时间（见 ModelSpec.fingerprint），
+    同名模型的文件被替换（如重新量化）后磁盘层的旧结果不会再命中。
+    模型输入与是否需要结果图无关（见 Base64Service.bytes_to_arrays），同一键的分数只有一个。
+    仅分数的结果存于该键下；带图片的结果按图片参数（编码与热力图色表）另存一项（"<键>-<图片参数>"），
+    写入时同时写入仅分数项，因此仅分数请求不区分图片参数，也能命中任何带图片请求算出的分数。
+    内存层按字节数上限做 LRU 淘汰；配置 RESULT_CACHE_DIR 时启用磁盘层，内存淘汰不影响磁盘，
+    磁盘层同样按字节数上限淘汰最久未使用的条目。
+
+    相同请求并发到达时只计算一次，其余请求等待同一个结果（in-flight 合并），仅分数请求也会合并到
+    进行中的带图片计算上。计算在独立任务中执行：某个请求被取消（客户端断开）不影响其他等待者，
+    所有等待者都取消后才取消计算。
+
+    内存层与 in-flight 表只在事件循环线程中访问；磁盘读写放到线程中执行。
+    """
+
+    def __init__(self, max_memory_bytes: int = None, disk_dir: Optional[str] = None,
+                 max_disk_bytes: int = None):
+        self.max_memory_bytes = (settings.RESULT_CACHE_MEMORY_MB * 1024 * 1024
+                                 if max_memory_bytes is None else max_memory_bytes)
+        self.disk_dir = settings.RESULT_CACHE_DIR if disk_dir is None else disk_dir
+        self.max_disk_bytes = (settings.RESULT_CACHE_DISK_MB * 1024 * 1024
+                               if max_disk_bytes is None else max_disk_bytes)
+
+        self._memory: "OrderedDict[str, Dict]" = OrderedDict()
+        self._memory_bytes = 0
+        # 进行中的计算：条目键 -> _Inflight（带图片的计算同时登记在仅分数键下）
+        self._inflight: Dict[str, _Inflight] = {}
+
+        # 磁盘层索引：条目键 -> 占用字节数，按最近使用排序
+        self._disk_lock = threading.Lock()
+        self._disk_index: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        if self.disk_dir:
+            self._load_disk_index()
+
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._coalesced = 0
+
+    @staticmethod
+    def make_key(query_source, gerber_source=None, model: str = "256",
+                 threshold: float = None, gerber_id: str = None) -> str:
+        """
+        计算缓存键（需要对整张图哈希，应在推理执行器中调用）
+
+        model 为模型标识（ModelSpec.fingerprint），而不只是模型名。
+        """
+        gerber_hash = gerber_id if gerber_id is not None else content_hash(gerber_source)
+        if threshold is None:
+            threshold = settings.ANOMALY_THRESHOLD
+        return hashlib.sha256(
+            f"{content_hash(query_source)}:{gerber_hash}:{model}:{threshold!r}".encode("utf-8")
+        ).hexdigest()
+
+    @staticmethod
+    def _entry_key(key: str, images: Optional[str]) -> str:
+        """条目键：仅分数为 key 本身，带图片时附加图片参数（如 "png:1:jet" -> "<key>-png-1-jet"，可作文件名）"""
+        if images is None:
+            return key
+        return f"{key}-{images.replace(':', '-')}"
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Dict]],
+                             images: Optional[str] = None) -> Dict:
+        """
+        命中缓存直接返回，否则等待同键的进行中计算或调用 compute() 计算并写入缓存
+
+        images 为决定结果图片内容的参数（编码与色表，如 "png:1:jet"），为 None 表示仅需分数。
+        """
+        entry_key = self._entry_key(key, images)
+        result = self._memory_get(entry_key)
+        if result is not None:
+            self._memory_hits += 1
+            annotate(cache="memory_hit")
+            return result
+
+        inflight = self._inflight.get(entry_key)
+        if inflight is not None:
+            self._coalesced += 1
+            annotate(cache="coalesced")
+        else:
+            # 先登记为进行中（包括磁盘查找期间），同键请求不会再各自计算
+            inflight = _Inflight(asyncio.ensure_future(self._lookup_or_compute(key, entry_key, compute)))
+            self._inflight[entry_key] = inflight
+            if entry_key != key:
+                # 仅分数请求可合并到带图片的计算上
+                self._inflight.setdefault(key, inflight)
+            inflight.task.add_done_callback(lambda task: self._finish(inflight))
+        return dict(await self._wait(inflight))
+
+    async def _wait(self, inflight: _Inflight) -> Dict:
+        inflight.waiters += 1
+        try:
+            return await asyncio.shield(inflight.task)
+        finally:
+            inflight.waiters -= 1
+            if inflight.waiters == 0 and not inflight.task.done():
+                # 所有等待者都已取消：放弃计算，之后的同键请求重新计算
+                self._forget(inflight)
+                inflight.task.cancel()
+
+    def _finish(self, inflight: _Inflight):
+        self._forget(inflight)
+        if not inflight.task.cancelled():
+            inflight.task.exception()  # 无等待者时避免 "exception was never retrieved" 警告
+
+    def _forget(self, inflight: _Inflight):
+        for entry_key in [k for k, v in self._inflight.items() if v is inflight]:
+            del self._inflight[entry_key]
+
+    async def _lookup_or_compute(self, key: str, entry_key: str,
+                                 compute: Callable[[], Awaitable[Dict]]) -> Dict:
+        result = None
+        if self.disk_dir:
+            result = await asyncio.to_thread(self._disk_get, entry_key)
+        if result is not None:
+            self._disk_hits += 1
+            annotate(cache="disk_hit")
+        else:
+            self._misses += 1
+            annotate(cache="miss")
+            result = await compute()
+            if self.disk_dir:
+                await asyncio.to_thread(self._disk_put, key, entry_key, result)
+        self._memory_put(key, entry_key, result)
+        return result
+
+    @staticmethod
+    def _score_only(result: Dict) -> Dict:
+        """带图片结果对应的仅分数条目"""
+        score = dict(result)
+        for field, _ in _IMAGE_FIELDS:
+            score[field] = None
+        score["image_format"] = None
+        return score
+
+    @staticmethod
+    def _entry_size(result: Dict) -> int:
+        size = len(result.get("defect_description") or "") * 3 + 64
+        for field, _ in _IMAGE_FIELDS:
+            size += len(result.get(field) or b"")
+        return size
+
+    # ---- 内存层 ----
+
+    def _memory_get(self, entry_key: str) -> Optional[Dict]:
+        result = self._memory.get(entry_key)
+        if result is None:
+            return None
+        self._memory.move_to_end(entry_key)
+        return dict(result)
+
+    def _memory_put(self, key: str, entry_key: str, result: Dict):
+        if entry_key != key:
+            self._memory_store(key, self._score_only(result))
+        self._memory_store(entry_key, result)
+
+    def _memory_store(self, entry_key: str, result: Dict):
+        existing = self._memory.pop(entry_key, None)
+        if existing is not None:
+            self._memory_bytes -= self._entry_size(existing)
+
+        size = self._entry_size(result)
+        if size > self.max_memory_bytes:
+            return
+        self._memory[entry_key] = dict(result)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= self._entry_size(evicted)
+
+    # ---- 磁盘层 ----
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.{suffix}")
+
+    def _load_disk_index(self):
+        os.makedirs(self.disk_dir, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-len(".json")]
+            meta_path = self._path(key, "json")
+            size = os.path.getsize(meta_path)
+            for _, suffix in _IMAGE_FIELDS:
+                if os.path.exists(self._path(key, suffix)):
+                    size += os.path.getsize(self._path(key, suffix))
+            entries.append((os.path.getmtime(meta_path), key, size))
+        for _, key, size in sorted(entries):
+            self._disk_index[key] = size
+            self._disk_bytes += size
+
+    def _disk_get(self, key: str) -> Optional[Dict]:
+        with self._disk_lock:
+            if key not in self._disk_index:
+                return None
+        try:
+            with open(self._path(key, "json"), "r", encoding="utf-8") as f:
+                result = json.load(f)
+            for field, suffix in _IMAGE_FIELDS:
+                data = None
+                if result.pop(field, False):
+                    with open(self._path(key, suffix), "rb") as f:
+                        data = f.read()
+                result[field] = data
+        except (OSError, ValueError):
+            self._disk_remove(key)
+            return None
+
+        with self._disk_lock:
+            if key in self._disk_index:
+                self._disk_index.move_to_end(key)
+        os.utime(self._path(key, "json"))
+        return result
+
+    def _disk_put(self, key: str, entry_key: str, result: Dict):
+        if entry_key != key:
+            with self._disk_lock:
+                stored = key in self._disk_index
+            if not stored:
+                self._disk_store(key, self._score_only(result))
+        self._disk_store(entry_key, result)
+
+    def _disk_store(self, key: str, result: Dict):
+        try:
+            meta = {k: v for k, v in result.items() if k not in dict(_IMAGE_FIELDS)}
+            size = 0
+            for field, suffix in _IMAGE_FIELDS:
+                data = result.get(field)
+                meta[field] = data is not None
+                if data is not None:
+                    with open(self._path(key, suffix), "wb") as f:
+                        f.write(data)
+                    size += len(data)
+            # 元数据最后写入（改名保证原子性），存在即表示条目完整
+            tmp_path = self._path(key, f"json.tmp-{threading.get_ident()}")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            size += os.path.getsize(tmp_path)
+            os.replace(tmp_path, self._path(key, "json"))
+        except OSError as e:
+            print(f"⚠️ 结果缓存写入磁盘失败: {e}")
+            return
+
+        evicted = []
+        with self._disk_lock:
+            self._disk_bytes += size - self._disk_index.pop(key, 0)
+            self._disk_index[key] = size
+            while self._disk_bytes > self.max_disk_bytes and len(self._disk_index) > 1:
+                old_key, old_size = self._disk_index.popitem(last=False)
+                self._disk_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            self._remove_files(old_key)
+
+    def _disk_remove(self, key: str):
+        with self._disk_lock:
+            self._disk_bytes -= self._disk_index.pop(key, 0)
+        self._remove_files(key)
+
+    def _remove_files(self, key: str):
+        for suffix in ["json"] + [suffix for _, suffix in _IMAGE_FIELDS]:
+            try:
+                os.remove(self._path(key, suffix))
+            except OSError:
+                pass
+
+    def clear(self):
+        """清空内存层与磁盘层"""
+        self._memory.clear()
+        self._memory_bytes = 0
+        if self.disk_dir:
+            with self._disk_lock:
+                keys = list(self._disk_index)
+                self._disk_index.clear()
+                self._disk_bytes = 0
+            for key in keys:
+                self._remove_files(key)
+
+    def stats(self) -> Dict:
+        """命中/未命中统计与各层占用"""
+        hits = self._memory_hits + self._disk_hits + self._coalesced
+        total = hits + self._misses
+        stats = {
+            "hits": hits,
+            "memory_hits": self._memory_hits,
+            "disk_hits": self._disk_hits,
+            "coalesced": self._coalesced,
+            "misses": self._misses,
+            "hit_rate": (hits / total) if total else 0.0,
+            "inflight": len(self._inflight),
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "max_memory_bytes": self.max_memory_bytes,
+            "disk_enabled": bool(self.disk_dir),
+        }
+        if self.disk_dir:
+            with self._disk_lock:
+                stats.update({
+                    "disk_entries": len(self._disk_index),
+                    "disk_bytes": self._disk_bytes,
+                    "max_disk_bytes": self.max_disk_bytes,
+                })
+        return stats
+
+
+# 创建全局结果缓存实例
+result_cache = ResultCache()
@@ -0,0 +1,80 @@
+import asyncio
+import importlib
+import time
+import traceback
+from typing import Dict, List
+from app.config import settings
+
+
+class StartupService:
+    """
+    启动流程：导入耗时统计、模型预加载与预热、就绪状态
+
+    模型加载与预热不再发生在导入 app.main 时，而是在应用启动后放到后台线程执行，
+    期间服务已可响应健康检查；/ready 在全部预热完成后才返回200，
+    自动扩缩容据此判断何时把流量切到新实例。
+    """
+
+    def __init__(self):
+        self.created_at = time.perf_counter()
+        self.import_times: Dict[str, float] = {}
+        self.model_load_times: Dict[str, float] = {}
+        self.warmup_times: Dict[str, Dict[int, float]] = {}
+        self.ready = False
+        self.errors: List[str] = []
+        self.ready_after: float = None
+        self._task = None
+
+    def measure_imports(self, modules: List[str]):
+        """依次导入模块并记录耗时（毫秒），已导入的模块耗时接近0"""
+        for name in modules:
+            start = time.perf_counter()
+            importlib.import_module(name)
+            self.import_times[name] = (time.perf_counter() - start) * 1000.0
+
+    def record_import(self, name: str, started_at: float):
+        self.import_times[name] = (time.perf_counter() - started_at) * 1000.0
+
+    def start(self, registry):
+        """在后台线程中预加载并预热模型（需在事件循环中调用）"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().run_in_executor(None, self.warmup_models, registry)
+
+    def warmup_models(self, registry):
+        """预加载并预热 MODEL_PRELOAD 中的模型，完成后更新就绪状态（阻塞执行）"""
+        for name in settings.MODEL_PRELOAD:
+            try:
+                start = time.perf_counter()
+                service = registry.get(name)
+                self.model_load_times[name] = (time.perf_counter() - start) * 1000.0
+
+                if settings.WARMUP_ENABLED:
+                    timings = service.warmup(settings.WARMUP_BATCH_SIZES or None, settings.WARMUP_ITERATIONS)
+                    self.warmup_times[name] = timings
+                    sizes = ", ".join(f"{size}:{ms:.0f}ms" for size, ms in timings.items())
+                    print(f"🔥 模型 {name} 预热完成（批大小:首次耗时 {sizes}）")
+            except Exception as e:
+                self.errors.append(f"{name}: {e}")
+                print(f"❌ 模型 {name} 预加载/预热失败: {e}")
+                print(traceback.format_exc())
+
+        self.ready_after = (time.perf_counter() - self.created_at) * 1000.0
+        # 有模型失败时保持未就绪，避免把流量切到不可用的实例
+        self.ready = not self.errors
+        if self.ready:
+            print(f"✅ 服务就绪，启动耗时 {self.ready_after:.0f}ms")
+
+    def status(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "errors": self.errors,
+            "ready_after_ms": self.ready_after,
+            "import_ms": self.import_times,
+            "model_load_ms": self.model_load_times,
+            "warmup_ms": {name: {str(k): v for k, v in timings.items()}
+                          for name, timings in self.warmup_times.items()},
+        }
+
+
+# 创建全局启动服务实例
+startup_service = StartupService()
@@ -0,0 +1,141 @@
+import time
+import cv2
+import numpy as np
+from typing import Dict, List, Tuple
+from app.config import settings
+from app.services.metrics_service import observe_stage
+
+
+def tile_starts(length: int, tile: int, overlap: int) -> List[int]:
+    """
+    一维方向上各切片的起点：步长 tile - overlap，最后一片贴齐边缘
+
+    length 不大于 tile 时只有一片（起点0）。
+    """
+    if length <= tile:
+        return [0]
+    stride = max(1, tile - overlap)
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)
+    return starts
+
+
+def blend_window(tile: int, overlap: int) -> np.ndarray:
+    """切片权重：重叠区内从边缘线性升到1，拼接时相邻切片平滑过渡"""
+    window = np.ones(tile, dtype=np.float32)
+    ramp = min(overlap, tile // 2)
+    if ramp > 0:
+        rise = (np.arange(1, ramp + 1, dtype=np.float32)) / (ramp + 1)
+        window[:ramp] = rise
+        window[-ramp:] = rise[::-1]
+    return window
+
+
+def window_sum(length: int, starts: List[int], window: np.ndarray) -> np.ndarray:
+    """每个位置上所有切片权重之和（一维）"""
+    total = np.zeros(length, dtype=np.float32)
+    for start in starts:
+        total[start:start + len(window)] += window
+    return total
+
+
+class TiledInference:
+    """
+    大图切片推理
+
+    把对齐的查询图/Gerber图按模型输入尺寸切成重叠切片（原始分辨率，不缩放），
+    每 batch_size 片拼成一批调用 session.run，再把 anomaly_mask 按权重拼回全分辨率热力图，
+    切片的缺陷概率取最大值作为整图分数（任一区域有缺陷即判定为缺陷）。
+
+    权重为可分离的二维窗口 w(y, x) = wy(y) * wx(x)，而切片网格是 y 起点与 x 起点的笛卡尔积，
+    因此权重和也可分离，归一化只需两个一维数组。除输出热力图本身外，
+    工作内存只有一批切片的输入/输出张量，与图片尺寸无关。
+    """
+
+    def __init__(self, onnx_service, overlap: int = None, batch_size: int = None):
+        self.onnx_service = onnx_service
+        self.overlap = settings.TILE_OVERLAP if overlap is None else overlap
+        batch_dim = onnx_service.session.get_inputs()[0].shape[0]
+        # batch维固定的模型只能按其固定批大小送入
+        if isinstance(batch_dim, int):
+            self.batch_size = batch_dim
+        else:
+            self.batch_size = max(1, settings.TILE_BATCH_SIZE if batch_size is None else batch_size)
+
+    def applicable(self, image_shape: Tuple[int, ...]) -> bool:
+        """图片长边超过 TILE_MIN_SIZE 且两边都不小于模型输入时才切片"""
+        height, width = image_shape[:2]
+        tile_w, tile_h = self.onnx_service.input_shape
+        return max(height, width) > settings.TILE_MIN_SIZE and height >= tile_h and width >= tile_w
+
+    def run(self, query_image: np.ndarray, gerber_image: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        切片推理
+
+        Args:
+            query_image: 查询图 RGB [H, W, 3]
+            gerber_image: Gerber图 RGB，尺寸与查询图不同时先缩放对齐
+
+        Returns:
+            与 run_inference 相同格式的输出：anomaly_pred [1, 2]、anomaly_mask [1, 1, H, W]（全分辨率），
+            以及 tile_scores [N]、tile_origins [N, 2]（各切片左上角 y, x）
+        """
+        height, width = query_image.shape[:2]
+        if gerber_image.shape[:2] != (height, width):
+            gerber_image = cv2.resize(gerber_image, (width, height), interpolation=cv2.INTER_AREA)
+
+        tile_w, tile_h = self.onnx_service.input_shape
+        ys = tile_starts(height, tile_h, self.overlap)
+        xs = tile_starts(width, tile_w, self.overlap)
+        wy = blend_window(tile_h, self.overlap)
+        wx = blend_window(tile_w, self.overlap)
+        window = np.outer(wy, wx)
+        origins = [(y, x) for y in ys for x in xs]
+
+        preprocessor = self.onnx_service.preprocessor
+        img_batch = preprocessor.get_buffer("tile_img", self.batch_size)
+        gerber_batch = preprocessor.get_buffer("tile_gerber", self.batch_size)
+        stitched = np.zeros((height, width), dtype=np.float32)
+        tile_scores = np.zeros(len(origins), dtype=np.float32)
+        preprocess_seconds = 0.0
+        inference_seconds = 0.0
+
+        for first in range(0, len(origins), self.batch_size):
+            chunk = origins[first:first + self.batch_size]
+            start = time.perf_counter()
+            for i, (y, x) in enumerate(chunk):
+                preprocessor.preprocess_into(query_image[y:y + tile_h, x:x + tile_w], img_batch[i])
+                preprocessor.preprocess_into(gerber_image[y:y + tile_h, x:x + tile_w], gerber_batch[i])
+            # 固定batch维的模型最后一批不足时用上一批残留数据补齐，输出只取前 len(chunk) 个
+            count = self.batch_size if self.batch_size != len(chunk) and self._fixed_batch() else len(chunk)
+            mid = time.perf_counter()
+            outputs = self.onnx_service.run_batch({"img": img_batch[:count], "gerber": gerber_batch[:count]})
+            inference_seconds += time.perf_counter() - mid
+            preprocess_seconds += mid - start
+
+            masks = outputs["anomaly_mask"]
+            for i, (y, x) in enumerate(chunk):
+                mask = masks[i].reshape(masks.shape[-2:])
+                if mask.shape != (tile_h, tile_w):
+                    mask = cv2.resize(mask, (tile_w, tile_h), interpolation=cv2.INTER_LINEAR)
+                stitched[y:y + tile_h, x:x + tile_w] += mask * window
+            if "anomaly_pred" in outputs:
+                tile_scores[first:first + len(chunk)] = outputs["anomaly_pred"][:len(chunk), 1]
+
+        # 按权重和归一化（可分离，逐行/逐列各除一次）
+        stitched /= window_sum(height, ys, wy)[:, None]
+        stitched /= window_sum(width, xs, wx)[None, :]
+
+        observe_stage("preprocess", preprocess_seconds)
+        observe_stage("inference", inference_seconds)
+
+        score = float(tile_scores.max()) if len(tile_scores) else 0.0
+        return {
+            "anomaly_pred": np.array([[1.0 - score, score]], dtype=np.float32),
+            "anomaly_mask": stitched[None, None],
+            "tile_scores": tile_scores,
+            "tile_origins": np.array(origins, dtype=np.int32),
+        }
+
+    def _fixed_batch(self) -> bool:
+        return isinstance(self.onnx_service.session.get_inputs()[0].shape[0], int)
@@ -0,0 +1,141 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+from app.config import settings
+
+# 当前请求的追踪记录；推理执行器与 asyncio.to_thread 会把上下文带入工作线程
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("request_trace", default=None)
+
+
+class RequestTrace:
+    """单个请求的追踪信息：请求ID、各阶段耗时（毫秒，同名阶段累加）与附加字段"""
+
+    __slots__ = ("request_id", "started_at", "stages", "info", "_lock")
+
+    def __init__(self, request_id: str = None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.started_at = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.info: Dict = {}
+        # 同一请求的多个阶段可能在不同工作线程中同时结束（如两张结果图并行编码）
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds * 1000.0
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started_at) * 1000.0
+
+    def server_timing(self, total_ms: float) -> str:
+        """Server-Timing 响应头，例如 decode;dur=3.1, inference;dur=40.2, cache;desc="miss", total;dur=52.0"""
+        parts = [f"{stage};dur={ms:.1f}" for stage, ms in self.stages.items()]
+        if "cache" in self.info:
+            parts.append(f'cache;desc="{self.info["cache"]}"')
+        parts.append(f"total;dur={total_ms:.1f}")
+        return ", ".join(parts)
+
+
+def start_trace(request_id: str = None) -> RequestTrace:
+    trace = RequestTrace(request_id)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def record_stage(stage: str, seconds: float):
+    """记录阶段耗时到当前请求（不在请求上下文中时忽略）"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_stage(stage, seconds)
+
+
+def annotate(**info):
+    """为当前请求追加追踪字段（模型、输入尺寸、缓存命中等）"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.info.update(info)
+
+
+class TraceWriter:
+    """
+    JSON Lines 追踪文件写入器
+
+    请求路径上只做一次非阻塞入队，序列化与写文件在后台线程完成；
+    队列满时丢弃记录并计数，不拖慢请求。文件按 TRACE_FILE_MAX_MB 轮转，
+    最多保留 TRACE_FILE_BACKUPS 个历史文件。
+    """
+
+    def __init__(self, path: str = None, max_bytes: int = None, backups: int = None, queue_size: int = None):
+        self.path = settings.TRACE_FILE if path is None else path
+        self.max_bytes = (settings.TRACE_FILE_MAX_MB if max_bytes is None else max_bytes) * 1024 * 1024
+        self.backups = settings.TRACE_FILE_BACKUPS if backups is None else backups
+        self._queue: "queue.Queue[Optional[Dict]]" = queue.Queue(
+            maxsize=settings.TRACE_QUEUE_SIZE if queue_size is None else queue_size
+        )
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="trace-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, record: Dict):
+        if not self.enabled:
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _loop(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding="utf-8"
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            line = json.dumps(record, ensure_ascii=False, default=str)
+            handler.emit(logging.makeLogRecord({"msg": line, "levelno": logging.INFO}))
+            self.written += 1
+        handler.close()
+
+    def shutdown(self):
+        """写完已入队的记录后停止后台线程"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout=5)
+
+    def stats(self) -> Dict:
+        return {"enabled": self.enabled, "path": self.path, "written": self.written, "dropped": self.dropped}
+
+
+# 创建全局追踪文件写入器
+trace_writer = TraceWriter()
@@ -0,0 +1,311 @@
+import asyncio
+import errno
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+from fastapi import UploadFile
+from app.config import settings
+from app.utils.file_utils import iter_upload_chunks, check_image_format, IMAGE_EXTENSIONS, SNIFF_BYTES
+
+# 表示文件系统不支持硬链接的错误：此后改为复制
+_LINK_UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP}
+
+
+class UploadStore:
+    """
+    内容寻址的上传存储与保留期清理
+
+    上传文件边读边写入临时文件并计算 SHA-256，完成后按哈希存放为
+    UPLOAD_DIR/blobs/<前2位>/<sha256><扩展名>；内容相同的上传只保留一份。
+    返回给前端的 original/<task_id>_<role><扩展名> 是指向该文件的硬链接，
+    因此 /api/files/original/... 的URL与以前一样直接按路径访问。
+    文件系统不支持硬链接时退回复制（此时不再节省空间）。
+
+    后台清理线程每 UPLOAD_JANITOR_INTERVAL_S 秒扫描 original / processed / temp：
+    删除超过 UPLOAD_RETENTION_HOURS 的文件，总大小超过 UPLOAD_QUOTA_MB 时从最早的文件开始删除，
+    最后删除已没有任何链接的 blob。同一内容的多个文件名共享修改时间，重复上传会刷新它。
+
+    清理只作用于启用存储之后写入的文件：首次使用时在 UPLOAD_DIR 下写入标记文件（MARKER_FILE），
+    修改时间早于标记的已有文件（旧版本上传的 task_id 对应的文件）不删除、不计入配额，其URL继续有效。
+    """
+
+    BLOB_DIR = "blobs"
+    MANAGED_DIRS = ("original", "processed", "temp")
+    TMP_PREFIX = ".tmp-"
+    TMP_MAX_AGE = 3600  # 超过该时长（秒）的临时文件视为中断的上传残留
+    MARKER_FILE = ".upload_store"
+
+    def __init__(self, root: str = None):
+        self.root = root or settings.UPLOAD_DIR
+        self.blob_dir = os.path.join(self.root, self.BLOB_DIR)
+        # 保证“确认 blob 存在后建立链接”与清理线程删除孤立 blob 互斥
+        self._lock = threading.Lock()
+        self._link_supported = True
+        self._thread = None
+        self._stop = threading.Event()
+        self.stored = 0
+        self.deduplicated = 0
+        self.deduplicated_bytes = 0
+        self.sweeps = 0
+        self.files_removed = 0
+        self.bytes_freed = 0
+        self.last_sweep_at: Optional[float] = None
+
+    def _blob_path(self, digest: str, extension: str) -> str:
+        return os.path.join(self.blob_dir, digest[:2], f"{digest}{extension}")
+
+    def _managed_since(self) -> float:
+        """
+        存储开始管理上传目录的时间（标记文件的修改时间，不存在时创建）
+
+        取文件系统的时间而不是 time.time()，与之后写入文件的修改时间出自同一时钟。
+        """
+        marker = os.path.join(self.root, self.MARKER_FILE)
+        try:
+            return os.stat(marker).st_mtime
+        except FileNotFoundError:
+            pass
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            with open(marker, "x", encoding="utf-8") as f:
+                f.write("original / processed / temp 中修改时间早于本文件的文件不参与保留期清理\n")
+        except FileExistsError:
+            pass
+        return os.stat(marker).st_mtime
+
+    async def save(self, file: UploadFile, role: str, max_size: int = None) -> Dict:
+        """
+        分块保存上传的图片，返回 {task_id, filename, path, size, sha256, deduplicated}
+
+        首块即按文件头识别格式，不是支持的图片时在写入任何内容之前拒绝；
+        大小上限见 iter_upload_chunks。整个文件不会完整读入内存。
+
+        Raises:
+            UploadTooLargeError: 超过大小上限
+            ValueError: 不是支持的图片格式
+        """
+        os.makedirs(self.blob_dir, exist_ok=True)
+        await asyncio.to_thread(self._managed_since)
+        tmp_path = os.path.join(self.blob_dir, f"{self.TMP_PREFIX}{uuid.uuid4().hex}")
+        hasher = hashlib.sha256()
+        header = bytearray()
+        image_format = None
+        size = 0
+        f = await asyncio.to_thread(open, tmp_path, "wb")
+        try:
+            async for chunk in iter_upload_chunks(file, max_size):
+                if image_format is None:
+                    header += chunk[:SNIFF_BYTES - len(header)]
+                    if len(header) >= SNIFF_BYTES:
+                        image_format = check_image_format(header)
+                await asyncio.to_thread(self._write_chunk, f, hasher, chunk)
+                size += len(chunk)
+            if image_format is None:
+                image_format = check_image_format(header)
+        except BaseException:
+            await asyncio.to_thread(self._discard, f, tmp_path)
+            raise
+        await asyncio.to_thread(f.close)
+        return await asyncio.to_thread(self._commit, tmp_path, hasher.hexdigest(), size, image_format, role)
+
+    @staticmethod
+    def _write_chunk(f, hasher, chunk: bytes):
+        hasher.update(chunk)
+        f.write(chunk)
+
+    @staticmethod
+    def _discard(f, tmp_path: str):
+        """上传失败：关闭并删除临时文件"""
+        f.close()
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def _commit(self, tmp_path: str, digest: str, size: int, image_format: str, role: str) -> Dict:
+        extension = IMAGE_EXTENSIONS[image_format]
+        blob_path = self._blob_path(digest, extension)
+        task_id = str(uuid.uuid4())
+        filename = f"{task_id}_{role}{extension}"
+        directory = os.path.join(self.root, "original")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, filename)
+        with self._lock:
+            deduplicated = os.path.exists(blob_path)
+            if not deduplicated:
+                self._store_blob(tmp_path, blob_path)
+            try:
+                self._link(blob_path, path)
+            except FileNotFoundError:
+                if not deduplicated:
+                    raise
+                # 检查之后 blob 被删除（如被人工清理）：用本次上传的内容重新写入
+                deduplicated = False
+                self._store_blob(tmp_path, blob_path)
+                self._link(blob_path, path)
+            if deduplicated:
+                os.remove(tmp_path)
+                # 刷新修改时间：保留期从最近一次上传该内容开始计算
+                os.utime(blob_path)
+            self.stored += 1
+            if deduplicated:
+                self.deduplicated += 1
+                self.deduplicated_bytes += size
+        return {"task_id": task_id, "filename": filename, "path": path, "size": size,
+                "sha256": digest, "deduplicated": deduplicated}
+
+    @staticmethod
+    def _store_blob(tmp_path: str, blob_path: str):
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(tmp_path, blob_path)
+
+    def _link(self, blob_path: str, path: str):
+        """
+        建立指向 blob 的硬链接
+
+        文件系统不支持硬链接（跨设备、无权限、不支持）时此后一律复制；
+        单个 blob 链接数达到上限（EMLINK）时只有这一次复制；其他错误（如 blob 不存在）直接抛出。
+        """
+        if self._link_supported:
+            try:
+                os.link(blob_path, path)
+                return
+            except OSError as e:
+                if e.errno == errno.EMLINK:
+                    pass
+                elif e.errno in _LINK_UNSUPPORTED:
+                    self._link_supported = False
+                    print(f"⚠️ 上传目录不支持硬链接，改为复制文件（不再去重）: {e}")
+                else:
+                    raise
+        shutil.copyfile(blob_path, path)
+
+    def sweep(self, now: float = None) -> Dict:
+        """执行一次清理，返回本次删除的文件数与释放的字节数"""
+        now = time.time() if now is None else now
+        max_age = settings.UPLOAD_RETENTION_HOURS * 3600
+        quota = settings.UPLOAD_QUOTA_MB * 1024 * 1024
+        removed = 0
+        freed = 0
+        since = self._managed_since()
+        with self._lock:
+            # 同一 inode 的多个文件名（同一内容）作为一组：大小只计一次，一起过期、一起删除
+            groups: Dict[tuple, Dict] = {}
+            for path, stat in self._scan(self.MANAGED_DIRS):
+                if stat.st_mtime < since:
+                    continue  # 启用存储之前已有的文件
+                group = groups.setdefault((stat.st_dev, stat.st_ino), {
+                    "paths": [], "mtime": stat.st_mtime, "size": stat.st_size, "links": stat.st_nlink,
+                })
+                group["paths"].append(path)
+
+            expired = [key for key, group in groups.items() if max_age > 0 and now - group["mtime"] > max_age]
+            expired_keys = set(expired)
+            kept = sorted((item for item in groups.items() if item[0] not in expired_keys),
+                          key=lambda item: item[1]["mtime"])
+            total = sum(group["size"] for _, group in kept)
+            for key, group in kept:
+                if quota <= 0 or total <= quota:
+                    break
+                expired.append(key)
+                total -= group["size"]
+            for key in expired:
+                group = groups[key]
+                removed += self._remove_all(group["paths"])
+                # 只有 blob 之外没有其他链接时，删除后才真正释放空间
+                if group["links"] <= len(group["paths"]):
+                    freed += group["size"]
+
+            # 没有任何文件名引用的 blob 与中断上传的临时文件
+            for path, stat in self._scan((self.BLOB_DIR,)):
+                name = os.path.basename(path)
+                if name.startswith(self.TMP_PREFIX):
+                    orphan = now - stat.st_mtime > self.TMP_MAX_AGE
+                else:
+                    orphan = stat.st_nlink <= 1
+                if orphan:
+                    removed += self._remove_all([path])
+                    freed += stat.st_size
+
+        self.sweeps += 1
+        self.files_removed += removed
+        self.bytes_freed += freed
+        self.last_sweep_at = now
+        return {"files_removed": removed, "bytes_freed": freed}
+
+    def _scan(self, directories) -> List:
+        entries = []
+        for name in directories:
+            for dirpath, _, filenames in os.walk(os.path.join(self.root, name)):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        entries.append((path, os.stat(path)))
+                    except FileNotFoundError:
+                        continue
+        return entries
+
+    @staticmethod
+    def _remove_all(paths: List[str]) -> int:
+        removed = 0
+        for path in paths:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def start(self):
+        """启动后台清理线程（UPLOAD_JANITOR_INTERVAL_S 为0时不启动）"""
+        # 启动时即写入标记，之后写入 processed 等目录的文件都在清理范围内
+        self._managed_since()
+        if settings.UPLOAD_JANITOR_INTERVAL_S <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="upload-janitor", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                result = self.sweep()
+                if result["files_removed"]:
+                    print(f"🧹 上传目录清理: 删除 {result['files_removed']} 个文件，"
+                          f"释放 {result['bytes_freed'] / 1024 / 1024:.1f}MB")
+            except Exception as e:
+                print(f"⚠️ 上传目录清理失败: {e}")
+            if self._stop.wait(settings.UPLOAD_JANITOR_INTERVAL_S):
+                break
+
+    def shutdown(self):
+        """停止后台清理线程"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join(timeout=5)
+        self._thread = None
+
+    def stats(self) -> Dict:
+        return {
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+            "deduplicated_bytes": self.deduplicated_bytes,
+            "hard_links": self._link_supported,
+            "janitor_running": self._thread is not None,
+            "retention_hours": settings.UPLOAD_RETENTION_HOURS,
+            "quota_mb": settings.UPLOAD_QUOTA_MB,
+            "sweeps": self.sweeps,
+            "files_removed": self.files_removed,
+            "bytes_freed": self.bytes_freed,
+            "last_sweep_at": self.last_sweep_at,
+        }
+
+
+# 创建全局上传存储实例
+upload_store = UploadStore()
@@ -1,37 +1,122 @@
 import os
-import aiofiles
-from fastapi import UploadFile, HTTPException
+from typing import AsyncIterator, Optional, Tuple
+from fastapi import UploadFile
 from app.config import settings
 
-async def validate_image_file(file: UploadFile):
-    """验证图片文件"""
-    if not file.content_type or not file.content_type.startswith('image/'):
-        raise ValueError("文件必须是图片格式")
-    
-    if file.size > settings.MAX_FILE_SIZE:
-        raise ValueError(f"文件大小不能超过 {settings.MAX_FILE_SIZE // 1024 // 1024}MB")
-    
-    filename = file.filename.lower()
-    file_ext = os.path.splitext(filename)[1]
-    if file_ext not in settings.ALLOWED_EXTENSIONS:
-        raise ValueError(f"不支持的文件格式。支持的格式: {', '.join(settings.ALLOWED_EXTENSIONS)}")
-
-async def save_upload_file(file: UploadFile, save_dir: str, filename: str = None) -> str:
-    """保存上传的文件"""
-    os.makedirs(save_dir, exist_ok=True)
-    
-    if not filename:
-        import uuid
-        file_ext = os.path.splitext(file.filename)[1]
-        filename = f"{uuid.uuid4()}{file_ext}"
-    
-    file_path = os.path.join(save_dir, filename)
-    
-    async with aiofiles.open(file_path, 'wb') as f:
-        content = await file.read()
-        await f.write(content)
-    
-    return file_path
+# 每次从上传文件读取的块大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 图片格式 -> 保存文件时使用的扩展名
+IMAGE_EXTENSIONS = {"jpeg": ".jpg", "png": ".png", "bmp": ".bmp", "webp": ".webp"}
+
+# 文件头特征（magic bytes），WebP 另行判断（RIFF....WEBP）
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"BM", "bmp"),
+)
+# 识别格式所需的最少字节数
+SNIFF_BYTES = 12
+
+
+class UploadTooLargeError(ValueError):
+    """上传文件超过大小上限（接口返回413）"""
+
+
+def sniff_image_format(header) -> Optional[str]:
+    """根据文件头识别图片格式（jpeg / png / bmp / webp），无法识别时返回 None"""
+    header = bytes(header[:SNIFF_BYTES])
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    for signature, image_format in _SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    return None
+
+
+def check_image_format(header) -> str:
+    """按文件头识别格式，不是支持的图片格式时抛出 ValueError"""
+    image_format = sniff_image_format(header)
+    if image_format is None or IMAGE_EXTENSIONS[image_format] not in settings.ALLOWED_EXTENSIONS:
+        allowed = ", ".join(sorted(settings.ALLOWED_EXTENSIONS))
+        raise ValueError(f"不支持的文件格式（按文件内容识别）。支持的格式: {allowed}")
+    return image_format
+
+
+def _check_declared_size(file: UploadFile, max_size: int = None) -> int:
+    """解析表单时已知文件大小的，超过上限（默认 MAX_FILE_SIZE）直接拒绝；返回生效的上限"""
+    limit = settings.MAX_FILE_SIZE if max_size is None else max_size
+    size = getattr(file, "size", None)
+    if size is not None and size > limit:
+        raise UploadTooLargeError(f"文件大小不能超过 {limit / 1024 / 1024:g}MB")
+    return limit
+
+
+async def iter_upload_chunks(file: UploadFile, max_size: int = None) -> AsyncIterator[bytes]:
+    """
+    按 UPLOAD_CHUNK_SIZE 分块读取上传文件
+
+    累计大小超过 max_size（默认 MAX_FILE_SIZE）时立即抛出 UploadTooLargeError，不再读取剩余部分；
+    解析表单时已知文件大小的，读取之前就拒绝。
+    """
+    limit = _check_declared_size(file, max_size)
+    too_large = f"文件大小不能超过 {limit / 1024 / 1024:g}MB"
+    length = 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        length += len(chunk)
+        if length > limit:
+            raise UploadTooLargeError(too_large)
+        yield chunk
+
+
+async def read_image_upload(file: UploadFile, max_size: int = None) -> Tuple[bytearray, str]:
+    """
+    分块读取上传的图片，返回 (文件内容, 图片格式)
+
+    - 读到首块即按文件头识别格式，不是支持的图片时立即拒绝（不信任扩展名与 Content-Type）
+    - 大小上限的处理见 iter_upload_chunks
+    - 各块直接追加到同一个 bytearray（已知大小时预分配），解码器直接使用该缓冲区，
+      不会再次读取或复制，每个上传文件的峰值内存约为一份文件大小
+    - 声明的大小超过上限时在分配缓冲区之前拒绝；预分配不超过上限，声明值不可信
+
+    Raises:
+        UploadTooLargeError: 超过大小上限
+        ValueError: 不是支持的图片格式
+    """
+    limit = _check_declared_size(file, max_size)
+    size = min(getattr(file, "size", None) or 0, limit)
+    buffer = bytearray(size) if size else bytearray()
+    view = memoryview(buffer) if size else None
+    length = 0
+    image_format = None
+    try:
+        async for chunk in iter_upload_chunks(file, max_size):
+            end = length + len(chunk)
+            if view is not None and end <= len(buffer):
+                view[length:end] = chunk
+            else:
+                # 实际大小与表单声明不符时退回追加方式
+                if view is not None:
+                    view.release()
+                    view = None
+                    del buffer[length:]
+                buffer += chunk
+            length = end
+            if image_format is None and length >= SNIFF_BYTES:
+                image_format = check_image_format(buffer)
+    finally:
+        if view is not None:
+            view.release()
+
+    if length < len(buffer):
+        del buffer[length:]
+    if image_format is None:
+        image_format = check_image_format(buffer)
+    return buffer, image_format
+
 
 def ensure_directories():
     """确保必要的目录存在"""
@@ -39,8 +124,9 @@ def ensure_directories():
         settings.UPLOAD_DIR,
         os.path.join(settings.UPLOAD_DIR, "original"),
         os.path.join(settings.UPLOAD_DIR, "processed"),
-        os.path.join(settings.UPLOAD_DIR, "temp")
+        os.path.join(settings.UPLOAD_DIR, "temp"),
+        os.path.join(settings.UPLOAD_DIR, "blobs")
     ]
-    
+
     for directory in directories:
-        os.makedirs(directory, exist_ok=True)
\ No newline at end of file
+        os.makedirs(directory, exist_ok=True)
@@ -0,0 +1,123 @@
+import json
+import uuid
+from typing import AsyncIterator, Dict, Optional
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from app.models.schemas import ProcessScoreResponse
+from app.services.base64_service import ImageEncoding
+
+# 处理接口支持的输出格式
+#   json:   Base64 图片内嵌在 JSON 中（默认，兼容当前Vue前端）
+#   binary: multipart/mixed，首段为JSON元数据，其后为原始PNG图片
+#   score:  仅返回分数与描述，不生成任何图片
+OUTPUT_FORMATS = ("json", "binary", "score")
+
+# 流式接口支持的格式
+#   ndjson: 每行一条JSON记录（application/x-ndjson，默认）
+#   sse:    Server-Sent Events（text/event-stream），浏览器可直接用 EventSource / fetch 读取
+STREAM_FORMATS = ("ndjson", "sse")
+
+
+def resolve_output_format(output_format: Optional[str], accept: Optional[str]) -> str:
+    """根据 format 参数与 Accept 请求头确定输出格式，显式参数优先"""
+    if output_format:
+        output_format = output_format.lower()
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"不支持的输出格式: {output_format}，可选: {', '.join(OUTPUT_FORMATS)}")
+        return output_format
+
+    if accept and "multipart/mixed" in accept.lower():
+        return "binary"
+    return "json"
+
+
+def resolve_stream_format(stream_format: Optional[str], accept: Optional[str]) -> str:
+    """流式接口的输出格式，显式参数优先，其次 Accept: text/event-stream"""
+    if stream_format:
+        stream_format = stream_format.lower()
+        if stream_format not in STREAM_FORMATS:
+            raise ValueError(f"不支持的流式格式: {stream_format}，可选: {', '.join(STREAM_FORMATS)}")
+        return stream_format
+
+    if accept and "text/event-stream" in accept.lower():
+        return "sse"
+    return "ndjson"
+
+
+def build_stream_response(records: AsyncIterator[Dict], stream_format: str) -> StreamingResponse:
+    """
+    逐条输出记录的流式响应
+
+    记录由异步迭代器按需产出，客户端读取多快就生成多快；
+    SSE 的事件名取记录的 type 字段（result / summary）。
+    """
+    async def encode():
+        try:
+            async for record in records:
+                data = json.dumps(record, ensure_ascii=False)
+                if stream_format == "sse":
+                    yield f"event: {record.get('type', 'message')}\ndata: {data}\n\n".encode("utf-8")
+                else:
+                    yield (data + "\n").encode("utf-8")
+        finally:
+            # 客户端断开时立即关闭记录源，取消尚未完成的检测
+            await records.aclose()
+
+    media_type = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    # 禁止代理缓冲与缓存，保证每条记录及时送达
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(encode(), media_type=media_type, headers=headers)
+
+
+def build_score_response(result: Dict) -> JSONResponse:
+    """仅包含分数与描述的JSON响应"""
+    return JSONResponse(ProcessScoreResponse(
+        anomalyScore=result["anomaly_score"],
+        defectDescription=result["defect_description"]
+    ).dict())
+
+
+def build_multipart_response(result: Dict) -> Response:
+    """
+    构建 multipart/mixed 响应
+
+    第一段为 application/json 元数据（anomalyScore、defectDescription、imageFormat 及各图片段名称），
+    随后每张图片一段原始图片数据（image/png、image/webp 或 image/jpeg），避免Base64膨胀和大字符串JSON序列化。
+    """
+    boundary = uuid.uuid4().hex
+    image_format = result.get("image_format") or "png"
+    extension = ImageEncoding(image_format).extension
+    images = [
+        ("convertedGerber", result.get("converted_bytes")),
+        ("anomalyImage", result.get("anomaly_bytes")),
+    ]
+    images = [(name, data) for name, data in images if data is not None]
+
+    metadata = {
+        "anomalyScore": result["anomaly_score"],
+        "defectDescription": result["defect_description"],
+        "imageFormat": image_format,
+        "parts": [name for name, _ in images],
+    }
+
+    chunks = [
+        _part_header(boundary, "application/json", 'inline; name="metadata"'),
+        json.dumps(metadata, ensure_ascii=False).encode("utf-8"),
+        b"\r\n",
+    ]
+    for name, data in images:
+        chunks.append(_part_header(boundary, f"image/{image_format}",
+                                   f'inline; name="{name}"; filename="{name}.{extension}"'))
+        chunks.append(data)
+        chunks.append(b"\r\n")
+    chunks.append(f"--{boundary}--\r\n".encode("ascii"))
+
+    return Response(content=b"".join(chunks), media_type=f"multipart/mixed; boundary={boundary}")
+
+
+def _part_header(boundary: str, content_type: str, disposition: str) -> bytes:
+    return (
+        f"--{boundary}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Disposition: {disposition}\r\n"
+        "\r\n"
+    ).encode("utf-8")
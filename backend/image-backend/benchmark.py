@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+检测流程各阶段的进程内基准测试
+
+直接调用 Base64Service、ONNXService（preprocess_image / run_inference / parse_results）、
+HeatmapRenderer 与 AlgorithmService.process_images，输入为 TestImageGenerator
+生成的合成图片，按多种分辨率与批大小统计延迟分位数与吞吐量（完整请求路径另记峰值数组内存），
+结果写入JSON，可与之前的结果对比并标出性能回退。
+
+用法:
+    python benchmark.py --output bench.json
+    python benchmark.py --sizes 640x480,2048x1536 --batch-sizes 1,2,4,8 --repeat 30 --output new.json --baseline bench.json
+    python benchmark.py --compare bench.json new.json --threshold 0.1
+
+未找到模型文件时只运行不依赖模型的阶段（Base64编解码、热力图）。
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from app.config import settings
+
+# 对比时用于判定回退的指标（越大越差）
+COMPARE_METRIC = "p50_ms"
+
+
+def parse_sizes(text: str) -> List[tuple]:
+    """'640x480,1920x1080' -> [(640, 480), (1920, 1080)]（宽x高）"""
+    sizes = []
+    for item in text.split(","):
+        width, height = (int(v) for v in item.lower().split("x"))
+        sizes.append((width, height))
+    return sizes
+
+
+def summarize(samples: List[float], items_per_call: int = 1) -> Dict:
+    """单次调用耗时（秒）-> 延迟分位数（毫秒）与吞吐量（样本/秒）"""
+    ms = np.asarray(samples) * 1000.0
+    mean_s = float(np.mean(samples))
+    return {
+        "iterations": len(samples),
+        "items_per_call": items_per_call,
+        "mean_ms": float(np.mean(ms)),
+        "min_ms": float(np.min(ms)),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(np.max(ms)),
+        "throughput_per_s": items_per_call / mean_s if mean_s > 0 else 0.0,
+    }
+
+
+def measure(func: Callable, repeat: int, warmup: int = 2, items_per_call: int = 1) -> Dict:
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples, items_per_call)
+
+
+def peak_allocation_mb(func: Callable) -> float:
+    """单次调用期间数组分配的峰值（tracemalloc 统计 NumPy 与 OpenCV 输出数组，不含 PIL 内部缓冲）"""
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def measure_concurrent(func: Callable, threads: int, repeat: int, warmup: int = 1) -> Dict:
+    """threads 个线程同时调用 func 为一轮，统计每轮耗时（用于观察动态组批与线程扩展性）"""
+    def one_round():
+        barrier = threading.Barrier(threads)
+
+        def worker():
+            barrier.wait()
+            func()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        start = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        return time.perf_counter() - start
+
+    for _ in range(warmup):
+        one_round()
+    return summarize([one_round() for _ in range(repeat)], threads)
+
+
+def synthetic_pair(width: int, height: int):
+    """按目标分辨率生成一对查询图/Gerber图（PIL RGB）"""
+    from app.utils.test_utils import TestImageGenerator
+    # 生成器按400x300布局绘制，先生成再缩放到目标分辨率
+    query = TestImageGenerator.generate_sample_image(image_type="query").resize((width, height))
+    gerber = TestImageGenerator.generate_sample_image(image_type="gerber").resize((width, height))
+    return query, gerber
+
+
+def run_suite(args) -> Dict:
+    # 服务模块在导入时读取 settings，需在修改配置后再导入
+    if args.no_batching:
+        settings.BATCH_MAX_SIZE = 1
+    settings.MODELS = {"bench": {"path": args.model, "input_size": args.input_size}}
+    settings.DEFAULT_MODEL = "bench"
+    from app.services.base64_service import base64_service, ImageEncoding
+    from app.services.heatmap_service import heatmap_renderer
+    from app.services.model_registry import model_registry
+
+    sizes = parse_sizes(args.sizes)
+    batch_sizes = [int(v) for v in args.batch_sizes.split(",")]
+    results: Dict[str, Dict] = {}
+
+    def record(name: str, stats: Dict):
+        results[name] = stats
+        print(f"  {name:<32} p50 {stats['p50_ms']:9.2f}ms  p99 {stats['p99_ms']:9.2f}ms  "
+              f"{stats['throughput_per_s']:9.1f}/s")
+
+    pairs = {size: synthetic_pair(*size) for size in sizes}
+
+    print("🖼️ Base64 编解码")
+    for (width, height), (query, _) in pairs.items():
+        encoded = base64_service.image_to_base64(query)
+        record(f"base64_encode@{width}x{height}",
+               measure(lambda: base64_service.image_to_base64(query), args.repeat))
+        record(f"base64_decode@{width}x{height}",
+               measure(lambda: base64_service.base64_to_image(encoded), args.repeat))
+        # 结果图片编码（每种格式单独计时，见 IMAGE_ENCODING）
+        query_np = np.array(query)
+        for text in ("png:1", "png:6", "webp", "jpeg"):
+            encoding = ImageEncoding.parse(text)
+            record(f"encode_{str(encoding).replace(':', '')}@{width}x{height}",
+                   measure(lambda: base64_service.encode(query_np, encoding), args.repeat))
+        # 相机原图通常为JPEG：对比原分辨率解码与只需模型输入时的缩小解码（DCT draft）
+        jpeg = base64_service.image_to_bytes(query, "JPEG")
+        record(f"jpeg_decode@{width}x{height}",
+               measure(lambda: base64_service.bytes_to_array(jpeg), args.repeat))
+        record(f"jpeg_decode_reduced@{width}x{height}",
+               measure(lambda: base64_service.bytes_to_array(jpeg, (args.input_size, args.input_size)), args.repeat))
+
+    onnx_service = None
+    if os.path.exists(args.model):
+        onnx_service = model_registry.get("bench")
+    else:
+        print(f"⚠️ 未找到模型文件 {args.model}，跳过推理相关阶段（可用 --model 指定）")
+
+    if onnx_service is not None:
+        model_w, model_h = onnx_service.input_shape
+
+        print("⚙️ 预处理 / 推理 / 结果解析")
+        outputs = None
+        for (width, height), (query, gerber) in pairs.items():
+            query_np = np.array(query)
+            gerber_np = np.array(gerber)
+            record(f"preprocess@{width}x{height}",
+                   measure(lambda: onnx_service.preprocess_image(query_np), args.repeat))
+            record(f"run_inference@{width}x{height}",
+                   measure(lambda: onnx_service.run_inference(query_np, gerber_np), args.repeat))
+            outputs = onnx_service.run_inference(query_np, gerber_np)
+        record("parse_results", measure(lambda: onnx_service.parse_results(outputs), args.repeat))
+
+        # session.run 本身随批大小的开销（不经过调度器）；batch维固定的模型只测其固定批大小
+        batch_dim = onnx_service.session.get_inputs()[0].shape[0]
+        for batch_size in [batch_dim] if isinstance(batch_dim, int) else batch_sizes:
+            feeds = {
+                input_meta.name: np.random.default_rng(0).standard_normal(
+                    (batch_size, 3, model_h, model_w)).astype(np.float32)
+                for input_meta in onnx_service.session.get_inputs()
+            }
+            record(f"run_batch@b{batch_size}",
+                   measure(lambda: onnx_service.run_batch(feeds), args.repeat, items_per_call=batch_size))
+
+        # 并发调用 run_inference：启用组批时由调度器合并
+        query_np = np.array(pairs[sizes[0]][0])
+        gerber_np = np.array(pairs[sizes[0]][1])
+        for threads in batch_sizes:
+            if threads > 1:
+                record(f"concurrent_inference@c{threads}",
+                       measure_concurrent(lambda: onnx_service.run_inference(query_np, gerber_np),
+                                          threads, args.repeat))
+
+    print("🔥 热力图叠加")
+    rng = np.random.default_rng(0)
+    for (width, height), (query, _) in pairs.items():
+        query_np = np.array(query)
+        mask = rng.random((height, width), dtype=np.float32)
+        record(f"heatmap@{width}x{height}",
+               measure(lambda: heatmap_renderer.render(query_np, mask), args.repeat))
+        # 模型分辨率的掩码（实际请求路径）：渲染时放大，并原地叠加到查询图缓冲
+        small_mask = rng.random((args.input_size, args.input_size), dtype=np.float32)
+        record(f"heatmap_model_mask@{width}x{height}",
+               measure(lambda: heatmap_renderer.render(query_np, small_mask, out=query_np), args.repeat))
+
+    if onnx_service is not None:
+        from app.services.algorithm_service import algorithm_service
+        print("🔁 AlgorithmService.process_images（推理 + 后处理）")
+        for (width, height), (query, gerber) in pairs.items():
+            record(f"process_images@{width}x{height}",
+                   measure(lambda: algorithm_service.process_images(query, gerber, "bench"), args.repeat))
+            record(f"process_images_score@{width}x{height}",
+                   measure(lambda: algorithm_service.process_images(query, gerber, "bench", include_images=False),
+                           args.repeat))
+
+        # 单个请求的完整CPU路径：JPEG解码 -> 推理与后处理 -> PNG编码，附带峰值数组内存
+        def request(query_jpeg: bytes, gerber_jpeg: bytes):
+            query_np, _ = base64_service.bytes_to_array(query_jpeg)
+            gerber_np, _ = base64_service.bytes_to_array(gerber_jpeg)
+            result = algorithm_service.process_images(query_np, gerber_np, "bench")
+            base64_service.image_to_bytes(result["converted_image"])
+            base64_service.image_to_bytes(result["anomaly_image"])
+
+        for (width, height), (query, gerber) in pairs.items():
+            query_jpeg = base64_service.image_to_bytes(query, "JPEG")
+            gerber_jpeg = base64_service.image_to_bytes(gerber, "JPEG")
+            stats = measure(lambda: request(query_jpeg, gerber_jpeg), args.repeat)
+            stats["peak_alloc_mb"] = peak_allocation_mb(lambda: request(query_jpeg, gerber_jpeg))
+            record(f"request@{width}x{height}", stats)
+            print(f"    峰值数组内存 {stats['peak_alloc_mb']:.1f}MB")
+        model_registry.shutdown()
+
+    return results
+
+
+def environment(args) -> Dict:
+    info = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "model": os.path.abspath(args.model),
+        "input_size": args.input_size,
+        "repeat": args.repeat,
+        "batching": {"max_size": settings.BATCH_MAX_SIZE, "max_wait_ms": settings.BATCH_MAX_WAIT_MS},
+        "ort_threads": {"intra_op": settings.ORT_INTRA_OP_THREADS, "inter_op": settings.ORT_INTER_OP_THREADS},
+    }
+    try:
+        import onnxruntime as ort
+        info["onnxruntime"] = ort.__version__
+    except ImportError:
+        info["onnxruntime"] = None
+    try:
+        import cv2
+        info["opencv"] = cv2.__version__
+    except ImportError:
+        info["opencv"] = None
+    return info
+
+
+def compare(baseline: Dict, current: Dict, threshold: float) -> int:
+    """逐项对比 p50 延迟，变慢超过 threshold（比例）记为回退，返回回退项数"""
+    base_results = baseline.get("results", {})
+    cur_results = current.get("results", {})
+    regressions = 0
+    print(f"📊 对比 {COMPARE_METRIC}（回退阈值 +{threshold:.0%}）")
+    print("=" * 78)
+    for name in sorted(set(base_results) | set(cur_results)):
+        if name not in base_results or name not in cur_results:
+            status = "仅基线" if name in base_results else "新增"
+            print(f"  {name:<32} {status}")
+            continue
+        before = base_results[name][COMPARE_METRIC]
+        after = cur_results[name][COMPARE_METRIC]
+        change = (after - before) / before if before > 0 else 0.0
+        if change > threshold:
+            regressions += 1
+            flag = "❌ 回退"
+        elif change < -threshold:
+            flag = "✅ 提升"
+        else:
+            flag = ""
+        print(f"  {name:<32} {before:9.2f}ms -> {after:9.2f}ms  {change:+7.1%}  {flag}")
+    print("-" * 78)
+    base_env = baseline.get("environment", {})
+    cur_env = current.get("environment", {})
+    for key in ("machine", "cpu_count", "onnxruntime", "model"):
+        if base_env.get(key) != cur_env.get(key):
+            print(f"⚠️ 运行环境不同: {key} {base_env.get(key)} -> {cur_env.get(key)}")
+    print(f"共 {regressions} 项回退" if regressions else "未发现回退")
+    return regressions
+
+
+def load_json(path: str) -> Dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检测流程各阶段基准测试")
+    parser.add_argument("--model", default=settings.ONNX_MODEL_PATH, help="ONNX模型路径")
+    parser.add_argument("--input-size", type=int, default=256, help="模型输入分辨率")
+    parser.add_argument("--sizes", default="400x300,1280x960,2592x1944", help="输入图片分辨率 WxH，逗号分隔")
+    parser.add_argument("--batch-sizes", default="1,2,4,8", help="run_batch 批大小与并发线程数，逗号分隔")
+    parser.add_argument("--repeat", type=int, default=20, help="每项重复次数")
+    parser.add_argument("--no-batching", action="store_true", help="关闭动态组批（单请求不经调度线程转发）")
+    parser.add_argument("--output", help="结果JSON输出路径")
+    parser.add_argument("--baseline", help="运行后与该结果JSON对比")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="只对比两份已有结果")
+    parser.add_argument("--threshold", type=float, default=0.10, help="判定回退的变慢比例")
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(load_json(args.compare[0]), load_json(args.compare[1]), args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    print("🚀 检测流程基准测试")
+    print("=" * 78)
+    report = {"environment": environment(args), "results": run_suite(args)}
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存: {args.output}")
+
+    if args.baseline:
+        regressions = compare(load_json(args.baseline), report, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+热力图渲染性能对比：查找表渲染器 vs 原 matplotlib 实现
+
+用法: python benchmark_heatmap.py [--sizes 1024x1024,3000x4000] [--repeat 10]
+"""
+
+import argparse
+import time
+import numpy as np
+import cv2
+
+from app.services.heatmap_service import HeatmapRenderer, available_colormaps
+
+
+def legacy_overlay(image, mask, alpha=0.6):
+    """原 ONNXService.create_heatmap_overlay 实现（matplotlib jet）"""
+    mask_norm = (mask - mask.min()) / (mask.max() - mask.min() + 1e-8)
+    import matplotlib.pyplot as plt
+    colormap = plt.cm.jet
+    heatmap = colormap(mask_norm)[:, :, :3]
+    heatmap = (heatmap * 255).astype(np.uint8)
+    return cv2.addWeighted(image, 1 - alpha, heatmap, alpha, 0)
+
+
+def time_per_megapixel(func, image, mask, repeat):
+    """返回每百万像素的中位耗时（毫秒）"""
+    func(image, mask)  # 预热
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(image, mask)
+        samples.append(time.perf_counter() - start)
+    megapixels = mask.shape[0] * mask.shape[1] / 1e6
+    return float(np.median(samples)) * 1000 / megapixels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="热力图渲染性能对比")
+    parser.add_argument("--sizes", default="256x256,1024x1024,3000x4000", help="HxW，逗号分隔")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    try:
+        import matplotlib  # noqa: F401
+        has_matplotlib = True
+    except ImportError:
+        has_matplotlib = False
+        print("⚠️ 未安装 matplotlib，跳过原实现对比")
+
+    renderer = HeatmapRenderer()
+    rng = np.random.default_rng(0)
+
+    print("🔥 热力图渲染耗时（ms / 百万像素）")
+    print("=" * 50)
+    for size in args.sizes.split(","):
+        h, w = (int(v) for v in size.lower().split("x"))
+        image = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+        mask = rng.random((h, w), dtype=np.float32)
+
+        lut_cost = time_per_megapixel(renderer.render, image, mask, args.repeat)
+        line = f"{h}x{w}: LUT {lut_cost:.2f}"
+        if has_matplotlib:
+            legacy_cost = time_per_megapixel(legacy_overlay, image, mask, args.repeat)
+            line += f" | matplotlib {legacy_cost:.2f} | 加速 {legacy_cost / lut_cost:.1f}x"
+        print(line)
+
+    print("-" * 50)
+    print(f"可选色表: {', '.join(available_colormaps())}")
+
+
+if __name__ == "__main__":
+    main()
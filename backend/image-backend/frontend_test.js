@@ -35,13 +35,13 @@ async function processImages(queryFile, gerberFile) {
             // 显示返回的图片
             if (result.convertedGerber) {
                 const convertedImg = document.createElement('img');
-                convertedImg.src = `data:image/png;base64,${result.convertedGerber}`;
+                convertedImg.src = `data:image/${result.imageFormat || 'png'};base64,${result.convertedGerber}`;
                 document.body.appendChild(convertedImg);
             }
             
             if (result.anomalyImage) {
                 const anomalyImg = document.createElement('img');
-                anomalyImg.src = `data:image/png;base64,${result.anomalyImage}`;
+                anomalyImg.src = `data:image/${result.imageFormat || 'png'};base64,${result.anomalyImage}`;
                 document.body.appendChild(anomalyImg);
             }
             
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+生成与正式模型输入输出一致的合成ONNX模型（用于基准测试、压测与离线联调）
+
+仓库不包含 settings.ONNX_MODEL_PATH 指向的正式模型，干净环境中无法越过 load_model。
+本脚本生成同样接口的小模型：
+    输入  img / gerber          [N, 3, H, W]  float32（ImageNet标准化后）
+    输出  anomaly_pred          [N, 2]        （正常/缺陷概率）
+          anomaly_mask          [N, 1, H, W]  （0~1 异常热力图）
+          style_output          [N, 3, H, W]  （标准化空间的风格图）
+
+异常分数与热力图由两图逐像素差异得到（相同图片分数为0，差异越大分数越高），
+风格图经过 --depth 层 --width 通道的 3x3 卷积，用于调节计算量以模拟正式模型的耗时。
+
+用法:
+    python generate_synthetic_model.py --output app/models/synthetic_256.onnx
+    python generate_synthetic_model.py --input-size 512 --depth 8 --width 64 --output app/models/synthetic_512.onnx --check
+
+生成后在 app/config.py 的 MODELS 中指向该文件，或传给 benchmark.py --model。
+依赖 onnx 包（pip install -r requirements-dev.txt），服务运行本身不需要。
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+
+def conv_flops(height: int, width: int, depth: int, channels: int) -> float:
+    """每个样本的卷积乘加次数 x2（近似FLOPs）"""
+    flops = 2 * height * width * 6 * channels * 9  # 输入层：img+gerber 共6通道
+    flops += 2 * height * width * channels * channels * 9 * (depth - 1)
+    flops += 2 * height * width * channels * 3  # 1x1 输出层
+    return float(flops)
+
+
+def build_model(height: int, width: int, depth: int = 4, channels: int = 32, batch: int = 0,
+                opset: int = 13, seed: int = 0):
+    """构建合成模型；batch 为0时batch维可变（支持动态组批）"""
+    try:
+        import onnx
+        from onnx import TensorProto, helper, numpy_helper
+    except ImportError:
+        raise SystemExit("❌ 需要 onnx 包: pip install -r requirements-dev.txt")
+
+    if depth < 1:
+        raise SystemExit("❌ --depth 至少为1")
+    rng = np.random.default_rng(seed)
+    batch_dim = batch if batch > 0 else "N"
+    initializers = []
+
+    def const(name: str, array: np.ndarray) -> str:
+        initializers.append(numpy_helper.from_array(np.asarray(array), name))
+        return name
+
+    def conv_weight(name: str, out_ch: int, in_ch: int, k: int, scale: float = None) -> str:
+        # He 初始化，保证多层堆叠后数值不发散
+        std = scale if scale is not None else np.sqrt(2.0 / (in_ch * k * k))
+        return const(name, (rng.standard_normal((out_ch, in_ch, k, k)) * std).astype(np.float32))
+
+    nodes = [
+        # 异常分支：逐像素差异 -> 通道平均 -> tanh 压到 [0, 1)
+        helper.make_node("Sub", ["img", "gerber"], ["diff"]),
+        helper.make_node("Abs", ["diff"], ["abs_diff"]),
+        helper.make_node("ReduceMean", ["abs_diff"], ["diff_mean"], axes=[1], keepdims=1),
+        helper.make_node("Tanh", ["diff_mean"], ["anomaly_mask"]),
+        helper.make_node("ReduceMean", ["anomaly_mask"], ["score"], axes=[1, 2, 3], keepdims=0),
+        helper.make_node("Sub", [const("one", np.array(1.0, np.float32)), "score"], ["normal"]),
+        helper.make_node("Unsqueeze", ["normal", const("axis1", np.array([1], np.int64))], ["normal_col"]),
+        helper.make_node("Unsqueeze", ["score", "axis1"], ["defect_col"]),
+        helper.make_node("Concat", ["normal_col", "defect_col"], ["anomaly_pred"], axis=1),
+        # 风格分支：img/gerber 拼接后经过卷积堆叠，输出与 gerber 残差相加
+        helper.make_node("Concat", ["img", "gerber"], ["pair"], axis=1),
+    ]
+    previous, in_ch = "pair", 6
+    for i in range(depth):
+        nodes.append(helper.make_node(
+            "Conv", [previous, conv_weight(f"conv{i}.weight", channels, in_ch, 3),
+                     const(f"conv{i}.bias", np.zeros(channels, np.float32))],
+            [f"conv{i}"], kernel_shape=[3, 3], pads=[1, 1, 1, 1],
+        ))
+        nodes.append(helper.make_node("Relu", [f"conv{i}"], [f"relu{i}"]))
+        previous, in_ch = f"relu{i}", channels
+    nodes.append(helper.make_node(
+        "Conv", [previous, conv_weight("style.weight", 3, channels, 1, scale=0.01),
+                 const("style.bias", np.zeros(3, np.float32))],
+        ["style_delta"], kernel_shape=[1, 1],
+    ))
+    nodes.append(helper.make_node("Add", ["gerber", "style_delta"], ["style_output"]))
+
+    def tensor(name, shape):
+        return helper.make_tensor_value_info(name, TensorProto.FLOAT, shape)
+
+    graph = helper.make_graph(
+        nodes, "synthetic_pcb_inspection",
+        inputs=[tensor("img", [batch_dim, 3, height, width]), tensor("gerber", [batch_dim, 3, height, width])],
+        outputs=[
+            tensor("anomaly_pred", [batch_dim, 2]),
+            tensor("anomaly_mask", [batch_dim, 1, height, width]),
+            tensor("style_output", [batch_dim, 3, height, width]),
+        ],
+        initializer=initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", opset)],
+                              producer_name="generate_synthetic_model")
+    # onnxruntime 1.16 最高支持 IR 9，固定为 8 以兼容 requirements 中的版本
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    return model
+
+
+def check_model(path: str, height: int, width: int, batch: int):
+    """用 onnxruntime 跑一次，确认输出形状并给出单次耗时"""
+    import onnxruntime as ort
+    session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+    n = batch if batch > 0 else 2
+    rng = np.random.default_rng(0)
+    img = rng.standard_normal((n, 3, height, width)).astype(np.float32)
+    feeds = {"img": img, "gerber": img.copy()}
+    session.run(None, feeds)
+    start = time.perf_counter()
+    outputs = session.run(None, feeds)
+    elapsed = (time.perf_counter() - start) * 1000.0
+    for meta, value in zip(session.get_outputs(), outputs):
+        print(f"   {meta.name}: {list(value.shape)}")
+    print(f"   相同输入的缺陷概率: {float(outputs[0][0, 1]):.4f}（应为0）")
+    print(f"⏱️ 批大小 {n} 单次推理 {elapsed:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成与正式模型接口一致的合成ONNX模型")
+    parser.add_argument("--output", default="app/models/synthetic_256.onnx", help="输出路径")
+    parser.add_argument("--input-size", default="256", help="输入分辨率：256 或 WxH")
+    parser.add_argument("--depth", type=int, default=4, help="3x3 卷积层数（调节计算量）")
+    parser.add_argument("--width", type=int, default=32, help="卷积通道数（调节计算量）")
+    parser.add_argument("--batch", type=int, default=0, help="固定batch维大小（如1，与batch维固定的正式模型一致），0为可变（支持动态组批）")
+    parser.add_argument("--opset", type=int, default=13)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--check", action="store_true", help="生成后用 onnxruntime 验证并测量耗时")
+    args = parser.parse_args()
+
+    if "x" in args.input_size.lower():
+        width, height = (int(v) for v in args.input_size.lower().split("x"))
+    else:
+        width = height = int(args.input_size)
+
+    model = build_model(height, width, args.depth, args.width, args.batch, args.opset, args.seed)
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    import onnx
+    onnx.save(model, args.output)
+
+    gflops = conv_flops(height, width, args.depth, args.width) / 1e9
+    print(f"✅ 合成模型已生成: {args.output}")
+    print(f"   输入 {width}x{height}，batch维 {'可变' if args.batch <= 0 else args.batch}，"
+          f"{args.depth} 层 x {args.width} 通道，约 {gflops:.2f} GFLOPs/样本，"
+          f"文件 {os.path.getsize(args.output) / 1024:.0f}KB")
+    print(f'   使用: MODELS = {{"synthetic": {{"path": "{args.output}", "input_size": '
+          f'{width if width == height else [width, height]}}}}}')
+
+    if args.check:
+        check_model(args.output, height, width, args.batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+INT8 量化工具：生成量化模型，与 FP32 模型对比精度，通过校验的注册为可选模型
+
+- dynamic: 权重离线量化为INT8，激活在推理时动态量化（quantize_dynamic，不需要校准数据）
+- static: 用校准目录中的查询图/Gerber图对统计激活范围，生成 QDQ 格式的静态量化模型（quantize_static）
+
+校准与评估数据为图片对目录（X.jpg 与 XG.jpg，规则与批量检测任务相同），按服务端相同的
+解码与预处理生成模型输入。未指定 --eval-dir 时，同一目录中的图片对交替分为校准集与评估集。
+
+每个量化模型与 FP32 模型逐对比较：
+- anomaly_pred：按 ANOMALY_THRESHOLD（默认0.35，与 ONNXService.parse_results 相同）判定的缺陷结论翻转比例
+- anomaly_mask：与 FP32 掩码的平均/最大绝对误差
+- 单对推理耗时与相对 FP32 的加速比
+翻转比例与掩码误差都不超过阈值、且加速比不低于 --min-speedup 的模型写入 MODELS_MANIFEST，
+服务启动后即可通过 model 参数（如 "256-int8-static"）选择；未通过的模型从清单中移除。
+量化依赖 onnx 包（pip install -r requirements-dev.txt），只有本工具需要。
+
+用法:
+    python quantize.py --calibration-dir data/pairs
+    python quantize.py --model app/models/20251005100417.onnx --calibration-dir data/calib --eval-dir data/eval \\
+        --methods static --max-flip-rate 0.01 --max-mask-mae 0.02 --output quantize_report.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+
+METHODS = ("dynamic", "static")
+
+
+def find_model_name(model_path: str) -> Optional[str]:
+    """settings.MODELS 中路径为 model_path 的模型名"""
+    for name, cfg in settings.MODELS.items():
+        if os.path.abspath(cfg["path"]) == os.path.abspath(model_path):
+            return name
+    return None
+
+
+def load_pairs(directory: str) -> List[Dict]:
+    """目录（含子目录）中的图片对，路径为绝对路径"""
+    from app.services.job_service import find_pairs
+    names = []
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            names.append(os.path.relpath(os.path.join(dirpath, filename), directory).replace(os.sep, "/"))
+    pairs = find_pairs(names)
+    for pair in pairs:
+        pair["query"] = os.path.join(directory, pair["query"])
+        pair["gerber"] = os.path.join(directory, pair["gerber"])
+    return pairs
+
+
+def load_samples(pairs: List[Dict], input_shape: Tuple[int, int]) -> List[Dict[str, np.ndarray]]:
+    """解码并预处理图片对，返回模型输入 [{"img": [1,3,H,W], "gerber": [1,3,H,W]}]"""
+    from app.services.base64_service import base64_service
+    from app.services.preprocess_service import ImagePreprocessor
+    preprocessor = ImagePreprocessor(input_shape)
+    width, height = input_shape
+    samples = []
+    for pair in pairs:
+        sample = {}
+        for name, key in (("img", "query"), ("gerber", "gerber")):
+            with open(pair[key], "rb") as f:
+                image, _ = base64_service.bytes_to_array(f.read(), input_shape)
+            sample[name] = preprocessor.preprocess_into(image, np.empty((1, 3, height, width), dtype=np.float32))
+        samples.append(sample)
+    return samples
+
+
+def split_pairs(args) -> Tuple[List[Dict], List[Dict]]:
+    """校准集与评估集"""
+    calibration = load_pairs(args.calibration_dir)
+    if args.eval_dir:
+        evaluation = load_pairs(args.eval_dir)
+    elif len(calibration) >= 2:
+        calibration, evaluation = calibration[0::2], calibration[1::2]
+    else:
+        evaluation = calibration
+        print("⚠️ 图片对不足，评估集与校准集相同，精度结果偏乐观")
+    if not calibration or not evaluation:
+        raise SystemExit("❌ 没有可用的图片对（X.jpg 与 XG.jpg）")
+    return calibration[:args.calibration_samples], evaluation
+
+
+def preprocess_model(source: str, output_path: str) -> str:
+    """量化前的形状推断与图优化（quant_pre_process）；缺少 sympy 时跳过符号形状推断，失败时使用原模型"""
+    from onnxruntime.quantization import quant_pre_process
+    for skip_symbolic_shape in (False, True):
+        try:
+            quant_pre_process(source, output_path, skip_symbolic_shape=skip_symbolic_shape)
+            return output_path
+        except Exception as e:
+            error = e
+    print(f"⚠️ 量化前处理失败，直接量化原模型: {error}")
+    return source
+
+
+class PairCalibrationReader:
+    """按图片对依次提供校准输入（onnxruntime CalibrationDataReader 接口）"""
+
+    def __init__(self, samples: List[Dict[str, np.ndarray]]):
+        self.samples = samples
+        self._iter = iter(samples)
+
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        return next(self._iter, None)
+
+    def rewind(self):
+        self._iter = iter(self.samples)
+
+
+def quantize_model(method: str, source: str, output_path: str, calibration: List[Dict[str, np.ndarray]], args):
+    from onnxruntime.quantization import (CalibrationMethod, QuantFormat, QuantType,
+                                          quantize_dynamic, quantize_static)
+    if method == "dynamic":
+        # ConvInteger 在CPU上只有 uint8 权重的高效实现
+        quantize_dynamic(source, output_path, weight_type=QuantType.QUInt8)
+    else:
+        quantize_static(
+            source, output_path, PairCalibrationReader(calibration),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+            calibrate_method=getattr(CalibrationMethod, args.calibration_method),
+        )
+
+
+def run_model(model_path: str, input_shape: Tuple[int, int], samples: List[Dict[str, np.ndarray]],
+              repeat: int) -> Tuple[List[Dict[str, np.ndarray]], float]:
+    """用服务端相同的会话配置逐对推理，返回各对输出与单对平均耗时（毫秒）"""
+    from app.services.onnx_service import ONNXService
+    service = ONNXService(input_shape, model_path=model_path)
+    if not service.load_model(model_path):
+        raise RuntimeError(f"模型加载失败: {model_path}")
+    try:
+        outputs = [service.run_batch(sample) for sample in samples]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for sample in samples:
+                service.run_batch(sample)
+        latency_ms = (time.perf_counter() - start) * 1000.0 / (repeat * len(samples))
+    finally:
+        service.shutdown()
+    return outputs, latency_ms
+
+
+def compare_outputs(baseline: List[Dict[str, np.ndarray]], candidate: List[Dict[str, np.ndarray]]) -> Dict:
+    """缺陷结论（ANOMALY_THRESHOLD）与异常掩码相对 FP32 的差异"""
+    metrics = {"pairs": len(baseline)}
+    if "anomaly_pred" in baseline[0]:
+        threshold = settings.ANOMALY_THRESHOLD
+        base = np.array([float(output["anomaly_pred"][0][1]) for output in baseline])
+        cand = np.array([float(output["anomaly_pred"][0][1]) for output in candidate])
+        flips = int(np.count_nonzero((base > threshold) != (cand > threshold)))
+        metrics.update({
+            "threshold": threshold,
+            "decision_flips": flips,
+            "flip_rate": flips / len(base),
+            "defect_prob_mae": float(np.mean(np.abs(base - cand))),
+            "defect_prob_max_error": float(np.max(np.abs(base - cand))),
+        })
+    if "anomaly_mask" in baseline[0]:
+        errors = [np.abs(b["anomaly_mask"].astype(np.float32) - c["anomaly_mask"].astype(np.float32))
+                  for b, c in zip(baseline, candidate)]
+        metrics.update({
+            "mask_mae": float(np.mean([error.mean() for error in errors])),
+            "mask_max_error": float(max(error.max() for error in errors)),
+        })
+    return metrics
+
+
+def check_gate(metrics: Dict, args) -> List[str]:
+    """未通过的原因（为空表示通过）"""
+    reasons = []
+    if metrics.get("flip_rate", 0.0) > args.max_flip_rate:
+        reasons.append(f"缺陷结论翻转 {metrics['flip_rate']:.2%} > {args.max_flip_rate:.2%}")
+    if metrics.get("mask_mae", 0.0) > args.max_mask_mae:
+        reasons.append(f"掩码平均误差 {metrics['mask_mae']:.4f} > {args.max_mask_mae}")
+    if metrics["speedup"] < args.min_speedup:
+        reasons.append(f"加速比 {metrics['speedup']:.2f}x < {args.min_speedup}x")
+    return reasons
+
+
+def load_manifest(path: str) -> Dict:
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"models": {}}
+
+
+def save_manifest(path: str, manifest: Dict):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="INT8 量化与精度校验")
+    parser.add_argument("--model", default=settings.ONNX_MODEL_PATH, help="FP32 ONNX模型路径")
+    parser.add_argument("--name", help="模型名前缀，默认取 settings.MODELS 中该路径对应的模型名")
+    parser.add_argument("--input-size", type=int, help="模型输入分辨率，默认取 settings.MODELS 中的配置")
+    parser.add_argument("--calibration-dir", required=True, help="校准图片对目录（X.jpg 与 XG.jpg）")
+    parser.add_argument("--eval-dir", help="评估图片对目录，默认与校准目录交替划分")
+    parser.add_argument("--calibration-samples", type=int, default=128, help="最多使用的校准图片对数")
+    parser.add_argument("--calibration-method", default="MinMax", choices=["MinMax", "Entropy", "Percentile"],
+                        help="静态量化的激活范围统计方法")
+    parser.add_argument("--methods", default=",".join(METHODS), help="量化方式，逗号分隔（dynamic,static）")
+    parser.add_argument("--output-dir", help="量化模型输出目录，默认为 MODELS_MANIFEST 所在目录")
+    parser.add_argument("--max-flip-rate", type=float, default=0.01, help="缺陷结论翻转比例上限")
+    parser.add_argument("--max-mask-mae", type=float, default=0.02, help="anomaly_mask 平均绝对误差上限")
+    parser.add_argument("--min-speedup", type=float, default=1.0, help="相对 FP32 的最低加速比")
+    parser.add_argument("--repeat", type=int, default=3, help="计时时评估集的重复遍数")
+    parser.add_argument("--keep-failed", action="store_true", help="保留未通过校验的模型文件")
+    parser.add_argument("--output", help="结果JSON输出路径")
+    args = parser.parse_args()
+
+    methods = [m.strip() for m in args.methods.split(",") if m.strip()]
+    unknown = [m for m in methods if m not in METHODS]
+    if unknown:
+        raise SystemExit(f"❌ 不支持的量化方式: {', '.join(unknown)}，可选: {', '.join(METHODS)}")
+    if not os.path.exists(args.model):
+        raise SystemExit(f"❌ 模型文件不存在: {args.model}")
+    if not settings.MODELS_MANIFEST:
+        raise SystemExit("❌ 未配置 MODELS_MANIFEST，无法注册量化模型")
+
+    # 评估时直接创建会话：不写优化计算图缓存，也不启动批调度器
+    settings.ORT_OPTIMIZED_MODEL_DIR = ""
+    settings.BATCH_MAX_SIZE = 1
+
+    base_name = args.name or find_model_name(args.model) or os.path.splitext(os.path.basename(args.model))[0]
+    base_cfg = dict(settings.MODELS.get(base_name, {}))
+    input_size = args.input_size or base_cfg.get("input_size", 256)
+    input_shape = tuple(input_size) if isinstance(input_size, (list, tuple)) else (input_size, input_size)
+    output_dir = args.output_dir or os.path.dirname(settings.MODELS_MANIFEST) or "."
+    os.makedirs(output_dir, exist_ok=True)
+
+    print("🧮 INT8 量化与精度校验")
+    print("=" * 78)
+    calibration_pairs, eval_pairs = split_pairs(args)
+    print(f"📂 校准 {len(calibration_pairs)} 对，评估 {len(eval_pairs)} 对，判定阈值 {settings.ANOMALY_THRESHOLD}")
+    calibration = load_samples(calibration_pairs, input_shape)
+    evaluation = load_samples(eval_pairs, input_shape)
+
+    baseline, baseline_ms = run_model(args.model, input_shape, evaluation, args.repeat)
+    print(f"  {'fp32':<24} {baseline_ms:8.2f}ms/对")
+
+    stem = os.path.splitext(os.path.basename(args.model))[0]
+    prepared = preprocess_model(args.model, os.path.join(output_dir, f"{stem}.prep.onnx"))
+    manifest_path = settings.MODELS_MANIFEST
+    manifest = load_manifest(manifest_path)
+    report = {"model": args.model, "fp32_ms": baseline_ms, "variants": {}}
+    try:
+        for method in methods:
+            name = f"{base_name}-int8-{method}"
+            output_path = os.path.join(output_dir, f"{stem}.int8-{method}.onnx")
+            try:
+                quantize_model(method, prepared, output_path, calibration, args)
+                outputs, latency_ms = run_model(output_path, input_shape, evaluation, args.repeat)
+            except Exception as e:
+                print(f"  {name:<24} ❌ 量化失败: {e}")
+                report["variants"][name] = {"method": method, "passed": False, "reasons": [f"量化失败: {e}"]}
+                continue
+
+            metrics = compare_outputs(baseline, outputs)
+            metrics.update({
+                "latency_ms": latency_ms,
+                "speedup": baseline_ms / latency_ms if latency_ms > 0 else 0.0,
+                "size_bytes": os.path.getsize(output_path),
+                "fp32_size_bytes": os.path.getsize(args.model),
+            })
+            reasons = check_gate(metrics, args)
+            report["variants"][name] = {"method": method, "path": output_path, "passed": not reasons,
+                                        "reasons": reasons, "metrics": metrics}
+            print(f"  {name:<24} {latency_ms:8.2f}ms/对  {metrics['speedup']:5.2f}x  "
+                  f"翻转 {metrics.get('decision_flips', 0)}/{metrics['pairs']}  "
+                  f"掩码MAE {metrics.get('mask_mae', 0.0):.4f}  "
+                  f"{'✅ 通过' if not reasons else '❌ ' + '；'.join(reasons)}")
+
+            if reasons:
+                manifest["models"].pop(name, None)
+                if not args.keep_failed:
+                    os.remove(output_path)
+                continue
+            manifest["models"][name] = {
+                **base_cfg,
+                # 相对于清单所在目录（见 load_model_manifest），服务与本工具的工作目录不同也能找到
+                "path": os.path.relpath(output_path, os.path.dirname(os.path.abspath(manifest_path))),
+                "input_size": list(input_shape),
+                "quantization": method,
+                "source": os.path.abspath(args.model),
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "metrics": metrics,
+            }
+    finally:
+        if prepared != args.model and os.path.exists(prepared):
+            os.remove(prepared)
+
+    save_manifest(manifest_path, manifest)
+    passed = [name for name, variant in report["variants"].items() if variant["passed"]]
+    print(f"💾 模型清单已更新: {manifest_path}（通过: {', '.join(passed) or '无'}）")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存: {args.output}")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+测试公共配置
+
+在导入任何 app 服务之前把上传目录、Gerber库、任务目录指向临时目录（全局单例在导入时读取配置），
+模型使用 generate_synthetic_model.py 生成的小模型（需要 onnx，见 requirements-dev.txt；未安装时跳过相关测试）。
+"""
+
+import io
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.config import settings
+
+TEST_ROOT = tempfile.mkdtemp(prefix="pcb-backend-test-")
+MODEL_NAME = "test"
+INPUT_SIZE = 64
+MODEL_PATH = os.path.join(TEST_ROOT, "models", f"synthetic_{INPUT_SIZE}.onnx")
+
+settings.UPLOAD_DIR = os.path.join(TEST_ROOT, "uploads")
+settings.GERBER_LIBRARY_DIR = os.path.join(TEST_ROOT, "uploads", "gerbers")
+settings.JOB_DIR = os.path.join(TEST_ROOT, "uploads", "jobs")
+settings.MODELS = {MODEL_NAME: {"path": MODEL_PATH, "input_size": INPUT_SIZE}}
+settings.MODELS_MANIFEST = ""
+settings.DEFAULT_MODEL = MODEL_NAME
+settings.MODEL_PRELOAD = []
+settings.ORT_OPTIMIZED_MODEL_DIR = ""
+settings.UPLOAD_JANITOR_INTERVAL_S = 0
+settings.RESULT_CACHE_DIR = ""
+settings.TRACE_FILE = ""
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TEST_ROOT, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def model_path() -> str:
+    """小尺寸合成模型（batch维可变，输出与正式模型一致）"""
+    onnx = pytest.importorskip("onnx")
+    from generate_synthetic_model import build_model
+    if not os.path.exists(MODEL_PATH):
+        os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
+        onnx.save(build_model(INPUT_SIZE, INPUT_SIZE, depth=1, channels=8), MODEL_PATH)
+    return MODEL_PATH
+
+
+@pytest.fixture(scope="session")
+def client(model_path):
+    """启动完整应用的测试客户端"""
+    from fastapi.testclient import TestClient
+    from app.main import app
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def make_image():
+    """生成随机纹理图片的编码字节：make_image(width, height, seed, format)"""
+    def make(width: int = 320, height: int = 240, seed: int = 0, format: str = "JPEG") -> bytes:
+        rng = np.random.default_rng(seed)
+        array = (rng.random((height, width, 3)) * 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(array).save(buffer, format=format)
+        return buffer.getvalue()
+    return make
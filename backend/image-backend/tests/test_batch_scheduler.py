@@ -0,0 +1,107 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app.services.batch_scheduler import BatchScheduler
+from conftest import INPUT_SIZE
+
+
+def run_concurrently(scheduler: BatchScheduler, requests):
+    """各请求在独立线程中同时提交，返回按请求顺序排列的输出"""
+    barrier = threading.Barrier(len(requests))
+    results = [None] * len(requests)
+    errors = [None] * len(requests)
+
+    def worker(index):
+        barrier.wait()
+        try:
+            results[index] = scheduler.run(requests[index])
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def fake_model(feeds):
+    """逐样本独立的确定性计算，组批与否结果应逐位相同"""
+    x = feeds["x"]
+    return {"double": x * 2.0, "sum": x.reshape(x.shape[0], -1).sum(axis=1, keepdims=True)}
+
+
+def test_batched_results_equal_sequential_runs():
+    rng = np.random.default_rng(0)
+    # 混合单样本与双样本请求，检查拼接与拆分的偏移
+    requests = [{"x": rng.random((1 + i % 2, 3, 4, 4)).astype(np.float32)} for i in range(12)]
+    expected = [fake_model(request) for request in requests]
+
+    scheduler = BatchScheduler(fake_model, max_batch_size=8, max_wait_ms=100)
+    scheduler.start()
+    try:
+        results, errors = run_concurrently(scheduler, requests)
+    finally:
+        scheduler.stop()
+
+    assert errors == [None] * len(requests)
+    for result, reference in zip(results, expected):
+        assert result.keys() == reference.keys()
+        for name in reference:
+            np.testing.assert_array_equal(result[name], reference[name])
+    stats = scheduler.stats()
+    assert stats["items"] == sum(request["x"].shape[0] for request in requests)
+    assert stats["batches"] < len(requests)
+    assert max(int(size) for size in stats["batch_size_histogram"]) <= 8
+
+
+def test_batch_failure_is_raised_to_every_caller():
+    def broken(feeds):
+        raise RuntimeError("session failed")
+
+    scheduler = BatchScheduler(broken, max_batch_size=4, max_wait_ms=50)
+    scheduler.start()
+    try:
+        _, errors = run_concurrently(scheduler, [{"x": np.zeros((1, 1), np.float32)} for _ in range(4)])
+    finally:
+        scheduler.stop()
+    assert all(isinstance(e, RuntimeError) for e in errors)
+
+
+def test_lone_request_does_not_wait_out_the_window():
+    scheduler = BatchScheduler(fake_model, max_batch_size=8, max_wait_ms=500)
+    scheduler.start()
+    try:
+        for _ in range(3):
+            start = time.perf_counter()
+            scheduler.run({"x": np.ones((1, 3, 4, 4), np.float32)})
+            assert time.perf_counter() - start < 0.1
+    finally:
+        scheduler.stop()
+    assert scheduler.stats()["batch_size_histogram"] == {"1": 3}
+
+
+def test_onnx_batched_inference_matches_single_runs(model_path):
+    from app.services.onnx_service import ONNXService
+    service = ONNXService((INPUT_SIZE, INPUT_SIZE), model_path=model_path, name="batch-test")
+    assert service.load_model(model_path)
+    if service.scheduler is None:
+        pytest.skip("BATCH_MAX_SIZE 为1，未启用组批")
+    try:
+        rng = np.random.default_rng(1)
+        shape = (1, 3, INPUT_SIZE, INPUT_SIZE)
+        requests = [{"img": rng.standard_normal(shape).astype(np.float32),
+                     "gerber": rng.standard_normal(shape).astype(np.float32)} for _ in range(6)]
+        expected = [service.run_batch(request) for request in requests]
+        results, errors = run_concurrently(service.scheduler, requests)
+        assert errors == [None] * len(requests)
+        for result, reference in zip(results, expected):
+            for name in service.output_names:
+                assert result[name].shape == reference[name].shape
+                np.testing.assert_allclose(result[name], reference[name], rtol=1e-4, atol=1e-5)
+    finally:
+        service.shutdown()
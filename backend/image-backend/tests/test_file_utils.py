@@ -0,0 +1,91 @@
+import asyncio
+import io
+import tracemalloc
+
+import pytest
+from fastapi import UploadFile
+
+from app.utils.file_utils import (UPLOAD_CHUNK_SIZE, UploadTooLargeError, read_image_upload,
+                                  sniff_image_format)
+
+
+class CountingFile(io.BytesIO):
+    """记录实际读取字节数的上传文件"""
+
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+def upload(data: bytes, size=None, filename: str = "image.jpg"):
+    return UploadFile(file=CountingFile(data), size=size, filename=filename)
+
+
+def read(file: UploadFile, max_size: int = None):
+    return asyncio.run(read_image_upload(file, max_size))
+
+
+@pytest.mark.parametrize("format, expected", [("JPEG", "jpeg"), ("PNG", "png"), ("BMP", "bmp"), ("WEBP", "webp")])
+def test_format_is_sniffed_from_content(make_image, format, expected):
+    data = make_image(64, 48, format=format)
+    assert sniff_image_format(data) == expected
+    # 扩展名与内容不符时以内容为准
+    buffer, image_format = read(upload(data, filename="wrong.txt"))
+    assert image_format == expected
+    assert bytes(buffer) == data
+
+
+def test_non_image_is_rejected_after_first_chunk():
+    data = b"%PDF-1.7" + b"\0" * (3 * UPLOAD_CHUNK_SIZE)
+    file = upload(data, filename="fake.jpg")
+    with pytest.raises(ValueError, match="不支持的文件格式"):
+        read(file)
+    assert file.file.bytes_read <= UPLOAD_CHUNK_SIZE
+
+
+def test_short_non_image_is_rejected():
+    with pytest.raises(ValueError):
+        read(upload(b"GIF89a"))
+
+
+def test_oversized_upload_stops_reading_at_limit(make_image):
+    data = make_image(64, 48) + b"\0" * (4 * UPLOAD_CHUNK_SIZE)
+    limit = UPLOAD_CHUNK_SIZE + 10
+    file = upload(data)
+    with pytest.raises(UploadTooLargeError):
+        read(file, max_size=limit)
+    # 超过上限的那一块读完即停止，不读取剩余部分
+    assert file.file.bytes_read <= limit + UPLOAD_CHUNK_SIZE
+    assert file.file.bytes_read < len(data)
+
+
+def test_declared_size_over_limit_is_rejected_without_reading(make_image):
+    data = make_image(64, 48)
+    file = upload(data, size=len(data))
+    with pytest.raises(UploadTooLargeError):
+        read(file, max_size=len(data) - 1)
+    assert file.file.bytes_read == 0
+
+
+def test_declared_size_mismatch_still_reads_everything(make_image):
+    data = make_image(64, 48)
+    for declared in (len(data) // 2, len(data) * 2):
+        buffer, image_format = read(upload(data, size=declared))
+        assert image_format == "jpeg"
+        assert bytes(buffer) == data
+
+
+def test_oversized_declared_size_is_rejected_before_allocating():
+    tracemalloc.start()
+    try:
+        with pytest.raises(UploadTooLargeError):
+            read(upload(b"\xff\xd8\xff" + b"\0" * 100, size=600 * 1024 * 1024), max_size=10 * 1024 * 1024)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 1024 * 1024
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from app.services.image_service import image_service
+from app.services.inference_executor import InferenceExecutor, InferenceQueueFullError
+
+
+def test_admit_rejects_beyond_workers_plus_queue():
+    executor = InferenceExecutor(max_workers=1, max_queue=1)
+
+    async def scenario():
+        release = asyncio.Event()
+        entered = []
+
+        async def hold():
+            async with executor.admit():
+                entered.append(True)
+                await release.wait()
+
+        holders = [asyncio.create_task(hold()) for _ in range(2)]
+        while len(entered) < 2:
+            await asyncio.sleep(0)
+
+        with pytest.raises(InferenceQueueFullError):
+            async with executor.admit():
+                pass
+        assert executor.stats()["rejected"] == 1
+
+        release.set()
+        await asyncio.gather(*holders)
+        # 名额释放后重新接纳
+        async with executor.admit():
+            assert executor.stats()["admitted"] == 1
+
+    asyncio.run(scenario())
+    assert executor.stats()["admitted"] == 0
+
+
+def test_process_returns_503_when_queue_full(client, make_image, monkeypatch):
+    executor = image_service.executor
+    monkeypatch.setattr(image_service, "result_cache", None)
+    monkeypatch.setattr(executor, "_admitted", executor.max_workers + executor.max_queue)
+    files = {"query": ("q.jpg", make_image(seed=1), "image/jpeg"),
+             "gerber": ("g.jpg", make_image(seed=2), "image/jpeg")}
+    response = client.post("/api/process?format=score", files=files)
+    assert response.status_code == 503
+
+
+def test_process_succeeds_with_free_capacity(client, make_image):
+    files = {"query": ("q.jpg", make_image(seed=1), "image/jpeg"),
+             "gerber": ("g.jpg", make_image(seed=2), "image/jpeg")}
+    response = client.post("/api/process?format=score", files=files)
+    assert response.status_code == 200
+    assert 0.0 <= response.json()["anomalyScore"] <= 1.0
@@ -0,0 +1,45 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Listener
+
+import numpy as np
+import pytest
+
+from app.services.inference_server import InferenceServer, _ServerConnection
+from app.services.model_registry import ModelRegistry
+from conftest import INPUT_SIZE
+
+
+@pytest.fixture
+def server(model_path):
+    """在本进程的线程中运行推理服务端（与推理进程中的处理逻辑相同）"""
+    registry = ModelRegistry({"test": {"path": model_path, "input_size": INPUT_SIZE}})
+    authkey = os.urandom(16)
+    listener = Listener(authkey=authkey)
+    threading.Thread(target=InferenceServer(registry).serve, args=(listener,), daemon=True).start()
+    yield registry, listener.address, authkey
+    registry.shutdown()
+
+
+def test_concurrent_runs_keep_counters_consistent(server):
+    registry, address, authkey = server
+    connection = _ServerConnection(address, authkey, slot_count=4, slot_size=1024 * 1024)
+    rng = np.random.default_rng(0)
+    inputs = [{"img": rng.standard_normal((1, 3, INPUT_SIZE, INPUT_SIZE)).astype(np.float32),
+               "gerber": rng.standard_normal((1, 3, INPUT_SIZE, INPUT_SIZE)).astype(np.float32)}
+              for _ in range(32)]
+    try:
+        connection.call("load", "test").result()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            outputs = list(pool.map(lambda feeds: connection.run("test", feeds), inputs))
+        stats = connection.stats()
+    finally:
+        connection.close()
+
+    assert stats["inflight"] == 0
+    assert stats["requests"] == len(inputs)
+    local = registry.get("test")
+    for feeds, output in zip(inputs, outputs):
+        expected = local.run_batch(feeds)
+        np.testing.assert_allclose(output["anomaly_pred"], expected["anomaly_pred"], rtol=1e-5, atol=1e-6)
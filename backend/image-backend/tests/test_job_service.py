@@ -0,0 +1,123 @@
+import base64
+import os
+import time
+import zipfile
+
+import pytest
+
+from app.config import settings
+from app.services.job_service import JobService, find_pairs, job_service
+
+
+def names_of(pairs):
+    return [(pair["name"], pair["query"], pair["gerber"]) for pair in pairs]
+
+
+def test_pairs_by_g_suffix():
+    pairs = find_pairs(["a.jpg", "aG.jpg", "b.png", "bg.png", "c.jpg"])
+    assert names_of(pairs) == [("a", "a.jpg", "aG.jpg"), ("b", "b.png", "bg.png")]
+
+
+def test_pairing_is_case_insensitive_and_mixes_extensions():
+    pairs = find_pairs(["Board1.JPG", "BOARD1G.png"])
+    assert names_of(pairs) == [("Board1", "Board1.JPG", "BOARD1G.png")]
+
+
+def test_pairs_only_within_the_same_directory():
+    pairs = find_pairs(["lot1/x.jpg", "lot1/xG.jpg", "lot2/y.jpg", "xG.jpg", "lot2/sub/yG.jpg"])
+    assert names_of(pairs) == [("lot1/x", "lot1/x.jpg", "lot1/xG.jpg")]
+
+
+def test_hidden_macos_and_unsupported_files_are_ignored():
+    pairs = find_pairs(["__MACOSX/a.jpg", "__MACOSX/aG.jpg", ".b.jpg", ".bG.jpg", "c.gif", "cG.gif",
+                        "d.jpg", "dG.jpg", "notes.txt"])
+    assert names_of(pairs) == [("d", "d.jpg", "dG.jpg")]
+
+
+def test_gerber_without_query_is_not_paired():
+    # "xG.jpg" 本身不会被当成查询图去找 "xGG.jpg"
+    assert find_pairs(["xG.jpg"]) == []
+
+
+def make_zip(path, files):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return path
+
+
+def test_archive_pairs_by_file_names(tmp_path):
+    path = make_zip(tmp_path / "a.zip", {"p/1.jpg": b"q", "p/1G.jpg": b"g", "p/2.jpg": b"q"})
+    assert names_of(JobService(str(tmp_path)).pairs_from_archive(str(path))) == [("p/1", "p/1.jpg", "p/1G.jpg")]
+
+
+def test_archive_manifest_paths_are_relative_to_manifest(tmp_path):
+    manifest = "name,query,gerber,gerber_id\nfirst,q1.jpg,ref.jpg,\nsecond,q2.jpg,,abc123\n"
+    path = make_zip(tmp_path / "m.zip", {"set/manifest.csv": manifest, "set/q1.jpg": b"q",
+                                         "set/q2.jpg": b"q", "set/ref.jpg": b"g"})
+    pairs = JobService(str(tmp_path)).pairs_from_archive(str(path))
+    assert pairs == [
+        {"name": "first", "query": "set/q1.jpg", "gerber": "set/ref.jpg", "gerber_id": None},
+        {"name": "second", "query": "set/q2.jpg", "gerber": None, "gerber_id": "abc123"},
+    ]
+
+
+@pytest.mark.parametrize("manifest, message", [
+    ("query,gerber\nq.jpg,missing.jpg\n", "不存在"),
+    ("query,gerber,gerber_id\nq.jpg,g.jpg,abc\n", "二选一"),
+    ("query,gerber\n,g.jpg\n", "需要 query"),
+])
+def test_archive_manifest_errors(tmp_path, manifest, message):
+    path = make_zip(tmp_path / "bad.zip", {"manifest.csv": manifest, "q.jpg": b"q", "g.jpg": b"g"})
+    with pytest.raises(ValueError, match=message):
+        JobService(str(tmp_path)).pairs_from_archive(str(path))
+
+
+def test_archive_without_pairs_or_not_a_zip(tmp_path):
+    service = JobService(str(tmp_path))
+    empty = make_zip(tmp_path / "empty.zip", {"a.jpg": b"q"})
+    with pytest.raises(ValueError, match="没有可配对"):
+        service.pairs_from_archive(str(empty))
+    not_zip = tmp_path / "x.zip"
+    not_zip.write_bytes(b"not a zip")
+    with pytest.raises(ValueError, match="不是有效的zip"):
+        service.pairs_from_archive(str(not_zip))
+
+
+def wait_finished(client, job_id: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        info = client.get(f"/api/jobs/{job_id}").json()
+        if info["status"] in ("completed", "failed", "cancelled"):
+            return info
+        time.sleep(0.05)
+    raise AssertionError(f"任务 {job_id} 未在 {timeout}s 内结束")
+
+
+def test_finished_job_deletes_archive_and_keeps_results(client, make_image, tmp_path):
+    path = make_zip(tmp_path / "lot.zip", {"b1.jpg": make_image(96, 96, seed=1), "b1G.jpg": make_image(96, 96, seed=2)})
+    with open(path, "rb") as f:
+        response = client.post("/api/jobs", files={"archive": ("lot.zip", f, "application/zip")})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    info = wait_finished(client, job_id)
+    assert info["status"] == "completed"
+    assert info["model"] == settings.DEFAULT_MODEL
+    assert not os.path.exists(job_service.archive_path(job_id))
+    assert info["results"][0]["status"] == "done"
+    assert client.get(f"/api/jobs/{job_id}/summary").status_code == 200
+
+
+def test_json_job_defaults_to_configured_model(client, make_image):
+    image = base64.b64encode(make_image(96, 96, seed=3)).decode()
+    response = client.post("/api/jobs/json", json={"pairs": [{"queryImage": image, "gerberImage": image}]})
+    assert response.status_code == 202
+    assert wait_finished(client, response.json()["job_id"])["model"] == settings.DEFAULT_MODEL
+
+
+def test_job_endpoints_are_refused_with_multiple_http_workers(client, monkeypatch):
+    monkeypatch.setattr(settings, "HTTP_WORKERS", 2)
+    assert client.post("/api/jobs/json", json={"pairs": []}).status_code == 501
+    assert client.get("/api/jobs").status_code == 501
+    assert client.get("/api/jobs/abc").status_code == 501
@@ -0,0 +1,69 @@
+import json
+import os
+
+from app.config import settings
+from app.services.model_registry import ModelRegistry, ModelSpec, load_model_manifest, process_rss
+from conftest import INPUT_SIZE
+
+
+def registry_of(model_path: str, names, limit_mb: int) -> ModelRegistry:
+    return ModelRegistry({name: {"path": model_path, "input_size": INPUT_SIZE} for name in names},
+                         memory_limit_mb=limit_mb)
+
+
+def test_resident_bytes_are_measured_at_load(model_path):
+    registry = registry_of(model_path, ["a"], 1024)
+    registry.get("a")
+    stats = registry.stats()
+    assert stats["models"]["a"]["resident_bytes"] >= os.path.getsize(model_path)
+    assert stats["resident_bytes"] == stats["models"]["a"]["resident_bytes"]
+    registry.shutdown()
+
+
+def test_least_recently_used_idle_model_is_evicted(model_path):
+    registry = registry_of(model_path, ["a", "b"], 0)
+    registry.get("a")
+    registry.get("b")
+    stats = registry.stats()
+    assert not stats["models"]["a"]["loaded"] and stats["models"]["b"]["loaded"]
+    assert stats["evictions"] == 1
+    registry.shutdown()
+
+
+def test_model_in_use_is_not_evicted(model_path):
+    registry = registry_of(model_path, ["a", "b"], 0)
+    with registry.acquire("a"):
+        registry.get("b")
+        assert registry.stats()["models"]["a"]["loaded"]
+    registry.shutdown()
+
+
+def test_estimate_without_rss_and_no_local_budget_for_remote_sessions(model_path, monkeypatch):
+    spec = ModelSpec("a", model_path, INPUT_SIZE)
+    monkeypatch.setattr(settings, "MODEL_MEMORY_FACTOR", 2.0)
+    assert ModelRegistry._measure(spec, 0) == 2 * os.path.getsize(model_path)
+    if process_rss():
+        assert ModelRegistry._measure(spec, process_rss()) >= os.path.getsize(model_path)
+    # 会话在推理进程中：HTTP 进程不计占用
+    monkeypatch.setattr(settings, "INFERENCE_SERVER_ADDRESS", "/tmp/inference.sock")
+    assert ModelRegistry._measure(spec, process_rss()) == 0
+
+
+def test_tiled_model_warms_up_the_tile_batch(model_path, monkeypatch):
+    monkeypatch.setattr(settings, "TILE_BATCH_SIZE", 11)
+    registry = ModelRegistry({"tiled": {"path": model_path, "input_size": INPUT_SIZE, "tiled": True}})
+    service = registry.get("tiled")
+    assert 11 in service.supported_batch_sizes()
+    assert 11 in service.warmup()
+    registry.shutdown()
+
+
+def test_manifest_paths_resolve_relative_to_the_manifest(tmp_path, monkeypatch):
+    directory = tmp_path / "quantized"
+    directory.mkdir()
+    (directory / "m.int8-static.onnx").write_bytes(b"onnx")
+    manifest = directory / "models.json"
+    manifest.write_text(json.dumps({"models": {"m-int8-static": {"path": "m.int8-static.onnx", "input_size": 64}}}))
+    monkeypatch.chdir(tmp_path.parent)
+    models = load_model_manifest(str(manifest))
+    assert models["m-int8-static"]["path"] == str(directory / "m.int8-static.onnx")
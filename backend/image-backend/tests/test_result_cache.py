@@ -0,0 +1,224 @@
+import asyncio
+import os
+
+import pytest
+
+from app.services.heatmap_service import heatmap_renderer
+from app.services.image_service import image_service
+from app.services.result_cache import ResultCache
+
+
+def make_result(score: float = 0.5, images: bool = False, fmt: str = "png"):
+    return {
+        "converted_bytes": b"converted" if images else None,
+        "anomaly_bytes": b"anomaly" if images else None,
+        "image_format": fmt if images else None,
+        "anomaly_score": score,
+        "defect_description": "描述",
+    }
+
+
+class Compute:
+    """计数的计算函数；release 之前一直阻塞，用于构造并发场景"""
+
+    def __init__(self, result=None, error: Exception = None):
+        self.result = result or make_result()
+        self.error = error
+        self.calls = 0
+        self.cancelled = False
+        self.release = None
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            if self.release is not None:
+                await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return dict(self.result)
+
+
+def new_cache(tmp_path=None) -> ResultCache:
+    return ResultCache(max_memory_bytes=1 << 20, disk_dir=str(tmp_path) if tmp_path else "",
+                       max_disk_bytes=1 << 20)
+
+
+def test_concurrent_requests_compute_once():
+    async def scenario():
+        cache = new_cache()
+        compute = Compute()
+        compute.release = asyncio.Event()
+        tasks = [asyncio.ensure_future(cache.get_or_compute("k", compute)) for _ in range(5)]
+        await asyncio.sleep(0)
+        compute.release.set()
+        results = await asyncio.gather(*tasks)
+        assert compute.calls == 1
+        assert all(r["anomaly_score"] == 0.5 for r in results)
+        assert cache.stats()["coalesced"] == 4
+        assert cache.stats()["inflight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelling_first_requester_keeps_other_waiters():
+    async def scenario():
+        cache = new_cache()
+        compute = Compute()
+        compute.release = asyncio.Event()
+        first = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        second = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        compute.release.set()
+        assert (await second)["anomaly_score"] == 0.5
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert compute.calls == 1
+        assert not compute.cancelled
+
+    asyncio.run(scenario())
+
+
+def test_cancelling_all_waiters_cancels_compute():
+    async def scenario():
+        cache = new_cache()
+        compute = Compute()
+        compute.release = asyncio.Event()
+        tasks = [asyncio.ensure_future(cache.get_or_compute("k", compute)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert compute.cancelled
+        assert cache.stats()["inflight"] == 0
+
+        # 之后的同键请求重新计算
+        retry = Compute(make_result(0.7))
+        assert (await cache.get_or_compute("k", retry))["anomaly_score"] == 0.7
+        assert retry.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_image_result_serves_later_score_requests():
+    async def scenario():
+        cache = new_cache()
+        await cache.get_or_compute("k", Compute(make_result(0.3, images=True)), images="png:1")
+        score = Compute()
+        result = await cache.get_or_compute("k", score)
+        assert score.calls == 0
+        assert result["anomaly_score"] == 0.3
+        assert result["converted_bytes"] is None and result["image_format"] is None
+
+    asyncio.run(scenario())
+
+
+def test_score_result_does_not_satisfy_image_requests():
+    async def scenario():
+        cache = new_cache()
+        await cache.get_or_compute("k", Compute(make_result(0.3)))
+        with_images = Compute(make_result(0.3, images=True))
+        result = await cache.get_or_compute("k", with_images, images="png:1")
+        assert with_images.calls == 1
+        assert result["converted_bytes"] == b"converted"
+
+        # 带图片的结果不覆盖仅分数条目之外的其他编码
+        webp = Compute(make_result(0.3, images=True, fmt="webp"))
+        assert (await cache.get_or_compute("k", webp, images="webp:80"))["image_format"] == "webp"
+        assert webp.calls == 1
+        png = Compute()
+        assert (await cache.get_or_compute("k", png, images="png:1"))["image_format"] == "png"
+        assert png.calls == 0
+
+    asyncio.run(scenario())
+
+
+def test_score_request_coalesces_onto_inflight_image_request():
+    async def scenario():
+        cache = new_cache()
+        with_images = Compute(make_result(0.4, images=True))
+        with_images.release = asyncio.Event()
+        image_task = asyncio.ensure_future(cache.get_or_compute("k", with_images, images="png:1"))
+        await asyncio.sleep(0)
+        score = Compute()
+        score_task = asyncio.ensure_future(cache.get_or_compute("k", score))
+        await asyncio.sleep(0)
+        # 带图片的请求断开后，仅分数的等待者仍拿到结果
+        image_task.cancel()
+        await asyncio.sleep(0)
+        with_images.release.set()
+        result = await score_task
+        assert score.calls == 0 and with_images.calls == 1
+        assert result["anomaly_score"] == 0.4
+
+    asyncio.run(scenario())
+
+
+def test_failures_propagate_and_are_not_cached():
+    async def scenario():
+        cache = new_cache()
+        failing = Compute(error=RuntimeError("推理失败"))
+        failing.release = asyncio.Event()
+        tasks = [asyncio.ensure_future(cache.get_or_compute("k", failing)) for _ in range(3)]
+        await asyncio.sleep(0)
+        failing.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert failing.calls == 1
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+        retry = Compute()
+        assert (await cache.get_or_compute("k", retry))["anomaly_score"] == 0.5
+        assert retry.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_disk_layer_survives_restart(tmp_path):
+    async def fill():
+        cache = new_cache(tmp_path)
+        await cache.get_or_compute("k", Compute(make_result(0.6, images=True)), images="png:1")
+
+    async def read():
+        cache = new_cache(tmp_path)
+        compute = Compute()
+        image = await cache.get_or_compute("k", compute, images="png:1")
+        score = await cache.get_or_compute("k", compute)
+        assert compute.calls == 0
+        assert image["anomaly_bytes"] == b"anomaly"
+        assert score["anomaly_score"] == 0.6 and score["anomaly_bytes"] is None
+        assert cache.stats()["disk_hits"] >= 1
+
+    asyncio.run(fill())
+    asyncio.run(read())
+
+
+def test_make_key_depends_on_model_identity_and_threshold():
+    key = ResultCache.make_key(b"query", b"gerber", "test", threshold=0.5)
+    assert key == ResultCache.make_key(b"query", b"gerber", "test", threshold=0.5)
+    assert key != ResultCache.make_key(b"query", b"gerber", "test", threshold=0.6)
+    assert key != ResultCache.make_key(b"query", b"gerber", "test:/models/test.onnx:1", threshold=0.5)
+
+
+def test_model_file_and_colormap_changes_miss_the_cache(client, model_path, make_image, monkeypatch):
+    cache = image_service.result_cache
+    query, gerber = make_image(96, 96, seed=11), make_image(96, 96, seed=12)
+
+    def inspect():
+        before = cache.stats()["misses"]
+        asyncio.run(image_service.inspect_pcb_bytes(query, gerber, "test"))
+        return cache.stats()["misses"] - before
+
+    assert inspect() == 1
+    assert inspect() == 0
+    # 热力图色表改变：带图片的结果需要重新生成
+    monkeypatch.setattr(heatmap_renderer, "default_colormap", "viridis")
+    assert inspect() == 1
+    # 模型文件被替换（修改时间改变）：旧结果不再命中
+    stat = os.stat(model_path)
+    os.utime(model_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert inspect() == 1
@@ -0,0 +1,142 @@
+import asyncio
+import errno
+import io
+import os
+
+import pytest
+from fastapi import UploadFile
+
+from app.config import settings
+from app.services.upload_store import UploadStore
+from app.utils.file_utils import UploadTooLargeError
+
+
+def upload(data: bytes, filename: str = "image.png"):
+    return UploadFile(file=io.BytesIO(data), size=len(data), filename=filename)
+
+
+def save(store: UploadStore, data: bytes, role: str = "query", max_size: int = None):
+    return asyncio.run(store.save(upload(data), role, max_size))
+
+
+@pytest.fixture
+def png(make_image):
+    return make_image(32, 32, seed=1, format="PNG")
+
+
+def test_identical_uploads_share_one_blob(tmp_path, png):
+    store = UploadStore(str(tmp_path))
+    first = save(store, png)
+    second = save(store, png)
+
+    assert not first["deduplicated"] and second["deduplicated"]
+    assert first["task_id"] != second["task_id"]
+    assert first["sha256"] == second["sha256"]
+    assert os.path.samefile(first["path"], second["path"])
+    assert open(second["path"], "rb").read() == png
+    assert store.stats()["deduplicated_bytes"] == len(png)
+
+
+def test_copy_fallback_without_hard_links(tmp_path, png, monkeypatch):
+    def no_link(src, dst):
+        raise OSError(errno.EXDEV, "硬链接不可用")
+
+    monkeypatch.setattr(os, "link", no_link)
+    store = UploadStore(str(tmp_path))
+    first = save(store, png)
+    second = save(store, png)
+
+    assert not store.stats()["hard_links"]
+    assert not os.path.samefile(first["path"], second["path"])
+    assert open(first["path"], "rb").read() == png
+    assert open(second["path"], "rb").read() == png
+
+
+def test_transient_link_errors_keep_hard_links(tmp_path, png, monkeypatch):
+    store = UploadStore(str(tmp_path))
+    first = save(store, png)
+    link = os.link
+    calls = []
+
+    def flaky_link(src, dst):
+        calls.append(src)
+        if len(calls) == 1:
+            os.remove(src)  # blob 在存在性检查之后消失
+        elif len(calls) == 3:
+            raise OSError(errno.EMLINK, "链接数已满")
+        return link(src, dst)
+
+    monkeypatch.setattr(os, "link", flaky_link)
+    second = save(store, png)
+    third = save(store, png)
+    fourth = save(store, png)
+
+    # blob 消失时用本次上传的内容重新写入；EMLINK 只影响这一次
+    assert not second["deduplicated"] and third["deduplicated"]
+    assert open(second["path"], "rb").read() == png
+    assert not os.path.samefile(second["path"], third["path"])
+    assert os.path.samefile(second["path"], fourth["path"])
+    assert store.stats()["hard_links"]
+    assert open(first["path"], "rb").read() == png
+
+
+def test_rejected_upload_leaves_no_temporary_file(tmp_path, png):
+    store = UploadStore(str(tmp_path))
+    with pytest.raises(ValueError):
+        save(store, b"not an image" * 100)
+    with pytest.raises(UploadTooLargeError):
+        save(store, png, max_size=len(png) - 1)
+    assert os.listdir(store.blob_dir) == []
+
+
+def test_sweep_removes_expired_uploads_and_orphan_blobs(tmp_path, png, make_image, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_RETENTION_HOURS", 1)
+    monkeypatch.setattr(settings, "UPLOAD_QUOTA_MB", 0)
+    store = UploadStore(str(tmp_path))
+    stored = save(store, png)
+    fresh = save(store, make_image(32, 32, seed=2, format="PNG"))
+    blob = os.path.join(store.blob_dir, stored["sha256"][:2], f"{stored['sha256']}.png")
+    now = os.stat(stored["path"]).st_mtime + 7200
+    os.utime(fresh["path"], (now, now))
+
+    result = store.sweep(now=now)
+
+    assert not os.path.exists(stored["path"])
+    assert not os.path.exists(blob)
+    assert os.path.exists(fresh["path"])
+    assert result["files_removed"] == 2
+    assert result["bytes_freed"] == len(png)
+
+
+def test_sweep_keeps_files_from_before_the_store(tmp_path, png, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_RETENTION_HOURS", 1)
+    monkeypatch.setattr(settings, "UPLOAD_QUOTA_MB", 0)
+    legacy = {}
+    for name in ("original", "processed"):
+        os.makedirs(tmp_path / name)
+        legacy[name] = tmp_path / name / f"legacy_{name}.png"
+        legacy[name].write_bytes(png)
+        os.utime(legacy[name], (0, 0))
+
+    store = UploadStore(str(tmp_path))
+    store.start()
+    stored = save(store, png)
+    store.sweep(now=os.stat(stored["path"]).st_mtime + 7200)
+
+    assert all(path.exists() for path in legacy.values())
+    assert not os.path.exists(stored["path"])
+
+
+def test_sweep_enforces_quota_from_oldest(tmp_path, make_image, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_RETENTION_HOURS", 0)
+    monkeypatch.setattr(settings, "UPLOAD_QUOTA_MB", 1)
+    store = UploadStore(str(tmp_path))
+    uploads = [save(store, make_image(512, 256, seed=i, format="BMP")) for i in range(3)]
+    for offset, stored in enumerate(uploads):
+        mtime = os.stat(stored["path"]).st_mtime + offset
+        os.utime(stored["path"], (mtime, mtime))
+
+    store.sweep()
+
+    assert not os.path.exists(uploads[0]["path"])
+    assert os.path.exists(uploads[2]["path"])